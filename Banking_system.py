@@ -1,100 +1,40 @@
-import sqlite3
-import random
-import re
-import datetime
 from getpass import getpass
+import os
 import sys
 
+from bank_service import (BankingService, DB_FILE, check_name, check_phone,
+                          check_email, check_pwd, check_dob)
+from money import MIN_BALANCE, MIN_BALANCE_CENTS, to_cents, fmt_money
+from metrics import Metrics
+from shards import ShardedBank
+import velocity
+
 # Using SQLite3 due to installation issues in MySQL
+# All the real work lives in bank_service.py, this is just the menu on top
 
 class BankingSystem:
-    def __init__(self):
-        # Connect to db
-        self.db = sqlite3.connect('banking_system.db')
-        self.db_cur = self.db.cursor()
-        self.setup_tables()
+    def __init__(self, db_path=DB_FILE, shards=None):
+        # BANK_METRICS=file turns on timing, see metrics.py
+        metrics = Metrics.from_env()
+        if shards is None:
+            shards = int(os.environ.get('BANK_SHARDS', 1))
+        # BANK_SNAPSHOT_AGE=seconds sends listings and exports to a copy of
+        # the db at most that old, see snapshot.py
+        snapshot_age = float(os.environ.get('BANK_SNAPSHOT_AGE', 0)) or None
+        # BANK_SHARDS=N splits the bank over N files, see shards.py
+        # BANK_LIMITS holds debits and transfers to velocity limits, off
+        # when it isn't set, see velocity.py
+        limits = velocity.from_env()
+        # An unsharded bank also runs due standing orders, see standing.py
+        if shards > 1:
+            self.service = ShardedBank(db_path, shards, metrics=metrics,
+                                       snapshot_age=snapshot_age, limits=limits)
+        else:
+            self.service = BankingService(db_path, metrics=metrics,
+                                          snapshot_age=snapshot_age, limits=limits,
+                                          scheduler=True)
         self.logged_user = None
-
-
-    def setup_tables(self):
-        # Make tables if they don't exist
-        self.db_cur.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                acc_num TEXT UNIQUE NOT NULL,
-                dob DATE NOT NULL,
-                city TEXT NOT NULL,
-                pwd TEXT NOT NULL,
-                cash_balance REAL NOT NULL,
-                phone TEXT NOT NULL,
-                email TEXT NOT NULL
-            )
-        ''')
-
-        # Track logins
-        self.db_cur.execute('''
-            CREATE TABLE IF NOT EXISTS login_info (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                acc_num TEXT NOT NULL,
-                login_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-                logout_time DATETIME,
-                FOREIGN KEY (acc_num) REFERENCES users(acc_num)
-            )
-        ''')
-
-
-        # Money stuff
-        self.db_cur.execute('''
-            CREATE TABLE IF NOT EXISTS money_moves (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                acc_num TEXT NOT NULL,
-                move_type TEXT NOT NULL,
-                amount REAL NOT NULL,
-                to_acc TEXT,
-                when_moved DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (acc_num) REFERENCES users(acc_num)
-            )
-        ''')
-        
-        self.db.commit()
-
-
-    def check_name(self, name):
-        if not name or not re.match("^[A-Za-z ]{2,50}$", name):
-            raise ValueError("Bad name! Letters only, 2-50 chars")
-        return True
-
-    def check_phone(self, num):
-        if not re.match("^[0-9]{10}$", num):
-            raise ValueError("Phone number should be 10 digits!")
-        return True
-
-    def check_email(self, email):
-        if not re.match(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", email):
-            raise ValueError("That's not a valid email!")
-        return True
-
-
-    def check_pwd(self, pwd):
-        if len(pwd) < 8:
-            raise ValueError("Password too short! Need 8+ chars")
-        if not re.search("[A-Z]", pwd):
-            raise ValueError("Need an uppercase letter!")
-        if not re.search("[a-z]", pwd):
-            raise ValueError("Need a lowercase letter!")
-        if not re.search("[0-9]", pwd):
-            raise ValueError("Need a number!")
-        if not re.search("[!@#$%^&*(),.?\":{}|<>]", pwd):
-            raise ValueError("Need a special character!")
-        return True
-
-    def make_acc_num(self):
-        while True:
-            num = ''.join([str(random.randint(0, 9)) for _ in range(10)])
-            self.db_cur.execute("SELECT 1 FROM users WHERE acc_num = ?", (num,))
-            if not self.db_cur.fetchone():
-                return num
+        self.token = None
 
 
     def add_user(self):
@@ -102,40 +42,34 @@ class BankingSystem:
             print("\n=== Sign Up ===")
             
             name = input("Your name: ")
-            self.check_name(name)
+            check_name(name)
             
             dob = input("When were you born? (YYYY-MM-DD): ")
-            datetime.datetime.strptime(dob, '%Y-%m-%d')
+            check_dob(dob)
             
             city = input("Which city?: ")
             if not city:
                 raise ValueError("Need a city!")
             
             pwd = getpass("Pick a password: ")
-            self.check_pwd(pwd)
+            check_pwd(pwd)
             
-            cash = float(input("Initial deposit (min 2000): "))
-            if cash < 2000:
-                raise ValueError("Need at least 2000 to open account!")
+            cash = to_cents(input(f"Initial deposit (min {MIN_BALANCE}): "))
+            if cash < MIN_BALANCE_CENTS:
+                raise ValueError(f"Need at least {MIN_BALANCE} to open account!")
             
             phone = input("Your phone number: ")
-            self.check_phone(phone)
+            check_phone(phone)
             
             email = input("Your email: ")
-            self.check_email(email)
+            check_email(email)
             
-            acc_num = self.make_acc_num()
-            
-            self.db_cur.execute('''
-                INSERT INTO users (name, acc_num, dob, city, pwd, cash_balance, 
-                                 phone, email)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (name, acc_num, dob, city, pwd, cash, phone, email))
-            
-            self.db.commit()
+            res = self.service.open_account(name, dob, city, pwd, cash, phone, email)
+            if not res['ok']:
+                raise ValueError(res['error'])
             
             print(f"\nWelcome aboard!")
-            print(f"Your account number is: {acc_num}")
+            print(f"Your account number is: {res['acc_num']}")
             
         except Exception as e:
             print(f"Oops: {str(e)}")
@@ -143,273 +77,284 @@ class BankingSystem:
         return True
 
 
-    def show_users(self):
-        self.db_cur.execute("SELECT acc_num, name, city, phone, email, cash_balance FROM users")
-        users = self.db_cur.fetchall()
-        
-        if not users:
-            print("\nNo users yet!")
-            return
-        
-        print("\n=== Users List ===")
-        print(f"{'Account #':<15} {'Name':<20} {'City':<15} {'Phone':<15} {'Email':<25} {'Balance':<10}")
-        print("-" * 100)
-        
-        for u in users:
-            acc, name, city, phone, email, cash = u
-            print(f"{acc:<15} {name:<20} {city:<15} {phone:<15} {email:<25} {cash:<10.2f}")
+    def ask_user_filters(self):
+        filters = {}
+        city = input("Only city (Enter for all): ")
+        if city:
+            filters['city'] = city
+        low = input("Min balance (Enter for none): ")
+        if low:
+            filters['min_balance'] = to_cents(low)
+        high = input("Max balance (Enter for none): ")
+        if high:
+            filters['max_balance'] = to_cents(high)
+        order = input("Sort by (acc_num/name/city/cash_balance) [acc_num]: ")
+        if order:
+            filters['order_by'] = order
+        return filters
 
 
-    def login(self):
+    def show_users(self):
         try:
-            print("\n=== Login ===")
-            acc = input("Account number: ")
-            pwd = getpass("Password: ")
-            
-            self.db_cur.execute("""
-                SELECT * FROM users 
-                WHERE acc_num = ? AND pwd = ?
-            """, (acc, pwd))
-            
-            user = self.db_cur.fetchone()
-            if not user:
-                print("Wrong account number or password!")
-                return False
-            
-            self.logged_user = user
+            filters = self.ask_user_filters()
+            users = self.service.iter_users(**filters)
             
-            # Log it
-            self.db_cur.execute("""
-                INSERT INTO login_info (acc_num) VALUES (?)
-            """, (acc,))
-            self.db.commit()
+            shown = 0
+            for u in users:
+                if not shown:
+                    print("\n=== Users List ===")
+                    print(f"{'Account #':<15} {'Name':<20} {'City':<15} {'Phone':<15} {'Email':<25} {'Balance':<10}")
+                    print("-" * 100)
+                print(f"{u['acc_num']:<15} {u['name']:<20} {u['city']:<15} {u['phone']:<15} {u['email']:<25} {fmt_money(u['cash_balance']):<10}")
+                shown += 1
             
-            return True
+            if not shown:
+                print("\nNo users yet!")
             
-        except Exception as e:
-            print(f"Login failed: {str(e)}")
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+
+
+    def export_users(self):
+        try:
+            path = input("\nExport to file: ")
+            fmt = input("Format (csv/jsonl) [csv]: ") or 'csv'
+            filters = self.ask_user_filters()
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            return
+        
+        res = self.service.export_users(path, fmt, **filters)
+        if not res['ok']:
+            print(f"Error: {res['error']}")
+            return
+        print(f"Wrote {res['rows']} users to {res['path']}")
+
+
+    def login(self):
+        print("\n=== Login ===")
+        acc = input("Account number: ")
+        pwd = getpass("Password: ")
+        
+        res = self.service.login(acc, pwd)
+        if not res['ok']:
+            print(res['error'])
             return False
+        
+        self.logged_user = res['user']
+        self.token = res['token']
+        return True
 
     def show_balance(self):
-        print(f"\nYou have: ${self.logged_user[6]:.2f}")
+        res = self.service.balance(self.logged_user['acc_num'])
+        if not res['ok']:
+            print(f"Error: {res['error']}")
+            return
+        print(f"\nYou have: ${fmt_money(res['balance'])}")
 
 
     def credit_amount(self):
         try:
-            amt = float(input("\nHow much to deposit? $"))
-            if amt <= 0:
-                raise ValueError("Amount needs to be positive!")
-            
-            new_total = self.logged_user[6] + amt
-            
-            self.db_cur.execute("""
-                UPDATE users 
-                SET cash_balance = ? 
-                WHERE acc_num = ?
-            """, (new_total, self.logged_user[2]))
-            
-            self.db_cur.execute("""
-                INSERT INTO money_moves (acc_num, move_type, amount)
-                VALUES (?, 'CREDIT', ?)
-            """, (self.logged_user[2], amt))
-            
-            self.db.commit()
-            print(f"Added ${amt:.2f}")
-            print(f"New balance: ${new_total:.2f}")
-            
-            self.logged_user = list(self.logged_user)
-            self.logged_user[6] = new_total
-            
+            amt = to_cents(input("\nHow much to deposit? $"))
         except ValueError as e:
             print(f"Error: {str(e)}")
-        except Exception as e:
-            print(f"Something went wrong: {str(e)}")
+            return
+        
+        res = self.service.credit(self.logged_user['acc_num'], amt)
+        if not res['ok']:
+            print(f"Error: {res['error']}")
+            return
+        
+        print(f"Added ${fmt_money(amt)}")
+        print(f"New balance: ${fmt_money(res['balance'])}")
+        self.logged_user['cash_balance'] = res['balance']
 
 
     def debit_amount(self):
         try:
-            amt = float(input("\nHow much to withdraw? $"))
-            if amt <= 0:
-                raise ValueError("Amount needs to be positive!")
-            
-            if amt > self.logged_user[6]:
-                raise ValueError("Not enough money!")
-            
-            if self.logged_user[6] - amt < 2000:
-                raise ValueError("Can't go below $2000!")
-            
-            new_total = self.logged_user[6] - amt
-            
-            self.db_cur.execute("""
-                UPDATE users 
-                SET cash_balance = ? 
-                WHERE acc_num = ?
-            """, (new_total, self.logged_user[2]))
-            
-            self.db_cur.execute("""
-                INSERT INTO money_moves (acc_num, move_type, amount)
-                VALUES (?, 'DEBIT', ?)
-            """, (self.logged_user[2], amt))
-            
-            self.db.commit()
-            print(f"Withdrew ${amt:.2f}")
-            print(f"New balance: ${new_total:.2f}")
-            
-            self.logged_user = list(self.logged_user)
-            self.logged_user[6] = new_total
-            
+            amt = to_cents(input("\nHow much to withdraw? $"))
         except ValueError as e:
             print(f"Error: {str(e)}")
-        except Exception as e:
-            print(f"Something went wrong: {str(e)}")
+            return
+        
+        res = self.service.debit(self.logged_user['acc_num'], amt)
+        if not res['ok']:
+            print(f"Error: {res['error']}")
+            return
+        
+        print(f"Withdrew ${fmt_money(amt)}")
+        print(f"New balance: ${fmt_money(res['balance'])}")
+        self.logged_user['cash_balance'] = res['balance']
 
 
     def transfer_money(self):
         try:
             to_acc = input("\nAccount number to send to: ")
-            
-            self.db_cur.execute("SELECT acc_num, name FROM users WHERE acc_num = ?", 
-                              (to_acc,))
-            receiver = self.db_cur.fetchone()
-            
-            if not receiver:
-                raise ValueError("Account not found!")
-            
-            if to_acc == self.logged_user[2]:
+            if to_acc == self.logged_user['acc_num']:
                 raise ValueError("Can't send money to yourself!")
+            if not self.service.get_user(to_acc)['ok']:
+                raise ValueError("Account not found!")
             
-            amt = float(input("How much to send? $"))
-            if amt <= 0:
-                raise ValueError("Amount needs to be positive!")
-            
-            if amt > self.logged_user[6]:
-                raise ValueError("Not enough money!")
-            
-            if self.logged_user[6] - amt < 2000:
-                raise ValueError("Can't go below $2000!")
-            
-            new_total = self.logged_user[6] - amt
-            self.db_cur.execute("""
-                UPDATE users 
-                SET cash_balance = ? 
-                WHERE acc_num = ?
-            """, (new_total, self.logged_user[2]))
-            
-            self.db_cur.execute("""
-                UPDATE users 
-                SET cash_balance = cash_balance + ? 
-                WHERE acc_num = ?
-            """, (amt, to_acc))
-            
-            self.db_cur.execute("""
-                INSERT INTO money_moves (acc_num, move_type, amount, to_acc)
-                VALUES (?, 'TRANSFER', ?, ?)
-            """, (self.logged_user[2], amt, to_acc))
-            
-            self.db.commit()
-            print(f"Sent ${amt:.2f} to account {to_acc}")
-            print(f"New balance: ${new_total:.2f}")
-            
-            self.logged_user = list(self.logged_user)
-            self.logged_user[6] = new_total
+            amt = to_cents(input("How much to send? $"))
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            return
+        
+        res = self.service.transfer(self.logged_user['acc_num'], to_acc, amt)
+        if not res['ok']:
+            print(f"Error: {res['error']}")
+            return
+        
+        print(f"Sent ${fmt_money(amt)} to account {to_acc}")
+        print(f"New balance: ${fmt_money(res['balance'])}")
+        self.logged_user['cash_balance'] = res['balance']
+
+
+    def show_statement(self):
+        start = input("\nFrom date (YYYY-MM-DD, Enter for all): ")
+        end = input("To date (YYYY-MM-DD, Enter for today): ")
+        acc = self.logged_user['acc_num']
+        
+        try:
+            pages = self.service.iter_statement(acc, start, end, page_size=20)
+            
+            print("\n=== Statement ===")
+            print(f"{'When':<20} {'Type':<10} {'In/Out':<7} {'Amount':>12}  {'Other account':<15}")
+            print("-" * 70)
+            
+            shown = 0
+            for page in pages:
+                for m in page:
+                    other = m['to_acc'] if m['direction'] == 'OUT' else m['acc_num']
+                    if m['move_type'] != 'TRANSFER':
+                        other = ''
+                    print(f"{m['when_moved']:<20} {m['move_type']:<10} {m['direction']:<7} {fmt_money(m['amount']):>12}  {other:<15}")
+                shown += len(page)
+                if input("Enter for more, q to stop: ").lower() == 'q':
+                    break
+            
+            if not shown:
+                print("Nothing in that range!")
             
         except ValueError as e:
             print(f"Error: {str(e)}")
-        except Exception as e:
-            print(f"Transfer failed: {str(e)}")
+
+
+    def standing_orders(self):
+        acc = self.logged_user['acc_num']
+        res = self.service.standing_orders(acc)
+        if not res['ok']:
+            print(f"Error: {res['error']}")
+            return
+
+        print("\n=== Standing Orders ===")
+        if not res['orders']:
+            print("None yet!")
+        for o in res['orders']:
+            print(f"#{o['id']:<6} ${fmt_money(o['amount']):>12} to {o['to_acc']:<12} every {o['every']:<6} next {o['next_run']}")
+            if o['last_error']:
+                print(f"        last try failed: {o['last_error']}")
+
+        choice = input("\na: add, c: cancel, Enter to go back: ").lower()
+        try:
+            if choice == 'a':
+                to_acc = input("Account number to send to: ")
+                amt = to_cents(input("How much each time? $"))
+                every = input("Every day, week or month? ").strip().lower()
+                start = input("First one on (YYYY-MM-DD, Enter for now): ").strip()
+                res = self.service.add_standing_order(acc, to_acc, amt, every, start or None)
+                if res['ok']:
+                    print(f"Standing order #{res['order_id']} set, first one {res['next_run']}")
+            elif choice == 'c':
+                res = self.service.cancel_standing_order(acc, int(input("Order #: ").lstrip('#')))
+                if res['ok']:
+                    print("Cancelled")
+            else:
+                return
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            return
+        if not res['ok']:
+            print(f"Error: {res['error']}")
+
+
+    def apply_batch(self, moves, chunk_size=500):
+        # Amounts in cents. Returns (number applied, [(row index, reason), ...])
+        res = self.service.apply_batch(moves, chunk_size)
+        if not res['ok']:
+            raise ValueError(res['error'])
+        return res['applied'], res['rejected']
 
 
     def change_pwd(self):
         try:
             old_pwd = getpass("\nCurrent password: ")
-            if old_pwd != self.logged_user[5]:
-                raise ValueError("Wrong password!")
             
             new_pwd = getpass("New password: ")
-            self.check_pwd(new_pwd)
+            check_pwd(new_pwd)
             
-            check_pwd = getpass("Type it again: ")
-            if new_pwd != check_pwd:
+            again = getpass("Type it again: ")
+            if new_pwd != again:
                 raise ValueError("Passwords don't match!")
             
-            self.db_cur.execute("""
-                UPDATE users 
-                SET pwd = ? 
-                WHERE acc_num = ?
-            """, (new_pwd, self.logged_user[2]))
+            res = self.service.change_pwd(self.logged_user['acc_num'], old_pwd, new_pwd)
+            if not res['ok']:
+                raise ValueError(res['error'])
             
-            self.db.commit()
             print("Password updated!")
             
-            self.logged_user = list(self.logged_user)
-            self.logged_user[5] = new_pwd
-            
         except ValueError as e:
             print(f"Error: {str(e)}")
-        except Exception as e:
-            print(f"Couldn't change password: {str(e)}")
 
 
     def update_info(self):
         try:
             print("\n=== Update Info ===")
             print("Hit Enter to keep current info")
+            user = self.logged_user
             
-            name = input(f"Name [{self.logged_user[1]}]: ") or self.logged_user[1]
-            self.check_name(name)
+            name = input(f"Name [{user['name']}]: ") or user['name']
+            check_name(name)
             
-            city = input(f"City [{self.logged_user[4]}]: ") or self.logged_user[4]
+            city = input(f"City [{user['city']}]: ") or user['city']
             
-            phone = input(f"Phone [{self.logged_user[7]}]: ") or self.logged_user[7]
-            self.check_phone(phone)
+            phone = input(f"Phone [{user['phone']}]: ") or user['phone']
+            check_phone(phone)
             
-            email = input(f"Email [{self.logged_user[8]}]: ") or self.logged_user[8]
-            self.check_email(email)
+            email = input(f"Email [{user['email']}]: ") or user['email']
+            check_email(email)
             
-            self.db_cur.execute("""
-                UPDATE users 
-                SET name = ?, city = ?, phone = ?, email = ?
-                WHERE acc_num = ?
-            """, (name, city, phone, email, self.logged_user[2]))
+            res = self.service.update_info(user['acc_num'], name=name, city=city,
+                                           phone=phone, email=email)
+            if not res['ok']:
+                raise ValueError(res['error'])
             
-            self.db.commit()
             print("Info updated!")
-            
-            self.logged_user = list(self.logged_user)
-            self.logged_user[1] = name
-            self.logged_user[4] = city
-            self.logged_user[7] = phone
-            self.logged_user[8] = email
+            self.logged_user = res['user']
             
         except ValueError as e:
             print(f"Error: {str(e)}")
-        except Exception as e:
-            print(f"Update failed: {str(e)}")
 
 
     def logout(self):
-        try:
-            if self.logged_user:
-                self.db_cur.execute("""
-                    UPDATE login_info 
-                    SET logout_time = CURRENT_TIMESTAMP 
-                    WHERE acc_num = ? 
-                    AND logout_time IS NULL
-                """, (self.logged_user[2],))
-                self.db.commit()
-                
-                self.logged_user = None
-                print("\nSee ya!")
-                return True
-        except Exception as e:
-            print(f"Logout problem: {str(e)}")
-        return False
+        if not self.logged_user:
+            return False
+        
+        res = self.service.logout(self.logged_user['acc_num'], self.token)
+        if not res['ok']:
+            print(f"Logout problem: {res['error']}")
+            return False
+        
+        self.logged_user = None
+        self.token = None
+        print("\nSee ya!")
+        return True
 
 
     def close_db(self):
         if self.logged_user:
             self.logout()
-        self.db.close()
+        self.service.close_all()
 
 
 def main():
@@ -421,9 +366,10 @@ def main():
             print("1. New Account")
             print("2. Show Users")
             print("3. Login")
-            print("4. Exit")
+            print("4. Export Users")
+            print("5. Exit")
             
-            choice = input("\nWhat do you want to do? (1-4): ")
+            choice = input("\nWhat do you want to do? (1-5): ")
             
             if choice == '1':
                 bank.add_user()
@@ -433,6 +379,8 @@ def main():
                 if bank.login():
                     print("\nYou're in!")
             elif choice == '4':
+                bank.export_users()
+            elif choice == '5':
                 print("\nThanks for banking with us!")
                 bank.close_db()
                 sys.exit(0)
@@ -440,11 +388,40 @@ def main():
                 print("That's not an option!")
         
         else:
-            print(f"\nHi {bank.logged_user[1]}!")
+            print(f"\nHi {bank.logged_user['name']}!")
             print("1. Check Balance")
             print("2. Add Money")
             print("3. Get Money")
             print("4. Send Money")
             print("5. Change Password")
             print("6. Update Info")
-            print("7. Logout</antArtifact>
\ No newline at end of file
+            print("7. Statement")
+            print("8. Standing Orders")
+            print("9. Logout")
+            
+            choice = input("\nWhat do you want to do? (1-9): ")
+            
+            if choice == '1':
+                bank.show_balance()
+            elif choice == '2':
+                bank.credit_amount()
+            elif choice == '3':
+                bank.debit_amount()
+            elif choice == '4':
+                bank.transfer_money()
+            elif choice == '5':
+                bank.change_pwd()
+            elif choice == '6':
+                bank.update_info()
+            elif choice == '7':
+                bank.show_statement()
+            elif choice == '8':
+                bank.standing_orders()
+            elif choice == '9':
+                bank.logout()
+            else:
+                print("That's not an option!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import time
+import threading
+from collections import OrderedDict
+
+# Account records kept in memory in front of the users table, so balance
+# checks and profile reads don't go to SQLite every time.
+#
+# Every users row carries a version that each UPDATE bumps (see
+# bank_service.py). The service writes through after its own commits with
+# the version the row has now: if the cached copy is exactly one behind it
+# gets the new values, anything else means someone else changed the row in
+# between and the entry is dropped, the next read reloads it from the db.
+# Receivers of transfers are just dropped.
+#
+# Writes from other processes can't be seen from here, the ttl is how long
+# a copy may be trusted without a write of ours confirming it. The guarded
+# UPDATEs in the service still decide every money move, a stale entry can
+# only make a displayed balance old, never let an account overdraw.
+
+CACHE_SIZE = 10000
+CACHE_TTL = 5.0     # seconds
+
+
+class AccountCache:
+    # Bounded and thread safe, least recently used goes first when full.
+    # max_size=0 turns it off (nothing is stored, every get is a miss).
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        # acc -> [Account record, version, expires, gen of the last write]
+        # user is None for accounts that were written or dropped but aren't
+        # loaded: they only remember when that happened, see put()
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        # Write counter. Readers take it before going to the db, and a put()
+        # is skipped if its account was written since: the row it read may
+        # be older than the write.
+        self.gen = 0
+        self._cleared = 0       # gen of the last clear(), older reads are skipped
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.reconciled = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, acc):
+        # The cached Account record (shared, don't change it) or None
+        with self._lock:
+            entry = self._rows.get(acc)
+            if entry is None or entry[0] is None:
+                self.misses += 1
+                return None
+            if entry[2] <= time.monotonic():
+                del self._rows[acc]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._rows.move_to_end(acc)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, acc, user, version, gen):
+        # user is what get() should hand out, gen is self.gen from before the
+        # row was read
+        if not self.max_size:
+            return
+        with self._lock:
+            entry = self._rows.get(acc)
+            if gen < self._cleared or (entry is not None and entry[3] > gen):
+                return
+            self._store(acc, [user, version, time.monotonic() + self.ttl, gen])
+
+    def _store(self, acc, entry):
+        self._rows[acc] = entry
+        self._rows.move_to_end(acc)
+        while len(self._rows) > self.max_size:
+            self._rows.popitem(last=False)
+            self.evicted += 1
+
+    def write(self, acc, version, **fields):
+        # Write-through after a committed UPDATE that left the row at version
+        if not self.max_size:
+            return
+        with self._lock:
+            self.gen += 1
+            expires = time.monotonic() + self.ttl
+            entry = self._rows.get(acc)
+            if entry is None or entry[0] is None or entry[1] != version - 1:
+                if entry is not None and entry[0] is not None:
+                    self.reconciled += 1
+                self._store(acc, [None, version, expires, self.gen])
+                return
+            # Copied, readers may still hold the old record
+            user = entry[0].replace(version=version, **fields)
+            self._store(acc, [user, version, expires, self.gen])
+
+    def drop(self, *accs):
+        if not self.max_size:
+            return
+        with self._lock:
+            self.gen += 1
+            expires = time.monotonic() + self.ttl
+            for acc in accs:
+                self._store(acc, [None, None, expires, self.gen])
+
+    def clear(self):
+        with self._lock:
+            self.gen += 1
+            self._cleared = self.gen
+            self._rows.clear()
+
+    def stats(self):
+        with self._lock:
+            looked = self.hits + self.misses
+            return {
+                'size': sum(1 for entry in self._rows.values() if entry[0] is not None),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / looked, 4) if looked else None,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'reconciled': self.reconciled,
+            }
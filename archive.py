@@ -0,0 +1,218 @@
+import os
+import gzip
+import json
+import zlib
+import hashlib
+
+# Cold storage for old money_moves. archive_moves.py moves closed months out
+# of the live table into one gzipped JSON-lines file per month, each line a
+# row as a JSON list in bank_service.MOVE_COLS order, sorted by
+# (when_moved, id). Files are written once and never changed. A file is a
+# run of gzip members of BLOCK_ROWS rows each (still one normal .gz to any
+# gzip reader), so one block can be read without the rest.
+#
+# The manifest is the archive_months table in the live db (plus a
+# manifest.json copy next to the files), written in the same transaction
+# that deletes the month from money_moves. A file without a manifest row is
+# a leftover of an archiver that died and gets written again.
+#
+# archive_net keeps every account's net over everything archived, so
+# reconcile.py can still check balances against the whole history.
+# archive_index has, per account and month, the file offsets of the blocks
+# with its rows (as sender or receiver) and the time span of each block.
+#
+# Reads: ArchiveReader gives statement() the archived rows of one account by
+# decompressing only the blocks the index points at that overlap the page,
+# newest first, and stops once the page is full. Memory is a block, not a month. Months archived
+# before the index existed (indexed = 0) are read start to end for every
+# statement page, keeping only that account's rows.
+
+BLOCK_ROWS = 1000
+
+
+def setup(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS archive_months (
+            month TEXT PRIMARY KEY,
+            file TEXT NOT NULL,
+            moves INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            archived DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute("PRAGMA table_info(archive_months)")
+    if 'indexed' not in [c[1] for c in cur.fetchall()]:
+        cur.execute("ALTER TABLE archive_months ADD COLUMN indexed INTEGER NOT NULL DEFAULT 0")
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS archive_index (
+            acc_num TEXT NOT NULL,
+            month TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            first_when DATETIME NOT NULL,
+            last_when DATETIME NOT NULL,
+            PRIMARY KEY (acc_num, month, offset)
+        ) WITHOUT ROWID
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS archive_net (
+            acc_num TEXT PRIMARY KEY,
+            net INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def archive_dir(db_path):
+    stem, _ = os.path.splitext(db_path)
+    return f"{stem}.archive"
+
+
+def month_file(month):
+    return f"money_moves-{month}.jsonl.gz"
+
+
+def write_month(path, rows, block_rows=BLOCK_ROWS):
+    # rows: (id, acc_num, move_type, amount, to_acc, when_moved) in file
+    # order. Written to a temp file and renamed, so a file that exists is
+    # complete. Returns what the manifest, archive_net and archive_index need.
+    info = {'moves': 0, 'total': 0, 'first_id': None, 'last_id': None, 'net': {},
+            'index': []}
+    net = info['net']
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as raw:
+        lines, accs = [], set()
+        for row in rows:
+            lines.append(json.dumps(row, separators=(',', ':')).encode('utf-8') + b'\n')
+            move_id, acc, kind, amount, to_acc, when = row
+            accs.add(acc)
+            if not lines[1:]:
+                first_when = when
+            info['moves'] += 1
+            info['total'] += amount
+            if info['first_id'] is None:
+                info['first_id'] = info['last_id'] = move_id
+            info['first_id'] = min(info['first_id'], move_id)
+            info['last_id'] = max(info['last_id'], move_id)
+            if kind == 'CREDIT':
+                net[acc] = net.get(acc, 0) + amount
+            else:
+                net[acc] = net.get(acc, 0) - amount
+                if kind == 'TRANSFER' and to_acc:
+                    net[to_acc] = net.get(to_acc, 0) + amount
+                    accs.add(to_acc)
+            if len(lines) == block_rows:
+                write_block(raw, lines, accs, (first_when, when), info['index'])
+                lines, accs = [], set()
+        if lines:
+            write_block(raw, lines, accs, (first_when, when), info['index'])
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    info['sha256'] = file_sha256(path)
+    return info
+
+
+def write_block(raw, lines, accs, span, index):
+    # One gzip member, plus (acc, offset, first when, last when) for everyone
+    # in it
+    offset = raw.tell()
+    raw.write(gzip.compress(b''.join(lines), mtime=0))
+    index.extend((acc, offset) + span for acc in accs)
+
+
+def read_block(f, offset):
+    # Lines (still JSON) of the gzip member that starts at offset
+    f.seek(offset)
+    unzip = zlib.decompressobj(wbits=31)
+    parts = []
+    while not unzip.eof:
+        data = f.read(1 << 16)
+        if not data:
+            raise ValueError(f"{f.name} ends inside the block at {offset}")
+        parts.append(unzip.decompress(data))
+    return b''.join(parts).splitlines()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_month(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def write_manifest(cur, folder):
+    # manifest.json mirrors archive_months, so the folder explains itself
+    cur.execute('''
+        SELECT month, file, moves, total, first_id, last_id, sha256, archived
+        FROM archive_months ORDER BY month
+    ''')
+    cols = [d[0] for d in cur.description]
+    months = [dict(zip(cols, row)) for row in cur.fetchall()]
+    tmp = os.path.join(folder, 'manifest.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'months': months}, f, indent=2)
+    os.replace(tmp, os.path.join(folder, 'manifest.json'))
+
+
+class ArchiveReader:
+    def __init__(self, db_path, cols):
+        self.folder = archive_dir(db_path)
+        self._idx = {name: cols.index(name)
+                     for name in ('id', 'acc_num', 'to_acc', 'when_moved')}
+
+    def _rows(self, cur, acc, month, name, indexed, start, before):
+        # acc's rows of one month, newest first, from the blocks that have
+        # any between start and before
+        src, dst = self._idx['acc_num'], self._idx['to_acc']
+        path = os.path.join(self.folder, name)
+        if not indexed:
+            mine = [row for row in read_month(path) if acc in (row[src], row[dst])]
+            yield from reversed(mine)
+            return
+
+        cur.execute('''
+            SELECT offset FROM archive_index
+            WHERE acc_num = ? AND month = ? AND first_when <= ? AND last_when >= ?
+            ORDER BY offset DESC
+        ''', (acc, month, before, start))
+        offsets = [r[0] for r in cur.fetchall()]
+        if not offsets:
+            return
+        # Only lines that mention the account get parsed
+        needle = json.dumps(acc).encode('utf-8')
+        with open(path, 'rb') as f:
+            for offset in offsets:
+                for line in reversed(read_block(f, offset)):
+                    if needle in line:
+                        row = tuple(json.loads(line))
+                        if acc in (row[src], row[dst]):
+                            yield row
+
+    def statement_rows(self, cur, acc, start, end, after, limit):
+        # Up to limit archived rows of acc in [start, end) and before after,
+        # newest first, same as the live half of statement()
+        cur.execute('''
+            SELECT month, file, indexed FROM archive_months
+            WHERE month >= ? AND month <= ?
+            ORDER BY month DESC
+        ''', (start[:7], min(end, after[0])[:7]))
+        months = cur.fetchall()
+
+        key, when = self._idx['id'], self._idx['when_moved']
+        found = []
+        for month, name, indexed in months:
+            for row in self._rows(cur, acc, month, name, indexed, start, min(end, after[0])):
+                if start <= row[when] < end and (row[when], row[key]) < tuple(after):
+                    found.append(row)
+                    if len(found) == limit:
+                        return found
+        return found
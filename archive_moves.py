@@ -0,0 +1,164 @@
+import os
+import sys
+import datetime
+
+import archive
+from bank_service import BankingService, DB_FILE, MOVE_COLS
+
+# Moves closed months of money_moves into cold storage (see archive.py).
+# Every month is one file plus one transaction that records it in the
+# manifest and deletes it from the live table, a crash in between leaves
+# the month live and the next run writes its file again. Statements keep
+# showing archived months, the rollups keep counting them.
+#
+# A month is archived once. Moves that show up later with a when_moved in
+# an archived month (a backdated insert, a clock that was off) stay in the
+# live table for good, statements and reconcile still see them there. Every
+# run says how many there are.
+#
+# Usage: python archive_moves.py [--db FILE] [--keep-months N] [--vacuum] [--verify]
+#
+# --keep-months N leaves the current month and the N before it live
+# (default 3). --vacuum gives the freed pages back to the disk afterwards,
+# it blocks writers while it runs. --verify only checks the files against
+# the manifest. Sharded banks: run it once per shard file.
+
+KEEP_MONTHS = 3
+CHUNK = 10000
+
+
+def month_start(month, add=0):
+    # 'YYYY-MM' plus add months -> 'YYYY-MM-01'
+    year, mon = int(month[:4]), int(month[5:7]) + add
+    year, mon = year + (mon - 1) // 12, (mon - 1) % 12 + 1
+    return f"{year:04d}-{mon:02d}-01"
+
+
+def closed_months(cur, keep_months=KEEP_MONTHS, today=None):
+    # Months with moves that are old enough and not archived yet. The
+    # monthly rollup knows them without scanning money_moves.
+    today = today or datetime.datetime.utcnow().date()
+    cutoff = month_start(today.strftime('%Y-%m'), -keep_months)[:7]
+    cur.execute('''
+        SELECT DISTINCT month FROM moves_monthly
+        WHERE month < ? AND month NOT IN (SELECT month FROM archive_months)
+        ORDER BY month
+    ''', (cutoff,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def stream_rows(cur, month):
+    cur.execute(f'''
+        SELECT {', '.join(MOVE_COLS)} FROM money_moves
+        WHERE when_moved >= ? AND when_moved < ?
+        ORDER BY when_moved, id
+    ''', (month_start(month), month_start(month, 1)))
+    while True:
+        rows = cur.fetchmany(CHUNK)
+        if not rows:
+            return
+        yield from rows
+
+
+def archive_month(bank, month, folder):
+    name = archive.month_file(month)
+    info = archive.write_month(os.path.join(folder, name),
+                               stream_rows(bank.conn().cursor(), month))
+    if not info['moves']:
+        os.remove(os.path.join(folder, name))
+        return 0
+
+    def commit(cur):
+        # Rows added to the month since (only ever with a higher id) stay
+        # live, anything else that changed means the file is wrong
+        cur.execute('''
+            DELETE FROM money_moves
+            WHERE when_moved >= ? AND when_moved < ? AND id BETWEEN ? AND ?
+        ''', (month_start(month), month_start(month, 1), info['first_id'], info['last_id']))
+        if cur.rowcount != info['moves']:
+            raise ValueError(f"{month} changed while it was archived, nothing was deleted")
+        cur.execute('''
+            INSERT INTO archive_months (month, file, moves, total, first_id, last_id,
+                                        sha256, indexed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+        ''', (month, name, info['moves'], info['total'], info['first_id'],
+              info['last_id'], info['sha256']))
+        cur.executemany('''
+            INSERT INTO archive_index (acc_num, month, offset, first_when, last_when)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((acc, month, offset, first, last) for acc, offset, first, last in info['index']))
+        cur.executemany('''
+            INSERT INTO archive_net (acc_num, net) VALUES (?, ?)
+            ON CONFLICT (acc_num) DO UPDATE SET net = net + excluded.net
+        ''', info['net'].items())
+
+    bank.run_write(commit)
+    archive.write_manifest(bank.conn().cursor(), folder)
+    return info['moves']
+
+
+def late_moves(cur):
+    # Live moves dated in months that are archived already, one pass
+    cur.execute('''
+        SELECT COUNT(*) FROM money_moves
+        WHERE substr(when_moved, 1, 7) IN (SELECT month FROM archive_months)
+    ''')
+    return cur.fetchone()[0]
+
+
+def verify(bank, folder):
+    # Months whose file is missing or doesn't match its checksum
+    cur = bank.conn().cursor()
+    cur.execute("SELECT month, file, sha256 FROM archive_months ORDER BY month")
+    bad = []
+    for month, name, digest in cur.fetchall():
+        path = os.path.join(folder, name)
+        if not os.path.exists(path) or archive.file_sha256(path) != digest:
+            bad.append(month)
+    return bad
+
+
+def main():
+    args = sys.argv[1:]
+    db_path = args[args.index('--db') + 1] if '--db' in args else DB_FILE
+    keep = int(args[args.index('--keep-months') + 1]) if '--keep-months' in args else KEEP_MONTHS
+    if not os.path.exists(db_path):
+        print(f"{db_path} doesn't exist")
+        sys.exit(1)
+
+    bank = BankingService(db_path)
+    folder = archive.archive_dir(db_path)
+    try:
+        if '--verify' in args:
+            bad = verify(bank, folder)
+            if bad:
+                print(f"Broken or missing archive files: {', '.join(bad)}")
+                sys.exit(1)
+            print("All archive files match the manifest")
+            return
+
+        os.makedirs(folder, exist_ok=True)
+        months = closed_months(bank.conn().cursor(), keep)
+        if not months:
+            print("Nothing to archive")
+        for month in months:
+            try:
+                n = archive_month(bank, month, folder)
+            except ValueError as e:
+                print(f"Skipped {month}: {str(e)}")
+                continue
+            print(f"Archived {month}: {n} moves")
+
+        late = late_moves(bank.conn().cursor())
+        if late:
+            print(f"{late} moves dated in archived months stay live")
+
+        if '--vacuum' in args and months:
+            bank.conn().execute("VACUUM")
+            print("Vacuumed")
+    finally:
+        bank.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import os
+import glob
+import json
+import uuid
+import queue
+import time
+import sqlite3
+import datetime
+import itertools
+import threading
+
+# Login/logout audit trail without a commit per login. Events go through a
+# bounded queue to one background thread that writes them in batches, one
+# transaction per batch.
+#
+# Crash safety: every event is appended to a small journal file before it is
+# queued. The writer keeps a high-water mark, the journal offset below which
+# every event is committed; once it reaches the end the journal is emptied,
+# and under steady load the committed front is cut off every COMPACT_BYTES.
+# A batch that can't be committed stays in memory and is retried ahead of
+# newer events, so the mark only ever moves over committed events. A journal
+# left behind by a dead process, or by a closed writer of this one, is
+# replayed on the next start. Replays are harmless: logins carry an event_id
+# (INSERT OR IGNORE) and logouts only close sessions that started before them.
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.05   # seconds the writer waits to fill a batch
+COMMIT_RETRIES = 5
+RETRY_DELAY = 1.0       # seconds between rounds for a batch that failed
+COMPACT_BYTES = 1 << 20
+
+_writer_ids = itertools.count()
+_open_journals = set()  # journals of writers still running in this process
+
+
+def setup(cur):
+    # Columns and indexes the writer needs on top of the original login_info
+    cur.execute("PRAGMA table_info(login_info)")
+    if 'event_id' not in [c[1] for c in cur.fetchall()]:
+        cur.execute("ALTER TABLE login_info ADD COLUMN event_id TEXT")
+    cur.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_login_event ON login_info (event_id)
+    ''')
+    # Only open sessions are in here, so logout finds them in O(log n)
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_login_open ON login_info (acc_num)
+        WHERE logout_time IS NULL
+    ''')
+    # For retention
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_login_time ON login_info (login_time)
+    ''')
+
+
+def now():
+    # Same text format as CURRENT_TIMESTAMP (UTC)
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def write_events(cur, events):
+    # Runs of the same kind go in with one executemany, order is kept
+    for kind, group in itertools.groupby(events, key=lambda e: e['kind']):
+        group = list(group)
+        if kind == 'login':
+            cur.executemany('''
+                INSERT OR IGNORE INTO login_info (acc_num, login_time, event_id)
+                VALUES (?, ?, ?)
+            ''', [(e['acc'], e['at'], e['id']) for e in group])
+        else:
+            cur.executemany('''
+                UPDATE login_info
+                SET logout_time = ?
+                WHERE acc_num = ? AND logout_time IS NULL AND login_time <= ?
+            ''', [(e['at'], e['acc'], e['at']) for e in group])
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AuditWriter:
+    def __init__(self, db_path, connect, queue_size=QUEUE_SIZE,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(queue_size)
+
+        self.journal_path = f"{db_path}-audit-{os.getpid()}-{next(_writer_ids)}.jsonl"
+        self.recover()
+        _open_journals.add(self.journal_path)
+
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal_lock = threading.Lock()
+        self._pending = 0               # journaled but not committed yet
+        self._idle = threading.Condition(self._journal_lock)
+        # Journal offsets count every byte ever written, _base is the one
+        # the file starts at after trimming
+        self._written = 0
+        self._base = 0
+        self._committed = 0             # high-water mark
+        self._done = {}                 # committed ranges past it, start -> end
+        self._failed = []               # batch waiting for its next round
+        self.errors = 0                 # failed commit rounds, just a count
+
+        self._thread = threading.Thread(target=self._run, name='audit-writer',
+                                        daemon=True)
+        self._thread.start()
+
+
+    def recover(self):
+        # Replays journals left behind by processes that died, or by writers
+        # of this process that closed before their last batch got in
+        db = None
+        for path in glob.glob(f"{glob.escape(self.db_path)}-audit-*.jsonl"):
+            try:
+                pid = int(path.rsplit('-audit-', 1)[1].split('-')[0])
+            except (IndexError, ValueError):
+                continue
+            if pid == os.getpid():
+                # Another writer in this very process is still using it
+                if path in _open_journals:
+                    continue
+            elif pid_alive(pid):
+                continue
+
+            events = []
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # Torn last line from the crash
+                        break
+            if events:
+                db = db or self.connect(self.db_path)
+                with db:
+                    write_events(db.cursor(), events)
+            os.remove(path)
+        if db:
+            db.close()
+
+
+    def login(self, acc):
+        self._put({'id': uuid.uuid4().hex, 'kind': 'login', 'acc': acc, 'at': now()})
+
+    def logout(self, acc):
+        self._put({'id': uuid.uuid4().hex, 'kind': 'logout', 'acc': acc, 'at': now()})
+
+    def _put(self, event):
+        line = json.dumps(event) + '\n'
+        with self._journal_lock:
+            self._journal.write(line)
+            self._journal.flush()
+            start = self._written
+            self._written += len(line)    # json.dumps output is ASCII
+            self._pending += 1
+        # Blocks when the writer is this far behind, that's the back pressure
+        self.queue.put((start, self._written, event))
+
+
+    def _run(self):
+        db = self.connect(self.db_path)
+        stop = False
+        try:
+            while True:
+                if self._failed:
+                    if stop:
+                        # One last round, what's still failing is left in
+                        # the journal for the next start
+                        self._commit(db, self._failed)
+                        return
+                    # The failed batch goes first, so events are committed
+                    # in journal order
+                    time.sleep(RETRY_DELAY)
+                    batch, self._failed = self._failed, []
+                    stop = self._fill(batch, 0)
+                elif stop:
+                    return
+                else:
+                    item = self.queue.get()
+                    if item is None:
+                        return
+                    batch = [item]
+                    stop = self._fill(batch, self.flush_interval)
+                self._commit(db, batch)
+        finally:
+            db.close()
+
+    def _fill(self, batch, wait):
+        # Grabs whatever else arrives within wait seconds, up to batch_size
+        deadline = time.monotonic() + wait
+        while len(batch) < self.batch_size:
+            left = deadline - time.monotonic()
+            try:
+                if left > 0:
+                    item = self.queue.get(timeout=left)
+                else:
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                return False
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    def _commit(self, db, batch):
+        try:
+            for attempt in range(COMMIT_RETRIES):
+                try:
+                    with db:
+                        write_events(db.cursor(), [event for _, _, event in batch])
+                    break
+                except sqlite3.OperationalError:
+                    # Locked for longer than the busy timeout, try again
+                    if attempt == COMMIT_RETRIES - 1:
+                        raise
+                    time.sleep(0.05 * 2 ** attempt)
+        except Exception:
+            # Kept for the next round, the journal still has it too
+            self.errors += 1
+            self._failed = batch
+            return
+
+        with self._journal_lock:
+            self._pending -= len(batch)
+            for start, end, _ in batch:
+                self._done[start] = end
+            while self._committed in self._done:
+                self._committed = self._done.pop(self._committed)
+            self._trim()
+            self._idle.notify_all()
+
+    def _trim(self):
+        # Drops the committed front of the journal, with _journal_lock held
+        if self._committed == self._written:
+            # Everything journaled is in the db now
+            self._journal.truncate(0)
+            self._base = self._written
+        elif self._committed - self._base >= COMPACT_BYTES:
+            # Never all caught up under steady load, keep only the tail
+            self._journal.close()
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._committed - self._base)
+                tail = f.read()
+            tmp = f"{self.journal_path}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.journal_path)
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+            self._base = self._committed
+
+
+    def flush(self, timeout=None):
+        # Waits until every event queued so far is committed
+        with self._journal_lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        # The writer works through the queue before it sees the None
+        self.queue.put(None)
+        self._thread.join()
+        self._journal.close()
+        _open_journals.discard(self.journal_path)
+        if self._committed == self._written:
+            os.remove(self.journal_path)
+
+    def stats(self):
+        with self._journal_lock:
+            return {
+                'pending': self._pending,
+                'retrying': len(self._failed),
+                'journal_bytes': self._written - self._base,
+                'errors': self.errors,
+            }
+
+
+def prune(cur, keep_days, chunk=10000):
+    # Drops login_info rows older than keep_days in small deletes so writers
+    # don't wait long. Returns how many went.
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=keep_days)) \
+        .strftime('%Y-%m-%d %H:%M:%S')
+    cur.execute('''
+        DELETE FROM login_info WHERE id IN (
+            SELECT id FROM login_info WHERE login_time < ? LIMIT ?
+        )
+    ''', (cutoff, chunk))
+    return cur.rowcount
@@ -0,0 +1,110 @@
+import hashlib
+import hmac
+import secrets
+import base64
+import threading
+import time
+from collections import OrderedDict
+
+# Password hashing and login sessions for the bank.
+# Stored format: pbkdf2_sha256$<iterations>$<salt>$<hash>. Anything else in
+# users.pwd is an old plaintext password and gets upgraded on next login
+# (or all at once with BankingService.migrate_passwords).
+
+PWD_SCHEME = 'pbkdf2_sha256'
+PWD_COST = 600000       # PBKDF2 iterations, see bench_login.py to size it
+SALT_BYTES = 16
+
+SESSION_TTL = 15 * 60   # seconds
+MAX_SESSIONS = 100000
+
+
+def b64(raw):
+    return base64.b64encode(raw).decode('ascii').rstrip('=')
+
+
+def unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def is_hashed(stored):
+    return str(stored).startswith(PWD_SCHEME + '$')
+
+
+def hash_pwd(pwd, cost=PWD_COST):
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', pwd.encode('utf-8'), salt, cost)
+    return f"{PWD_SCHEME}${cost}${b64(salt)}${b64(digest)}"
+
+
+def verify_pwd(pwd, stored, cost=PWD_COST):
+    # Returns (matches, needs_rehash). needs_rehash is set for plaintext
+    # leftovers and for hashes made with a different cost than the current one
+    if not is_hashed(stored):
+        return hmac.compare_digest(pwd.encode('utf-8'), str(stored).encode('utf-8')), True
+
+    try:
+        _, iters, salt, digest = stored.split('$')
+        iters = int(iters)
+        salt, digest = unb64(salt), unb64(digest)
+    except ValueError:
+        return False, False
+
+    check = hashlib.pbkdf2_hmac('sha256', pwd.encode('utf-8'), salt, iters)
+    ok = hmac.compare_digest(check, digest)
+    return ok, ok and iters != cost
+
+
+class SessionCache:
+    # Short-lived login tokens so only the first request pays for the KDF.
+    # Bounded and thread safe: expired tokens are dropped as they're seen,
+    # and when it's full the oldest session goes first.
+
+    def __init__(self, ttl=SESSION_TTL, max_size=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._tokens = OrderedDict()    # token -> (acc_num, expires)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def issue(self, acc):
+        token = secrets.token_urlsafe(24)
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            while len(self._tokens) >= self.max_size:
+                self._tokens.popitem(last=False)
+            self._tokens[token] = (acc, now + self.ttl)
+        return token
+
+    def check(self, token):
+        # acc_num for a live token, None otherwise
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._tokens[token]
+                return None
+            return entry[0]
+
+    def revoke(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def revoke_acc(self, acc):
+        # e.g. after a password change, kill every session of that account
+        with self._lock:
+            for token in [t for t, (a, _) in self._tokens.items() if a == acc]:
+                del self._tokens[token]
+
+    def _purge(self, now):
+        # Tokens are in issue order and share one ttl, so expired ones are
+        # always at the front
+        while self._tokens:
+            token, (_, expires) = next(iter(self._tokens.items()))
+            if expires > now:
+                break
+            del self._tokens[token]
@@ -0,0 +1,1401 @@
+import sqlite3
+import random
+import sys
+import datetime
+import threading
+import time
+import functools
+import csv
+import json
+
+from auth import (PWD_COST, SESSION_TTL, MAX_SESSIONS, SessionCache, hash_pwd,
+                  verify_pwd, is_hashed)
+import audit
+import archive
+import rollups
+from acc_cache import AccountCache, CACHE_SIZE, CACHE_TTL
+from snapshot import SnapshotReplica
+import standing
+import validate
+import velocity
+from money import MIN_BALANCE, MIN_BALANCE_CENTS, to_cents, as_cents, fmt_money
+
+# Headless side of the bank. No input()/print() in here, every operation
+# takes plain arguments and hands back a dict, so the same code can serve
+# the menu in Banking_system.py, worker pools and load tests.
+# All money going in and out of the service is integer cents (see money.py).
+
+DB_FILE = 'banking_system.db'
+MOVE_TYPES = ('CREDIT', 'DEBIT', 'TRANSFER')
+
+# How long one statement waits on a locked db, and how many times a whole
+# transaction gets retried after that
+BUSY_TIMEOUT = 5.0
+BUSY_RETRIES = 10
+
+# NORMAL is safe with WAL against app crashes, FULL also survives power loss
+# (one fsync per commit)
+SYNCHRONOUS = 'NORMAL'
+
+MOVE_COLS = ('id', 'acc_num', 'move_type', 'amount', 'to_acc', 'when_moved')
+
+# Account numbers come out of a shared sequence in blocks. With a check
+# digit the sequence gives the first 9 digits and Luhn adds the 10th.
+ACC_CHECK_DIGIT = True
+ACC_SEQ = {
+    True: ('acc9', 100000000, 999999999),
+    False: ('acc10', 1000000000, 9999999999),
+}
+
+IMPORT_COLS = ('name', 'dob', 'city', 'pwd', 'cash_balance', 'phone', 'email')
+
+LIST_COLS = ('acc_num', 'name', 'city', 'phone', 'email', 'cash_balance')
+LIST_ORDERS = ('id', 'acc_num', 'name', 'city', 'cash_balance')
+
+USER_COLS = ('id', 'name', 'acc_num', 'dob', 'city', 'pwd', 'cash_balance',
+             'phone', 'email')
+# What an Account record holds: no password, plus the row version
+ACCOUNT_COLS = ('id', 'name', 'acc_num', 'dob', 'city', 'cash_balance',
+                'phone', 'email', 'version')
+ACCOUNT_SQL = f"SELECT {', '.join(ACCOUNT_COLS)} FROM users WHERE acc_num = ?"
+
+# Bumped by migrations, kept in PRAGMA user_version.
+# 1: cash_balance and amount are INTEGER cents instead of REAL dollars
+# 2: users.version, bumped by every UPDATE of a users row (see acc_cache.py)
+SCHEMA_VERSION = 2
+
+USERS_DDL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        acc_num TEXT UNIQUE NOT NULL,
+        dob DATE NOT NULL,
+        city TEXT NOT NULL,
+        pwd TEXT NOT NULL,
+        cash_balance INTEGER NOT NULL,
+        phone TEXT NOT NULL,
+        email TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+'''
+
+MOVES_DDL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        acc_num TEXT NOT NULL,
+        move_type TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        to_acc TEXT,
+        when_moved DATETIME DEFAULT CURRENT_TIMESTAMP,
+        via TEXT,
+        FOREIGN KEY (acc_num) REFERENCES users(acc_num)
+    )
+'''
+# via: NULL for a customer's own move, 'batch', 'standing' or 'posting' for
+# the ones the bank runs (they don't count against the velocity limits)
+
+# table -> (ddl, columns, money column)
+MONEY_TABLES = {
+    'users': (USERS_DDL, USER_COLS, 'cash_balance'),
+    'money_moves': (MOVES_DDL, MOVE_COLS, 'amount'),
+}
+
+INDEXES = {
+    # City filter for listings and exports. No balance index on purpose,
+    # every money move would have to update it.
+    'users': [('idx_users_city', '(city)')],
+    # Statements walk these newest first, one for each side of a move
+    'money_moves': [('idx_moves_acc_when', '(acc_num, when_moved)'),
+                    ('idx_moves_to_when', '(to_acc, when_moved)')],
+}
+
+
+def connect_db(path=DB_FILE, metrics=None):
+    # WAL lets readers run next to the single writer, and the busy timeout
+    # makes other processes wait for the lock instead of failing right away.
+    # check_same_thread is off only so close_all() can clean up, each
+    # connection is still used by a single thread.
+    connect = metrics.connect if metrics else sqlite3.connect
+    db = connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    return db
+
+
+def cents_expr(col, money, prefix=None):
+    # Column as it goes into the cents tables, dollars -> whole cents
+    ref = f"{prefix}.{col}" if prefix else col
+    if col == money:
+        return f"CAST(ROUND({ref} * 100) AS INTEGER)"
+    return ref
+
+
+def is_busy(err):
+    msg = str(err).lower()
+    return 'locked' in msg or 'busy' in msg
+
+
+# Field rules live in validate.py, these raise the first problem
+def check_name(name):
+    return validate.check('name', name or '')
+
+def check_phone(num):
+    return validate.check('phone', num)
+
+def check_email(email):
+    return validate.check('email', email)
+
+
+def check_pwd(pwd):
+    return validate.check('pwd', pwd)
+
+def check_dob(dob):
+    return validate.check('dob', dob)
+
+
+def statement_range(start, end):
+    # Inclusive dates -> [start, day after end) in when_moved's text format
+    if start:
+        start = datetime.datetime.strptime(str(start)[:10], '%Y-%m-%d').strftime('%Y-%m-%d')
+    else:
+        start = ''
+    if end:
+        end = datetime.datetime.strptime(str(end)[:10], '%Y-%m-%d') + datetime.timedelta(days=1)
+        end = end.strftime('%Y-%m-%d')
+    else:
+        end = '9999-12-31'
+    return start, end
+
+
+def luhn_digit(base):
+    total = 0
+    for i, ch in enumerate(reversed(base)):
+        d = int(ch)
+        if i % 2 == 0:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return str((10 - total % 10) % 10)
+
+
+def acc_num_for(n, check_digit=ACC_CHECK_DIGIT):
+    if check_digit:
+        base = f"{n:09d}"
+        return base + luhn_digit(base)
+    return f"{n:010d}"
+
+
+def valid_acc_num(acc):
+    # Only for numbers handed out with a check digit
+    acc = str(acc)
+    return len(acc) == 10 and acc.isdigit() and luhn_digit(acc[:9]) == acc[9]
+
+
+def read_import_file(path):
+    # Yields one dict per customer from a .csv (with header) or .jsonl file
+    if path.lower().endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+
+
+def clean_import_rows(rows, pwd_cost=PWD_COST):
+    # Same rules as the sign up form for a chunk of rows, checked column by
+    # column (see validate.py). Returns ([(index, values in IMPORT_COLS
+    # order)], [(index, reason)]). Passwords that already come hashed from
+    # the old system are kept as is.
+    cols = {name: [] for name in ('name', 'dob', 'city', 'phone', 'email')}
+    plain, hashed, cash = [], [], []
+    for _, row in rows:
+        for name, values in cols.items():
+            values.append(str(row.get(name) or '').strip())
+        pwd = str(row.get('pwd') or row.get('password') or '')
+        plain.append(pwd)
+        hashed.append(is_hashed(pwd))
+        cash.append(row.get('cash_balance', row.get('cash')))
+
+    # Hashed passwords skip the rules, the hash is what gets stored
+    bad = dict(validate.check_columns(cols))
+    fresh = [pos for pos, h in enumerate(hashed) if not h]
+    for i, code in validate.BANK['pwd'].column([plain[pos] for pos in fresh]):
+        bad.setdefault(fresh[i], []).append(code)
+
+    good, rejected = [], []
+    for pos, (idx, _) in enumerate(rows):
+        codes = bad.get(pos)
+        try:
+            if cash[pos] in (None, ''):
+                raise ValueError("Need an opening balance!")
+            # Files carry normal dollar amounts
+            cents = to_cents(cash[pos])
+            if cents < MIN_BALANCE_CENTS:
+                raise ValueError(f"Need at least {MIN_BALANCE} to open account!")
+        except (ValueError, TypeError) as e:
+            codes = (codes or []) + [str(e)]
+        if codes:
+            rejected.append((idx, '; '.join(validate.MESSAGES.get(c, c) for c in codes)))
+            continue
+        pwd = plain[pos] if hashed[pos] else hash_pwd(plain[pos], pwd_cost)
+        good.append((idx, (cols['name'][pos], cols['dob'][pos], cols['city'][pos], pwd,
+                           cents, cols['phone'][pos], cols['email'][pos])))
+    return good, rejected
+
+
+class Account:
+    # One users row without the password. Slots instead of a dict per
+    # record, so the cache and bulk loads stay small. Account.from_row is a
+    # row_factory: cur.row_factory = Account.from_row, then select
+    # ACCOUNT_COLS in that order.
+    __slots__ = ACCOUNT_COLS
+
+    def __init__(self, id, name, acc_num, dob, city, cash_balance, phone, email,
+                 version=0):
+        self.id = id
+        self.name = name
+        self.acc_num = acc_num
+        self.dob = dob
+        self.city = city
+        self.cash_balance = cash_balance
+        self.phone = phone
+        self.email = email
+        self.version = version
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        # City and birthday repeat a lot, interned every account shares
+        # one string for them
+        id, name, acc_num, dob, city, *rest = row
+        return cls(id, name, acc_num, sys.intern(dob), sys.intern(city), *rest)
+
+    def as_dict(self):
+        # What service calls hand back as 'user' (the version stays inside)
+        return {col: getattr(self, col) for col in ACCOUNT_COLS[:-1]}
+
+    def replace(self, **changes):
+        # Changed copy, records can be shared between threads (see acc_cache.py)
+        copy = Account(*[getattr(self, col) for col in ACCOUNT_COLS])
+        for col, value in changes.items():
+            setattr(copy, col, value)
+        return copy
+
+
+def service_call(fn):
+    # Turns the return value into {'ok': True, ...} and rule/db errors into
+    # {'ok': False, 'error': ...} so callers never have to catch anything
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return dict(ok=True, **(fn(*args, **kwargs) or {}))
+        except (ValueError, TypeError) as e:
+            return {'ok': False, 'error': str(e)}
+        except sqlite3.Error as e:
+            return {'ok': False, 'error': f"Database problem: {str(e)}"}
+    # So BankingService knows what to time when metrics are on
+    wrapper.is_service_call = True
+    return wrapper
+
+
+def service_iter(fn):
+    # Generators that stream a listing. They raise like any iterator, with
+    # metrics on the whole listing is timed as one operation.
+    fn.is_service_iter = True
+    return fn
+
+
+class BankingService:
+    def __init__(self, db_path=DB_FILE, pwd_cost=PWD_COST,
+                 session_ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, metrics=None,
+                 cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL, snapshot_age=None,
+                 limits=None, scheduler=False):
+        self.db_path = db_path
+        self.pwd_cost = pwd_cost
+        self.sessions = SessionCache(session_ttl, max_sessions)
+        # Account rows for balance checks and profile reads, see acc_cache.py
+        self.cache = AccountCache(cache_size, cache_ttl)
+        self._dummy_hash = None
+        # One connection per thread, handed out lazily by conn()
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._pool = []
+        # Instrumentation, see metrics.py. When it's off nothing gets wrapped.
+        self.metrics = metrics
+        if metrics:
+            for name in dir(type(self)):
+                attr = getattr(type(self), name)
+                if getattr(attr, 'is_service_call', False):
+                    setattr(self, name, metrics.wrap(name, getattr(self, name)))
+                elif getattr(attr, 'is_service_iter', False):
+                    setattr(self, name, metrics.wrap_iter(name, getattr(self, name)))
+        self.setup_tables()
+        # login_info rows are written in the background, see audit.py
+        self.audit = audit.AuditWriter(
+            db_path, functools.partial(connect_db, metrics=metrics))
+        # With snapshot_age (seconds) listings, exports and move_totals read
+        # a copy that's at most that old, see snapshot.py
+        self.replica = None
+        if snapshot_age:
+            self.replica = SnapshotReplica(
+                db_path, snapshot_age, connect=functools.partial(connect_db, metrics=metrics))
+            self.replica.start()
+        # Months moved to cold storage by archive_moves.py
+        self.archive = archive.ArchiveReader(db_path, MOVE_COLS)
+        # Velocity limits on debits and transfers (e.g. velocity.LIMITS),
+        # off when None. The windows start out with the recent moves.
+        self.velocity = None
+        if limits:
+            self.velocity = velocity.VelocityLimits(limits)
+            velocity.rebuild(self.conn().cursor(), self.velocity)
+        # With scheduler=True this process runs due standing orders in the
+        # background, see standing.py
+        self.scheduler = None
+        if scheduler:
+            self.scheduler = standing.Scheduler(self)
+            self.scheduler.start()
+
+
+    def conn(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = connect_db(self.db_path, self.metrics)
+            self._local.db = db
+            with self._pool_lock:
+                self._pool.append(db)
+        return db
+
+    def read_conn(self):
+        # For reports: the snapshot when there is one, the live db otherwise
+        if self.replica:
+            return self.replica.conn()
+        return self.conn()
+
+    def release(self):
+        # Done with this thread, give its connection back
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            self._local.db = None
+            with self._pool_lock:
+                self._pool.remove(db)
+            db.close()
+        if self.replica:
+            self.replica.release()
+
+    def close_all(self):
+        if self.scheduler:
+            self.scheduler.stop()
+        # Audit events still in the queue get committed first
+        self.audit.close()
+        if self.replica:
+            self.replica.close()
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for db in pool:
+            db.close()
+        self._local = threading.local()
+        if self.metrics and self.metrics.dump_path:
+            self.metrics.dump()
+
+    @service_call
+    def stats(self):
+        # Counters and timings so far, only when metrics are on
+        if not self.metrics:
+            raise ValueError("Metrics are off!")
+        stats = self.metrics.snapshot()
+        stats['cache'] = self.cache.stats()
+        stats['audit'] = self.audit.stats()
+        if self.replica:
+            stats['snapshot'] = self.replica.stats()
+        if self.velocity:
+            stats['velocity'] = self.velocity.stats()
+        if self.scheduler:
+            stats['standing'] = self.scheduler.stats()
+        return {'stats': stats}
+
+    @service_call
+    def refresh_snapshot(self):
+        # New report copy right now, e.g. before an export that has to be current
+        if not self.replica:
+            raise ValueError("No snapshot, reports read the live db!")
+        self.replica.refresh()
+        return {'snapshot': self.replica.stats()}
+
+    @service_call
+    def cache_stats(self):
+        # Hit/miss counts of the account cache, these work without metrics
+        return {'cache': self.cache.stats()}
+
+
+    def setup_tables(self):
+        db = self.conn()
+        cur = db.cursor()
+
+        cur.execute("PRAGMA user_version")
+        version = cur.fetchone()[0]
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'")
+        old_file = cur.fetchone() is not None
+
+        # Make tables if they don't exist
+        cur.execute(USERS_DDL.format(table='users'))
+
+        # Track logins
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS login_info (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                acc_num TEXT NOT NULL,
+                login_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                logout_time DATETIME,
+                FOREIGN KEY (acc_num) REFERENCES users(acc_num)
+            )
+        ''')
+
+
+        audit.setup(cur)
+        archive.setup(cur)
+        standing.setup(cur)
+
+
+        # Money stuff
+        cur.execute(MOVES_DDL.format(table='money_moves'))
+
+        # Next free account number per sequence, see take_acc_nums()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS acc_seq (
+                name TEXT PRIMARY KEY,
+                next_val INTEGER NOT NULL
+            )
+        ''')
+        db.commit()
+
+        if old_file and version < 1:
+            self.migrate_to_cents()
+        else:
+            if not old_file:
+                cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            # Old REAL tables left behind by a migration that didn't finish
+            # cleaning up
+            for table in MONEY_TABLES:
+                cur.execute(f"DROP TABLE IF EXISTS {table}_real")
+
+        # Files from before version 2
+        cur.execute("SELECT 1 FROM pragma_table_info('users') WHERE name = 'version'")
+        if cur.fetchone() is None:
+            cur.execute("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        cur.execute("SELECT 1 FROM pragma_table_info('money_moves') WHERE name = 'via'")
+        if cur.fetchone() is None:
+            cur.execute("ALTER TABLE money_moves ADD COLUMN via TEXT")
+
+        for table, indexes in INDEXES.items():
+            for name, cols in indexes:
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {cols}")
+
+        db.commit()
+
+        # Reporting rollups, the first open of an older file folds its
+        # existing history in chunk by chunk
+        self.run_write(rollups.install)
+        while self.run_write(rollups.backfill_chunk):
+            pass
+
+
+    def migrate_to_cents(self, chunk_size=50000):
+        # Files from before integer cents keep money as REAL dollars. Rebuilds
+        # users and money_moves with INTEGER cents without locking writers
+        # out: the new tables are filled chunk by chunk while triggers copy
+        # every concurrent change across, then one short transaction swaps
+        # the names.
+        db = self.conn()
+
+        def prepare(cur):
+            for table, (ddl, cols, money) in MONEY_TABLES.items():
+                new = f"{table}_cents"
+                cur.execute(ddl.format(table=new))
+
+                # Index names have to stay the same, so the live table loses
+                # its indexes and the new one gets them before the backfill
+                cur.execute("""
+                    SELECT name FROM sqlite_master
+                    WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+                """, (table,))
+                for (name,) in cur.fetchall():
+                    cur.execute(f"DROP INDEX {name}")
+                for name, idx_cols in INDEXES.get(table, []):
+                    cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {new} {idx_cols}")
+
+                names = ', '.join(cols)
+                values = ', '.join(cents_expr(c, money, 'NEW') for c in cols)
+                for event in ('INSERT', 'UPDATE'):
+                    cur.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS {new}_{event.lower()}
+                        AFTER {event} ON {table} BEGIN
+                            INSERT OR REPLACE INTO {new} ({names}) VALUES ({values});
+                        END
+                    """)
+                cur.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {new}_delete
+                    AFTER DELETE ON {table} BEGIN
+                        DELETE FROM {new} WHERE id = OLD.id;
+                    END
+                """)
+
+        self.run_write(prepare)
+
+        for table, (ddl, cols, money) in MONEY_TABLES.items():
+            new = f"{table}_cents"
+            names = ', '.join(cols)
+            values = ', '.join(cents_expr(c, money) for c in cols)
+            last_id = 0
+
+            def copy_chunk(cur):
+                cur.execute(f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?)",
+                            (last_id, chunk_size))
+                hi = cur.fetchone()[0]
+                if hi is None:
+                    return None
+                # Rows the triggers already copied are newer, leave them alone
+                cur.execute(f"""
+                    INSERT OR IGNORE INTO {new} ({names})
+                    SELECT {values} FROM {table} WHERE id > ? AND id <= ?
+                """, (last_id, hi))
+                return hi
+
+            while True:
+                hi = self.run_write(copy_chunk)
+                if hi is None:
+                    break
+                last_id = hi
+
+        def swap(cur):
+            for table in MONEY_TABLES:
+                new = f"{table}_cents"
+                for event in ('insert', 'update', 'delete'):
+                    cur.execute(f"DROP TRIGGER IF EXISTS {new}_{event}")
+                cur.execute(f"ALTER TABLE {table} RENAME TO {table}_real")
+                cur.execute(f"ALTER TABLE {new} RENAME TO {table}")
+            cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        # Legacy rename keeps login_info's foreign key pointing at "users"
+        # instead of following the old table to users_real
+        db.execute("PRAGMA legacy_alter_table = ON")
+        try:
+            self.run_write(swap)
+        finally:
+            db.execute("PRAGMA legacy_alter_table = OFF")
+
+        for table in MONEY_TABLES:
+            self.run_write(lambda cur: cur.execute(f"DROP TABLE IF EXISTS {table}_real"))
+
+
+    def run_write(self, work):
+        # Run work(cursor) in one IMMEDIATE transaction, retrying on SQLITE_BUSY
+        db = self.conn()
+        cur = db.cursor()
+        for attempt in range(BUSY_RETRIES):
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                result = work(cur)
+                db.commit()
+                return result
+            except sqlite3.OperationalError as e:
+                if db.in_transaction:
+                    db.rollback()
+                if not is_busy(e) or attempt == BUSY_RETRIES - 1:
+                    raise
+                time.sleep(0.01 * 2 ** attempt * random.random())
+            except Exception:
+                if db.in_transaction:
+                    db.rollback()
+                raise
+
+    def _fetch_user(self, cur, acc):
+        # Account record, read in cur's transaction
+        rec = cur.connection.cursor()
+        rec.row_factory = Account.from_row
+        rec.execute(ACCOUNT_SQL, (acc,))
+        user = rec.fetchone()
+        if not user:
+            raise ValueError("Account not found!")
+        return user
+
+    def _cached_user(self, acc):
+        # Account record, shared with the cache so never changed in place
+        user = self.cache.get(acc)
+        if user is None:
+            gen = self.cache.gen
+            user = self._fetch_user(self.conn().cursor(), acc)
+            self.cache.put(acc, user, user.version, gen)
+        return user
+
+    def take_acc_nums(self, cur, n, check_digit=ACC_CHECK_DIGIT):
+        # Reserves n unused account numbers. Has to run inside the caller's
+        # write transaction: the sequence bump and the inserts that use the
+        # numbers commit (or roll back) together, so no two processes ever
+        # get the same block.
+        seq, first, last = ACC_SEQ[check_digit]
+        nums = []
+        while len(nums) < n:
+            cur.execute("SELECT next_val FROM acc_seq WHERE name = ?", (seq,))
+            row = cur.fetchone()
+            lo = row[0] if row else first
+            hi = lo + n - len(nums)
+            if hi - 1 > last:
+                raise ValueError("Ran out of account numbers!")
+            cur.execute("INSERT OR REPLACE INTO acc_seq (name, next_val) VALUES (?, ?)",
+                        (seq, hi))
+
+            block = [acc_num_for(i, check_digit) for i in range(lo, hi)]
+            # Older random numbers can sit inside the block, one range
+            # lookup on the unique index finds all of them
+            cur.execute("SELECT acc_num FROM users WHERE acc_num BETWEEN ? AND ?",
+                        (block[0], block[-1]))
+            taken = {r[0] for r in cur.fetchall()}
+            nums.extend(a for a in block if a not in taken)
+        return nums
+
+    def make_acc_num(self, cur):
+        return self.take_acc_nums(cur, 1)[0]
+
+
+    @service_call
+    def open_account(self, name, dob, city, pwd, cash, phone, email, acc_num=None):
+        # acc_num is only passed in by shards.py, which hands out numbers
+        # from one sequence for all shards
+        check_name(name)
+        check_dob(dob)
+        if not city:
+            raise ValueError("Need a city!")
+        check_pwd(pwd)
+        cash = as_cents(cash)
+        if cash < MIN_BALANCE_CENTS:
+            raise ValueError(f"Need at least {MIN_BALANCE} to open account!")
+        check_phone(phone)
+        check_email(email)
+        pwd = hash_pwd(pwd, self.pwd_cost)
+
+        def work(cur):
+            acc = acc_num or self.make_acc_num(cur)
+            cur.execute('''
+                INSERT INTO users (name, acc_num, dob, city, pwd, cash_balance,
+                                 phone, email)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (name, acc, dob, city, pwd, cash, phone, email))
+            # Opening deposit goes in the ledger too, so balances can always
+            # be rebuilt from money_moves (see reconcile.py)
+            cur.execute("""
+                INSERT INTO money_moves (acc_num, move_type, amount)
+                VALUES (?, 'CREDIT', ?)
+            """, (acc, cash))
+            return acc
+
+        return {'acc_num': self.run_write(work)}
+
+    @service_call
+    def import_users(self, rows, chunk_size=5000, check_digit=ACC_CHECK_DIGIT,
+                     map_path=None, pwd_cost=None):
+        # Bulk onboarding. rows: iterable of dicts (see read_import_file).
+        # Bad rows are rejected by index, good ones go in with executemany,
+        # one transaction and one account number block per chunk.
+        # map_path gets a "row,acc_num" CSV of the numbers handed out.
+        # A lower pwd_cost makes big imports feasible, those hashes get
+        # upgraded to the normal cost on each customer's first login.
+        pwd_cost = pwd_cost or self.pwd_cost
+        imported = 0
+        rejected = []
+        chunk = []
+        out = None
+        if map_path:
+            out = open(map_path, 'w', newline='', encoding='utf-8')
+            mapping = csv.writer(out)
+            mapping.writerow(['row', 'acc_num'])
+
+        def flush():
+            nonlocal imported
+
+            def work(cur):
+                nums = self.take_acc_nums(cur, len(chunk), check_digit)
+                cur.executemany('''
+                    INSERT INTO users (name, dob, city, pwd, cash_balance, phone,
+                                       email, acc_num)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [rec + (acc,) for (_, rec), acc in zip(chunk, nums)])
+                # Opening deposits, same as open_account
+                cur.executemany("""
+                    INSERT INTO money_moves (acc_num, move_type, amount)
+                    VALUES (?, 'CREDIT', ?)
+                """, [(acc, rec[IMPORT_COLS.index('cash_balance')])
+                      for (_, rec), acc in zip(chunk, nums)])
+                return nums
+
+            try:
+                nums = self.run_write(work)
+            except sqlite3.Error as e:
+                rejected.extend((idx, f"Batch failed: {str(e)}") for idx, _ in chunk)
+                return
+            imported += len(nums)
+            if out:
+                mapping.writerows((idx, acc) for (idx, _), acc in zip(chunk, nums))
+
+        def clean(raw):
+            nonlocal chunk
+            good, bad = clean_import_rows(raw, pwd_cost)
+            rejected.extend(bad)
+            chunk = good
+            if chunk:
+                flush()
+
+        try:
+            # Rows are checked a chunk at a time, anything that isn't even a
+            # record is rejected on the spot
+            raw = []
+            for idx, row in enumerate(rows):
+                if not isinstance(row, dict):
+                    rejected.append((idx, "Not a customer record"))
+                    continue
+                raw.append((idx, row))
+                if len(raw) >= chunk_size:
+                    clean(raw)
+                    raw = []
+            if raw:
+                clean(raw)
+        finally:
+            if out:
+                out.close()
+
+        rejected.sort()
+        return {'imported': imported, 'rejected': rejected}
+
+    def _users_query(self, city=None, min_balance=None, max_balance=None,
+                     order_by='acc_num', desc=False, after=None, limit=None):
+        # Builds the filtered listing query. Sorting is always (column, id) so
+        # 'after' can pick up exactly where the last page stopped.
+        if order_by not in LIST_ORDERS:
+            raise ValueError(f"Can't sort by {order_by!r}")
+        where, params = [], []
+        if city:
+            where.append("city = ?")
+            params.append(city)
+        if min_balance is not None:
+            where.append("cash_balance >= ?")
+            params.append(as_cents(min_balance))
+        if max_balance is not None:
+            where.append("cash_balance <= ?")
+            params.append(as_cents(max_balance))
+        if after is not None:
+            where.append(f"({order_by}, id) {'<' if desc else '>'} (?, ?)")
+            params.extend(after)
+
+        direction = 'DESC' if desc else 'ASC'
+        sql = f"SELECT {', '.join(LIST_COLS)}, {order_by}, id FROM users"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order_by} {direction}, id {direction}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return sql, params
+
+    @service_call
+    def list_users(self, city=None, min_balance=None, max_balance=None,
+                   order_by='acc_num', desc=False, page_size=100, after=None):
+        # One page of users, pass 'next' back as after for the next one
+        sql, params = self._users_query(city, min_balance, max_balance,
+                                        order_by, desc, after, page_size)
+        cur = self.read_conn().cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+
+        nxt = None
+        if len(rows) == int(page_size):
+            nxt = tuple(rows[-1][-2:])
+        return {'users': [dict(zip(LIST_COLS, r)) for r in rows], 'next': nxt}
+
+    @service_iter
+    def iter_users(self, city=None, min_balance=None, max_balance=None,
+                   order_by='acc_num', desc=False, batch_size=1000):
+        # Streams user dicts with fetchmany, never holds the whole table
+        sql, params = self._users_query(city, min_balance, max_balance,
+                                        order_by, desc)
+        cur = self.read_conn().cursor()
+        cur.execute(sql, params)
+        try:
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                for r in rows:
+                    yield dict(zip(LIST_COLS, r))
+        finally:
+            cur.close()
+
+    @service_call
+    def export_users(self, path, fmt='csv', **filters):
+        # Writes the (filtered) user list to a CSV or JSONL file row by row
+        fmt = fmt.lower()
+        if fmt not in ('csv', 'jsonl'):
+            raise ValueError("Export format must be csv or jsonl")
+
+        # Files are an edge, balances go out as dollar strings like import takes them
+        count = 0
+        try:
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                if fmt == 'csv':
+                    out = csv.DictWriter(f, fieldnames=LIST_COLS)
+                    out.writeheader()
+                    for u in self.iter_users(**filters):
+                        u['cash_balance'] = fmt_money(u['cash_balance'])
+                        out.writerow(u)
+                        count += 1
+                else:
+                    for u in self.iter_users(**filters):
+                        u['cash_balance'] = fmt_money(u['cash_balance'])
+                        f.write(json.dumps(u) + '\n')
+                        count += 1
+        except OSError as e:
+            # Missing folder, no permission, full disk...
+            raise ValueError(f"Can't write {path}: {e.strerror or e}")
+        return {'path': path, 'rows': count}
+
+
+    @service_call
+    def login(self, acc, pwd):
+        # Pays for the KDF once and hands back a session token, later
+        # requests can be checked against that with check_session()
+        gen = self.cache.gen
+        cur = self.conn().cursor()
+        cur.execute(f"SELECT pwd, {', '.join(ACCOUNT_COLS)} FROM users WHERE acc_num = ?",
+                    (acc,))
+        row = cur.fetchone()
+        if not row:
+            # Burn the same time as a real check so unknown accounts don't stand out
+            if self._dummy_hash is None:
+                self._dummy_hash = hash_pwd('', self.pwd_cost)
+            verify_pwd(pwd, self._dummy_hash, self.pwd_cost)
+            raise ValueError("Wrong account number or password!")
+        stored, user = row[0], Account(*row[1:])
+        ok, rehash = verify_pwd(pwd, stored, self.pwd_cost)
+        if not ok:
+            raise ValueError("Wrong account number or password!")
+
+        # Plaintext leftovers and old costs get upgraded while we have the password
+        if rehash:
+            self.run_write(lambda cur: cur.execute(
+                "UPDATE users SET pwd = ?, version = version + 1 WHERE acc_num = ? AND pwd = ?",
+                (hash_pwd(pwd, self.pwd_cost), acc, stored)))
+            self.cache.drop(acc)
+        else:
+            # Fresh from the db anyway, the balance checks that follow can use it
+            self.cache.put(acc, user, user.version, gen)
+
+        # Log it
+        self.audit.login(acc)
+        return {'user': user.as_dict(), 'token': self.sessions.issue(acc)}
+
+    @service_call
+    def check_session(self, token):
+        acc = self.sessions.check(token)
+        if acc is None:
+            raise ValueError("Session expired, please log in again!")
+        return {'acc_num': acc}
+
+    @service_call
+    def logout(self, acc, token=None):
+        if token:
+            self.sessions.revoke(token)
+        self.audit.logout(acc)
+        return {}
+
+    @service_call
+    def prune_logins(self, keep_days):
+        # Retention cap for login_info, deletes in small chunks
+        gone = 0
+        while True:
+            n = self.run_write(lambda cur: audit.prune(cur, keep_days))
+            if not n:
+                return {'deleted': gone}
+            gone += n
+
+    @service_call
+    def get_user(self, acc):
+        return {'user': self._cached_user(acc).as_dict()}
+
+    @service_call
+    def balance(self, acc):
+        return {'balance': self._cached_user(acc).cash_balance}
+
+
+    # Balance engine. Everything works on the row in the db with relative,
+    # guarded updates, so parallel sessions can't clobber each other.
+    # Every UPDATE bumps version, the cache is written through after commit.
+
+    def _add_cash(self, cur, acc, amt):
+        cur.execute("""
+            UPDATE users
+            SET cash_balance = cash_balance + ?, version = version + 1
+            WHERE acc_num = ?
+        """, (amt, acc))
+        if cur.rowcount != 1:
+            raise ValueError("Account not found!")
+
+    def _take_cash(self, cur, acc, amt):
+        # Only goes through if the floor still holds at write time
+        cur.execute("""
+            UPDATE users
+            SET cash_balance = cash_balance - ?, version = version + 1
+            WHERE acc_num = ? AND cash_balance - ? >= ?
+        """, (amt, acc, amt, MIN_BALANCE_CENTS))
+        if cur.rowcount != 1:
+            cur.execute("SELECT 1 FROM users WHERE acc_num = ?", (acc,))
+            if not cur.fetchone():
+                raise ValueError("Account not found!")
+            raise ValueError(f"Can't go below ${MIN_BALANCE}!")
+
+    def _new_balance(self, cur, acc):
+        # (balance, version) after this transaction's updates
+        cur.execute("SELECT cash_balance, version FROM users WHERE acc_num = ?", (acc,))
+        return cur.fetchone()
+
+    def limited(self, acc, amt, work):
+        # run_write(work) for money leaving acc, counted against the velocity
+        # limits first so a refused move never takes the write lock
+        if not self.velocity:
+            return self.run_write(work)
+        held = self.velocity.reserve(acc, amt)
+        try:
+            return self.run_write(work)
+        except Exception:
+            self.velocity.cancel(acc, amt, held)
+            raise
+
+    @service_call
+    def credit(self, acc, amt):
+        amt = as_cents(amt)
+        if amt <= 0:
+            raise ValueError("Amount needs to be positive!")
+
+        def work(cur):
+            self._add_cash(cur, acc, amt)
+            cur.execute("""
+                INSERT INTO money_moves (acc_num, move_type, amount)
+                VALUES (?, 'CREDIT', ?)
+            """, (acc, amt))
+            return self._new_balance(cur, acc)
+
+        bal, version = self.run_write(work)
+        self.cache.write(acc, version, cash_balance=bal)
+        return {'amount': amt, 'balance': bal}
+
+    @service_call
+    def debit(self, acc, amt):
+        amt = as_cents(amt)
+        if amt <= 0:
+            raise ValueError("Amount needs to be positive!")
+
+        def work(cur):
+            self._take_cash(cur, acc, amt)
+            cur.execute("""
+                INSERT INTO money_moves (acc_num, move_type, amount)
+                VALUES (?, 'DEBIT', ?)
+            """, (acc, amt))
+            return self._new_balance(cur, acc)
+
+        bal, version = self.limited(acc, amt, work)
+        self.cache.write(acc, version, cash_balance=bal)
+        return {'amount': amt, 'balance': bal}
+
+    @service_call
+    def transfer(self, acc, to_acc, amt):
+        amt = as_cents(amt)
+        if amt <= 0:
+            raise ValueError("Amount needs to be positive!")
+        if to_acc == acc:
+            raise ValueError("Can't send money to yourself!")
+
+        def work(cur):
+            cur.execute("SELECT 1 FROM users WHERE acc_num = ?", (to_acc,))
+            if not cur.fetchone():
+                raise ValueError("Account not found!")
+            self._take_cash(cur, acc, amt)
+            self._add_cash(cur, to_acc, amt)
+            cur.execute("""
+                INSERT INTO money_moves (acc_num, move_type, amount, to_acc)
+                VALUES (?, 'TRANSFER', ?, ?)
+            """, (acc, amt, to_acc))
+            return self._new_balance(cur, acc)
+
+        bal, version = self.limited(acc, amt, work)
+        self.cache.write(acc, version, cash_balance=bal)
+        self.cache.drop(to_acc)
+        return {'amount': amt, 'to_acc': to_acc, 'balance': bal}
+
+
+    @service_call
+    def statement(self, acc, start=None, end=None, page_size=50, after=None):
+        # One page of history, newest first. start/end are inclusive
+        # YYYY-MM-DD dates, after is the 'next' value of the previous page.
+        start, end = statement_range(start, end)
+        if after is None:
+            after = (end, 0)
+        page_size = int(page_size)
+        if page_size < 1:
+            raise ValueError("Page size needs to be positive!")
+
+        # Each half is a bounded range scan on its own index, so only about
+        # page_size rows per side get touched no matter how big the table is
+        cur = self.conn().cursor()
+        cur.execute("""
+            SELECT * FROM (
+                SELECT id, acc_num, move_type, amount, to_acc, when_moved
+                FROM money_moves
+                WHERE acc_num = ? AND when_moved >= ? AND when_moved < ?
+                AND (when_moved, id) < (?, ?)
+                ORDER BY when_moved DESC, id DESC LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT id, acc_num, move_type, amount, to_acc, when_moved
+                FROM money_moves
+                WHERE to_acc = ? AND when_moved >= ? AND when_moved < ?
+                AND (when_moved, id) < (?, ?)
+                ORDER BY when_moved DESC, id DESC LIMIT ?
+            )
+            ORDER BY when_moved DESC, id DESC LIMIT ?
+        """, (acc, start, end, after[0], after[1], page_size,
+              acc, start, end, after[0], after[1], page_size, page_size))
+        rows = cur.fetchall()
+
+        # Archived months (see archive.py). A full page only needs the
+        # archived rows that are newer than its oldest one.
+        low = rows[-1][-1] if len(rows) == page_size else start
+        old = self.archive.statement_rows(cur, acc, low, end, after, page_size)
+        if old:
+            rows = sorted(rows + old, key=lambda r: (r[-1], r[0]), reverse=True)[:page_size]
+
+        moves = []
+        for row in rows:
+            move = dict(zip(MOVE_COLS, row))
+            if move['move_type'] == 'TRANSFER':
+                move['direction'] = 'OUT' if move['acc_num'] == acc else 'IN'
+            else:
+                move['direction'] = 'IN' if move['move_type'] == 'CREDIT' else 'OUT'
+            moves.append(move)
+
+        nxt = None
+        if len(moves) == page_size:
+            nxt = (moves[-1]['when_moved'], moves[-1]['id'])
+        return {'moves': moves, 'next': nxt}
+
+    @service_iter
+    def iter_statement(self, acc, start=None, end=None, page_size=50):
+        # Streams statement pages until the range runs out
+        after = None
+        while True:
+            res = self.statement(acc, start, end, page_size, after)
+            if not res['ok']:
+                raise ValueError(res['error'])
+            if res['moves']:
+                yield res['moves']
+            after = res['next']
+            if after is None:
+                return
+
+
+    @service_call
+    def move_totals(self, period='day', start=None, end=None, acc_num=None,
+                    move_type=None, city=None, by=('period', 'move_type')):
+        # Dashboard numbers from the rollup tables, cost depends on the number
+        # of periods/accounts asked for and not on the number of moves
+        sql, params, by = rollups.report_query(period, start, end, acc_num,
+                                               move_type, city, by)
+        cur = self.read_conn().cursor()
+        cur.execute(sql, params)
+        cols = by + ('moves', 'total')
+        return {'rows': [dict(zip(cols, r)) for r in cur.fetchall()]}
+
+
+    @service_call
+    def change_pwd(self, acc, old_pwd, new_pwd):
+        check_pwd(new_pwd)
+        cur = self.conn().cursor()
+        cur.execute("SELECT pwd FROM users WHERE acc_num = ?", (acc,))
+        row = cur.fetchone()
+        if not row:
+            raise ValueError("Account not found!")
+        stored = row[0]
+        if not verify_pwd(old_pwd, stored, self.pwd_cost)[0]:
+            raise ValueError("Wrong password!")
+        new_hash = hash_pwd(new_pwd, self.pwd_cost)
+
+        def work(cur):
+            # Only if nobody changed it since we checked
+            cur.execute("""
+                UPDATE users
+                SET pwd = ?, version = version + 1
+                WHERE acc_num = ? AND pwd = ?
+            """, (new_hash, acc, stored))
+            if cur.rowcount != 1:
+                raise ValueError("Wrong password!")
+
+        self.run_write(work)
+        self.cache.drop(acc)
+        # Old sessions go with the old password
+        self.sessions.revoke_acc(acc)
+        return {}
+
+    @service_call
+    def migrate_passwords(self, chunk_size=500):
+        # One-off upgrade of every plaintext password left in users, in small
+        # transactions so logins keep working while it runs
+        done = 0
+        last_id = 0
+        cur = self.conn().cursor()
+        while True:
+            cur.execute("""
+                SELECT id, pwd FROM users
+                WHERE id > ? AND pwd NOT LIKE ?
+                ORDER BY id LIMIT ?
+            """, (last_id, 'pbkdf2_sha256$%', chunk_size))
+            rows = cur.fetchall()
+            if not rows:
+                self.cache.clear()
+                return {'migrated': done}
+            last_id = rows[-1][0]
+            hashed = [(hash_pwd(pwd, self.pwd_cost), uid, pwd) for uid, pwd in rows]
+
+            def work(cur):
+                cur.executemany(
+                    "UPDATE users SET pwd = ?, version = version + 1 WHERE id = ? AND pwd = ?",
+                    hashed)
+                return cur.rowcount
+
+            done += self.run_write(work)
+
+    @service_call
+    def update_info(self, acc, name=None, city=None, phone=None, email=None):
+        # Anything left as None keeps its current value
+        def work(cur):
+            user = self._fetch_user(cur, acc)
+            new = {
+                'name': name or user.name,
+                'city': city or user.city,
+                'phone': phone or user.phone,
+                'email': email or user.email,
+            }
+            check_name(new['name'])
+            check_phone(new['phone'])
+            check_email(new['email'])
+
+            cur.execute("""
+                UPDATE users
+                SET name = ?, city = ?, phone = ?, email = ?, version = version + 1
+                WHERE acc_num = ?
+            """, (new['name'], new['city'], new['phone'], new['email'], acc))
+            return user.replace(version=user.version + 1, **new), new
+
+        user, new = self.run_write(work)
+        self.cache.write(acc, user.version, **new)
+        return {'user': user.as_dict()}
+
+
+    @service_call
+    def apply_batch(self, moves, chunk_size=500):
+        # Non-interactive path for payroll/settlement files.
+        # moves: iterable of dicts with acc_num, move_type, amount (cents) and
+        # to_acc (TRANSFER only). Every chunk is one transaction, bad rows are
+        # rejected one by one instead of killing the whole file.
+        applied = 0
+        rejected = []
+        chunk = []
+
+        for idx, move in enumerate(moves):
+            chunk.append((idx, move))
+            if len(chunk) >= chunk_size:
+                done, bad = self._apply_chunk(chunk)
+                applied += done
+                rejected.extend(bad)
+                chunk = []
+
+        if chunk:
+            done, bad = self._apply_chunk(chunk)
+            applied += done
+            rejected.extend(bad)
+
+        return {'applied': applied, 'rejected': rejected}
+
+    def _load_balances(self, cur, accs):
+        # Stay under SQLite's host parameter limit
+        accs = list(accs)
+        balances = {}
+        for i in range(0, len(accs), 500):
+            part = accs[i:i + 500]
+            marks = ','.join('?' * len(part))
+            cur.execute(
+                f"SELECT acc_num, cash_balance FROM users WHERE acc_num IN ({marks})",
+                part)
+            balances.update(cur.fetchall())
+        return balances
+
+    def _apply_chunk(self, chunk):
+        try:
+            res = self.run_write(lambda cur: self._apply_chunk_locked(cur, chunk, 'batch'))
+        except sqlite3.Error as e:
+            # Only this chunk is lost, earlier chunks are already committed
+            return 0, [(idx, f"Batch failed: {str(e)}") for idx, _ in chunk]
+        self.cache.drop(*{str(move[key]) for _, move in chunk
+                          for key in ('acc_num', 'to_acc') if move.get(key)})
+        return res
+
+    def _apply_chunk_locked(self, cur, chunk, via):
+        # Runs inside the write lock, so the balances read here can't go stale.
+        # via marks the money_moves rows, see MOVES_DDL.
+        accs = set()
+        for _, move in chunk:
+            accs.add(str(move.get('acc_num', '')))
+            if move.get('to_acc'):
+                accs.add(str(move['to_acc']))
+        balances = self._load_balances(cur, accs)
+
+        deltas = {}
+        rows = []
+        rejected = []
+
+        for idx, move in chunk:
+            try:
+                acc = str(move.get('acc_num', ''))
+                kind = str(move.get('move_type', '')).upper()
+                to_acc = move.get('to_acc')
+                to_acc = str(to_acc) if to_acc else None
+                amt = as_cents(move.get('amount'))
+
+                if kind not in MOVE_TYPES:
+                    raise ValueError(f"Unknown move type {kind!r}")
+                if not amt > 0:
+                    raise ValueError("Amount needs to be positive!")
+                if acc not in balances:
+                    raise ValueError("Account not found!")
+
+                if kind == 'CREDIT':
+                    balances[acc] += amt
+                    deltas[acc] = deltas.get(acc, 0) + amt
+                    rows.append((acc, kind, amt, None, via))
+                    continue
+
+                if kind == 'TRANSFER':
+                    if not to_acc or to_acc not in balances:
+                        raise ValueError("Receiver account not found!")
+                    if to_acc == acc:
+                        raise ValueError("Can't send money to yourself!")
+
+                if balances[acc] - amt < MIN_BALANCE_CENTS:
+                    raise ValueError(f"Can't go below ${MIN_BALANCE}!")
+
+                balances[acc] -= amt
+                deltas[acc] = deltas.get(acc, 0) - amt
+                if kind == 'TRANSFER':
+                    balances[to_acc] += amt
+                    deltas[to_acc] = deltas.get(to_acc, 0) + amt
+                rows.append((acc, kind, amt, to_acc, via))
+
+            except (TypeError, ValueError) as e:
+                rejected.append((idx, str(e)))
+
+        if not rows:
+            return 0, rejected
+
+        cur.executemany("""
+            UPDATE users
+            SET cash_balance = cash_balance + ?, version = version + 1
+            WHERE acc_num = ?
+        """, [(d, acc) for acc, d in deltas.items()])
+
+        cur.executemany("""
+            INSERT INTO money_moves (acc_num, move_type, amount, to_acc, via)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+
+        return len(rows), rejected
+
+
+    # Standing orders, see standing.py
+
+    @service_call
+    def add_standing_order(self, acc, to_acc, amt, every, start=None):
+        # Transfers amt (cents) to to_acc every day/week/month from start
+        # (text, default now) on, the first one at start
+        amt = as_cents(amt)
+        if amt <= 0:
+            raise ValueError("Amount needs to be positive!")
+        if to_acc == acc:
+            raise ValueError("Can't send money to yourself!")
+        if every not in standing.EVERY:
+            raise ValueError(f"Has to repeat every {', '.join(standing.EVERY)}!")
+        start = standing.parse_start(start) if start else standing.now()
+
+        def work(cur):
+            for num in (acc, to_acc):
+                cur.execute("SELECT 1 FROM users WHERE acc_num = ?", (num,))
+                if not cur.fetchone():
+                    raise ValueError("Account not found!")
+            cur.execute('''
+                INSERT INTO standing_orders (acc_num, to_acc, amount, every, start, next_run)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (acc, to_acc, amt, every, start, start))
+            return cur.lastrowid
+
+        order_id = self.run_write(work)
+        if self.scheduler:
+            self.scheduler.add(start, order_id)
+        return {'order_id': order_id, 'next_run': start}
+
+    @service_call
+    def standing_orders(self, acc):
+        cur = self.conn().cursor()
+        cur.execute(f'''
+            SELECT {', '.join(standing.ORDER_COLS)} FROM standing_orders
+            WHERE acc_num = ? AND active = 1
+            ORDER BY id
+        ''', (acc,))
+        return {'orders': [dict(zip(standing.ORDER_COLS, row)) for row in cur.fetchall()]}
+
+    @service_call
+    def cancel_standing_order(self, acc, order_id):
+        def work(cur):
+            cur.execute('''
+                UPDATE standing_orders SET active = 0
+                WHERE id = ? AND acc_num = ? AND active = 1
+            ''', (order_id, acc))
+            if cur.rowcount != 1:
+                raise ValueError("Standing order not found!")
+
+        self.run_write(work)
+        return {'order_id': order_id}
+
+    @service_call
+    def run_standing_orders(self, chunk_size=standing.CHUNK):
+        # Runs every order due by now, chunk_size per transaction with the
+        # apply_batch checks. The transfers and the orders' next_run commit
+        # together.
+        when = standing.now()
+
+        def work(cur):
+            orders = standing.due_orders(cur, when, chunk_size)
+            if not orders:
+                return orders, 0, []
+            moves = [(pos, {'acc_num': acc, 'move_type': 'TRANSFER', 'amount': amt,
+                            'to_acc': to_acc})
+                     for pos, (_, acc, to_acc, amt, _, _, _) in enumerate(orders)]
+            done, rejected = self._apply_chunk_locked(cur, moves, 'standing')
+            standing.reschedule(cur, orders, dict(rejected), when)
+            return orders, done, rejected
+
+        applied = failed = 0
+        while True:
+            orders, done, rejected = self.run_write(work)
+            applied += done
+            failed += len(rejected)
+            self.cache.drop(*{acc for order in orders for acc in order[1:3]})
+            if len(orders) < chunk_size:
+                return {'applied': applied, 'failed': failed}
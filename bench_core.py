@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import platform
+import tempfile
+import itertools
+import threading
+
+from auth import PWD_COST, hash_pwd
+from bank_service import BankingService
+from acc_cache import CACHE_SIZE
+from metrics import Metrics, SQL_EVERY
+
+# Synthetic workload for the banking core. Seeds a scratch banking_system.db
+# with N accounts and replays a mix of logins, balance checks, credits,
+# debits and transfers from a few threads, picking accounts with a Zipf skew
+# so a handful of hot accounts get most of the traffic. Prints ops/sec and
+# p50/p95/p99 per op, and --json writes the same numbers for regression
+# tracking ('-' for stdout). Everything goes through BankingService, so no
+# prompts and nothing to type.
+#
+# Usage: python bench_core.py [--accounts N] [--ops N] [--threads N]
+#            [--mix login=5,balance=40,credit=20,debit=15,transfer=20]
+#            [--skew S] [--seed N] [--pwd-cost N] [--db FILE] [--json FILE]
+#            [--metrics FILE] [--sql-every N] [--cache-size N]
+#
+# --skew 0 is uniform, ~1.1 is a realistic hot set. --db has to be a new
+# file, by default a temp dir is used and thrown away. --metrics runs with
+# instrumentation on and dumps it to FILE. Compare CPU per op (all threads of
+# the process, audit writer included) to see its cost, ops/sec swings too
+# much from run to run on a shared box for a few percent to show.
+# --sql-every is passed on to it (see metrics.py). --cache-size 0 runs
+# without the account cache (see acc_cache.py).
+
+OPS = ('login', 'balance', 'credit', 'debit', 'transfer')
+DEFAULTS = {
+    'accounts': 10000,
+    'ops': 20000,
+    'threads': 4,
+    'mix': 'login=5,balance=40,credit=20,debit=15,transfer=20',
+    'skew': 1.1,
+    'seed': 1,
+    'pwd-cost': PWD_COST,
+    'db': None,
+    'json': None,
+    'metrics': None,
+    'sql-every': SQL_EVERY,
+    'cache-size': CACHE_SIZE,
+}
+
+PWD = 'Bench#Pass1'
+START_CASH = 10000000   # cents, enough that debits rarely hit the floor
+SEED_CHUNK = 5000
+
+
+def parse_args(argv):
+    conf = dict(DEFAULTS)
+    args = iter(argv)
+    for arg in args:
+        key = arg.lstrip('-')
+        if not arg.startswith('--') or key not in conf:
+            raise ValueError(f"Unknown option {arg}")
+        try:
+            conf[key] = next(args)
+        except StopIteration:
+            raise ValueError(f"{arg} needs a value")
+    for key in ('accounts', 'ops', 'threads', 'seed', 'pwd-cost', 'sql-every', 'cache-size'):
+        conf[key] = int(conf[key])
+    conf['skew'] = float(conf['skew'])
+    conf['mix'] = parse_mix(conf['mix'])
+    if conf['accounts'] < 2:
+        raise ValueError("Need at least 2 accounts for transfers")
+    return conf
+
+
+def parse_mix(text):
+    # "login=5,balance=40" -> {'login': 5.0, 'balance': 40.0}
+    mix = {}
+    for part in text.split(','):
+        op, _, weight = part.partition('=')
+        op = op.strip()
+        if op not in OPS:
+            raise ValueError(f"Unknown op {op!r} in mix, pick from {', '.join(OPS)}")
+        mix[op] = float(weight)
+    if not sum(mix.values()) > 0:
+        raise ValueError("Mix weights have to add up to something")
+    return mix
+
+
+def seed(bank, n, pwd_cost):
+    # Real account numbers from the sequence, one hash shared by everyone
+    # (the KDF is only measured on login, not while seeding)
+    pwd = hash_pwd(PWD, pwd_cost)
+    accs = []
+    while len(accs) < n:
+        size = min(SEED_CHUNK, n - len(accs))
+
+        def work(cur):
+            nums = bank.take_acc_nums(cur, size)
+            cur.executemany('''
+                INSERT INTO users (name, acc_num, dob, city, pwd, cash_balance,
+                                   phone, email)
+                VALUES ('Bench User', ?, '2000-01-01', ?, ?, ?,
+                        '0000000000', 'bench@test.com')
+            ''', [(a, f"City {i % 50}", pwd, START_CASH) for i, a in enumerate(nums)])
+            cur.executemany('''
+                INSERT INTO money_moves (acc_num, move_type, amount)
+                VALUES (?, 'CREDIT', ?)
+            ''', [(a, START_CASH) for a in nums])
+            return nums
+
+        accs.extend(bank.run_write(work))
+    return accs
+
+
+def zipf_weights(n, skew):
+    # Cumulative weights for rank 1..n, for random.choices(cum_weights=...)
+    return list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+def percentile(sorted_vals, pct):
+    # Nearest rank
+    if not sorted_vals:
+        return None
+    idx = max(0, min(len(sorted_vals) - 1, int(round(pct / 100 * len(sorted_vals))) - 1))
+    return sorted_vals[idx]
+
+
+def worker(bank, accs, cum, conf, n_ops, seed_num, out):
+    rnd = random.Random(seed_num)
+    ops = list(conf['mix'])
+    weights = [conf['mix'][op] for op in ops]
+    times = {op: [] for op in OPS}
+    failed = {op: 0 for op in OPS}
+
+    plan = rnd.choices(ops, weights, k=n_ops)
+    picks = rnd.choices(accs, cum_weights=cum, k=n_ops * 2)
+    for i, op in enumerate(plan):
+        acc = picks[2 * i]
+        amt = rnd.randint(100, 50000)
+        start = time.perf_counter()
+        if op == 'login':
+            res = bank.login(acc, PWD)
+        elif op == 'balance':
+            res = bank.balance(acc)
+        elif op == 'credit':
+            res = bank.credit(acc, amt)
+        elif op == 'debit':
+            res = bank.debit(acc, amt)
+        else:
+            to_acc = picks[2 * i + 1]
+            if to_acc == acc:
+                to_acc = accs[(accs.index(acc) + 1) % len(accs)]
+            res = bank.transfer(acc, to_acc, amt)
+        times[op].append(time.perf_counter() - start)
+        if not res['ok']:
+            failed[op] += 1
+    bank.release()
+    out.append((times, failed))
+
+
+def run(conf, path):
+    metrics = None
+    if conf['metrics']:
+        metrics = Metrics(dump_path=conf['metrics'], sql_every=conf['sql-every'])
+    bank = BankingService(path, pwd_cost=conf['pwd-cost'], metrics=metrics,
+                          cache_size=conf['cache-size'])
+    start = time.perf_counter()
+    accs = seed(bank, conf['accounts'], conf['pwd-cost'])
+    seed_secs = time.perf_counter() - start
+
+    # Hot accounts are spread over the number range, not the first ones
+    ranked = list(accs)
+    random.Random(conf['seed']).shuffle(ranked)
+    cum = zipf_weights(len(ranked), conf['skew'])
+
+    out = []
+    per_thread = [conf['ops'] // conf['threads']] * conf['threads']
+    per_thread[0] += conf['ops'] % conf['threads']
+    threads = [threading.Thread(target=worker,
+                                args=(bank, ranked, cum, conf, n, conf['seed'] * 1000 + i, out))
+               for i, n in enumerate(per_thread)]
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    secs = time.perf_counter() - start
+    cpu_secs = time.process_time() - cpu_start
+    cache = bank.cache.stats()
+    bank.close_all()
+
+    report = {
+        'config': {k: v for k, v in conf.items() if k not in ('db', 'json', 'metrics')},
+        'metrics': bool(metrics),
+        'env': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'seed_seconds': round(seed_secs, 3),
+        'seconds': round(secs, 3),
+        'total_ops': conf['ops'],
+        'ops_per_sec': round(conf['ops'] / secs, 1),
+        'cpu_us_per_op': round(cpu_secs / conf['ops'] * 1e6, 1),
+        'cache': cache,
+        'ops': {},
+    }
+    for op in OPS:
+        vals = sorted(v for times, _ in out for v in times[op])
+        if not vals:
+            continue
+        report['ops'][op] = {
+            'count': len(vals),
+            'failed': sum(failed[op] for _, failed in out),
+            'ops_per_sec': round(len(vals) / secs, 1),
+            'mean_ms': round(sum(vals) / len(vals) * 1000, 3),
+            'p50_ms': round(percentile(vals, 50) * 1000, 3),
+            'p95_ms': round(percentile(vals, 95) * 1000, 3),
+            'p99_ms': round(percentile(vals, 99) * 1000, 3),
+        }
+    return report
+
+
+def print_report(report):
+    conf = report['config']
+    print(f"{conf['accounts']} accounts seeded in {report['seed_seconds']:.1f}s, "
+          f"{report['total_ops']} ops on {conf['threads']} threads, skew {conf['skew']}")
+    print(f"{report['ops_per_sec']:.0f} ops/sec overall ({report['seconds']:.1f}s, "
+          f"{report['cpu_us_per_op']:.0f}us CPU per op)")
+    cache = report['cache']
+    if cache['max_size']:
+        rate = f"{cache['hit_rate']:.1%}" if cache['hit_rate'] is not None else '-'
+        print(f"Account cache: {rate} hits ({cache['hits']} hits, {cache['misses']} misses, "
+              f"{cache['reconciled']} reconciled)")
+    print()
+    print(f"{'Op':<10} {'Count':>8} {'Failed':>7} {'ops/sec':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    print("-" * 67)
+    for op, s in report['ops'].items():
+        print(f"{op:<10} {s['count']:>8} {s['failed']:>7} {s['ops_per_sec']:>9.1f} "
+              f"{s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} {s['p99_ms']:>9.3f}")
+
+
+def main():
+    try:
+        conf = parse_args(sys.argv[1:])
+    except ValueError as e:
+        print(f"Oops: {str(e)}")
+        sys.exit(1)
+
+    if conf['db']:
+        if os.path.exists(conf['db']):
+            print(f"{conf['db']} already exists, the benchmark only runs on a new file")
+            sys.exit(1)
+        report = run(conf, conf['db'])
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            report = run(conf, os.path.join(tmp, 'banking_system.db'))
+
+    if conf['json'] == '-':
+        print(json.dumps(report, indent=2))
+        return
+    print_report(report)
+    if conf['json']:
+        with open(conf['json'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {conf['json']}")
+
+
+if __name__ == "__main__":
+    main()
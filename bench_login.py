@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import tempfile
+
+from auth import PWD_COST, hash_pwd
+from bank_service import BankingService
+
+# Logins/sec and session checks/sec at different KDF costs, to size PWD_COST
+# against the peak login rate.
+# Usage: python bench_login.py [seconds per cost] [cost ...]
+
+PWD = 'Bench#Pass1'
+
+
+def bench(cost, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        bank = BankingService(os.path.join(tmp, 'bench.db'), pwd_cost=cost)
+        db = bank.conn()
+        db.execute('''
+            INSERT INTO users (name, acc_num, dob, city, pwd, cash_balance,
+                               phone, email)
+            VALUES ('Bench User', '0000000001', '2000-01-01', 'Nowhere', ?, 500000,
+                    '0000000000', 'bench@test.com')
+        ''', (hash_pwd(PWD, cost),))
+        db.commit()
+
+        logins = 0
+        token = None
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            res = bank.login('0000000001', PWD)
+            assert res['ok'], res
+            token = res['token']
+            logins += 1
+        login_rate = logins / (time.perf_counter() - start)
+
+        checks = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            for _ in range(1000):
+                bank.check_session(token)
+            checks += 1000
+        check_rate = checks / (time.perf_counter() - start)
+
+        bank.close_all()
+    return login_rate, check_rate
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    costs = [int(c) for c in sys.argv[2:]] or [10000, 100000, 310000, PWD_COST]
+
+    print(f"{'Iterations':>12} {'ms/login':>10} {'logins/sec':>12} {'checks/sec':>12}")
+    print("-" * 50)
+    for cost in costs:
+        login_rate, check_rate = bench(cost, seconds)
+        print(f"{cost:>12} {1000 / login_rate:>10.2f} {login_rate:>12.1f} {check_rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
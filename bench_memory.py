@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+from bank_service import BankingService, Account, ACCOUNT_COLS, USER_COLS
+from bench_core import seed
+
+# Memory of bulk account loads: every account of a scratch bank held in a
+# list, as SELECT * tuples, as dicts (what user dicts cost) and as slotted
+# Account records from the row_factory. tracemalloc counts what the list
+# keeps after loading and the peak while it loads.
+# The seeded accounts share 50 cities and one birthday (see bench_core.py),
+# so the interning in Account.from_row does a bit better here than on a
+# real customer base with thousands of distinct birthdays.
+#
+# Usage: python bench_memory.py [--accounts N]   (default 200000)
+
+CHUNK = 10000
+PWD_COST = 1000
+
+
+def load(cur, sql, convert=None):
+    cur.execute(sql)
+    out = []
+    while True:
+        rows = cur.fetchmany(CHUNK)
+        if not rows:
+            return out
+        out.extend(map(convert, rows) if convert else rows)
+
+
+def as_dict(row):
+    user = dict(zip(USER_COLS, row))
+    del user['pwd']
+    return user
+
+
+def measure(name, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = fn()
+    secs = time.perf_counter() - start
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'name': name, 'rows': len(rows), 'kept': kept, 'peak': peak, 'seconds': secs}
+
+
+def run(path, n):
+    bank = BankingService(path, pwd_cost=PWD_COST)
+    seed(bank, n, PWD_COST)
+    db = bank.conn()
+
+    def records():
+        cur = db.cursor()
+        cur.row_factory = Account.from_row
+        return load(cur, f"SELECT {', '.join(ACCOUNT_COLS)} FROM users")
+
+    results = [
+        measure('SELECT * tuples', lambda: load(db.cursor(), "SELECT * FROM users")),
+        measure('dicts', lambda: load(db.cursor(), "SELECT * FROM users", as_dict)),
+        measure('Account records', records),
+    ]
+    bank.close_all()
+    return results
+
+
+def main():
+    args = sys.argv[1:]
+    n = int(args[args.index('--accounts') + 1]) if '--accounts' in args else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(os.path.join(tmp, 'banking_system.db'), n)
+
+    base = results[0]['kept']
+    print(f"{n} accounts\n")
+    print(f"{'Load':<18} {'Kept MB':>9} {'Peak MB':>9} {'B/acc':>7} {'vs tuples':>10} {'Secs':>6}")
+    print("-" * 64)
+    for r in results:
+        print(f"{r['name']:<18} {r['kept'] / 2**20:>9.1f} {r['peak'] / 2**20:>9.1f} "
+              f"{r['kept'] / r['rows']:>7.0f} {r['kept'] / base:>9.0%} {r['seconds']:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
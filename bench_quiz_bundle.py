@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import tempfile
+
+import db_init
+import quiz_bundle
+
+# Start-up cost of a big question bank: a scratch quiz_app.db with N
+# questions is compiled into a bundle, then timed
+#   db load       every quiz and question read out of SQLite and parsed, what
+#                 a front end with its questions in memory pays at start
+#   bundle open   mmap + quiz table, what the quiz apps pay at start now
+#   first quiz    one quiz's questions decoded from the bundle
+#
+# Usage: python bench_quiz_bundle.py [--questions N] [--per-quiz N]   (300000, 1000)
+
+
+def make_db(path, n, per_quiz, seed=3):
+    rnd = random.Random(seed)
+    db_init.DB_FILE = path
+    db_init.setup_database()
+    conn = sqlite3.connect(path)
+    n_quizzes = (n + per_quiz - 1) // per_quiz
+    conn.executemany("INSERT INTO quizzes (name) VALUES (?)",
+                     [(f"Quiz {i}",) for i in range(n_quizzes)])
+    rows = []
+    for i in range(n):
+        options = [f"Option {rnd.randint(0, 10**6)}, or so" for _ in range(4)]
+        rows.append((i // per_quiz + 1, f"Question number {i}: which one is right?",
+                     json.dumps(options), rnd.choice(options)))
+    conn.executemany("INSERT INTO quiz_questions (quiz_id, question, options, answer) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def db_load(path):
+    conn = sqlite3.connect(path)
+    quizzes = {quiz_id: (name, []) for quiz_id, name in conn.execute("SELECT id, name FROM quizzes")}
+    for quiz_id, question, options, answer in conn.execute(
+            "SELECT quiz_id, question, options, answer FROM quiz_questions ORDER BY quiz_id, id"):
+        options = quiz_bundle.parse_options(options)
+        quizzes[quiz_id][1].append((question, options, options.index(answer)))
+    conn.close()
+    return quizzes
+
+
+def timed(fn):
+    start = time.perf_counter()
+    res = fn()
+    return res, time.perf_counter() - start
+
+
+def main():
+    args = sys.argv[1:]
+    n = int(args[args.index('--questions') + 1]) if '--questions' in args else 300000
+    per_quiz = int(args[args.index('--per-quiz') + 1]) if '--per-quiz' in args else 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'quiz_app.db')
+        out = os.path.join(tmp, 'quiz_app.qzb')
+        make_db(db_path, n, per_quiz)
+
+        info, build_secs = timed(lambda: quiz_bundle.build(db_path, out))
+        loaded, db_secs = timed(lambda: db_load(db_path))
+        bundle, open_secs = timed(lambda: quiz_bundle.Bundle(out))
+        quiz_id = bundle.quizzes()[len(bundle.quizzes()) // 2][0]
+        first, quiz_secs = timed(lambda: list(bundle.questions(quiz_id)))
+
+        # Same questions either way
+        name, want = loaded[quiz_id]
+        if first != want:
+            print("The bundle and the db disagree!")
+            sys.exit(1)
+        bundle.close()
+
+        print(f"{n} questions in {info['quizzes']} quizzes")
+        print(f"db {os.path.getsize(db_path) / 2**20:.1f} MB, "
+              f"bundle {info['bytes'] / 2**20:.1f} MB, built in {build_secs:.2f}s\n")
+        print(f"{'Start-up':<14} {'ms':>10}")
+        print("-" * 25)
+        print(f"{'db load':<14} {db_secs * 1000:>10.1f}")
+        print(f"{'bundle open':<14} {open_secs * 1000:>10.2f}")
+        print(f"{'first quiz':<14} {quiz_secs * 1000:>10.2f}   ({len(first)} questions)")
+
+
+if __name__ == "__main__":
+    main()
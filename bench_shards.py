@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import multiprocessing
+
+import bank_service
+from auth import hash_pwd
+from bank_service import acc_num_for, ACC_SEQ, ACC_CHECK_DIGIT
+from shards import ShardedBank, shard_index
+
+# Write throughput against the number of shards. For every shard count it
+# seeds the same accounts, then a pool of processes does credits, debits and
+# transfers (some of them cross-shard) for a fixed time.
+#
+# Usage: python bench_shards.py [--shards 1,2,4,8] [--procs N] [--seconds S]
+#            [--accounts N] [--cross F] [--sync FULL|NORMAL] [--json FILE]
+#
+# --sync FULL (the default here) makes every commit wait for the disk like a
+# real durable deployment, which is where the single write lock hurts. With
+# NORMAL and few cores the Python side is the limit, not the lock.
+
+DEFAULTS = {
+    'shards': '1,2,4,8',
+    'procs': 8,
+    'seconds': 5.0,
+    'accounts': 4000,
+    'cross': 0.1,
+    'sync': 'FULL',
+    'json': None,
+}
+
+PWD_COST = 1000
+START_CASH = 100000000
+
+
+def seed(base, n, n_accs):
+    bank = ShardedBank(base, n, pwd_cost=PWD_COST)
+    pwd = hash_pwd('Bench#Pass1', PWD_COST)
+    accs = [acc_num_for(ACC_SEQ[ACC_CHECK_DIGIT][1] + i) for i in range(n_accs)]
+    parts = [[] for _ in range(n)]
+    for acc in accs:
+        parts[shard_index(acc, n)].append(acc)
+    for shard, part in zip(bank.shards, parts):
+        shard.run_write(lambda cur: cur.executemany('''
+            INSERT INTO users (name, acc_num, dob, city, pwd, cash_balance, phone, email)
+            VALUES ('Bench User', ?, '2000-01-01', 'Nowhere', ?, ?, '0000000000',
+                    'bench@test.com')
+        ''', [(a, pwd, START_CASH) for a in part]))
+    bank.close_all()
+    return parts
+
+
+def worker(base, n, parts, seconds, cross, sync, seed_num):
+    bank_service.SYNCHRONOUS = sync
+    bank = ShardedBank(base, n, pwd_cost=PWD_COST)
+    rnd = random.Random(seed_num)
+    done = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        home = parts[rnd.randrange(n)]
+        acc = rnd.choice(home)
+        kind = rnd.random()
+        if kind < cross and n > 1:
+            other = parts[(parts.index(home) + 1 + rnd.randrange(n - 1)) % n]
+            res = bank.transfer(acc, rnd.choice(other), rnd.randint(1, 10000))
+        elif kind < 0.5:
+            res = bank.credit(acc, rnd.randint(1, 10000))
+        elif kind < 0.75:
+            res = bank.debit(acc, rnd.randint(1, 10000))
+        else:
+            to_acc = rnd.choice(home)
+            if to_acc == acc:
+                continue
+            res = bank.transfer(acc, to_acc, rnd.randint(1, 10000))
+        if not res['ok']:
+            raise RuntimeError(res['error'])
+        done += 1
+    secs = time.perf_counter() - start
+    bank.close_all()
+    return done, secs
+
+
+def run(conf, n):
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, 'banking_system.db')
+        parts = seed(base, n, conf['accounts'])
+        with multiprocessing.Pool(conf['procs']) as pool:
+            res = pool.starmap(worker, [
+                (base, n, parts, conf['seconds'], conf['cross'], conf['sync'], i)
+                for i in range(conf['procs'])])
+    # Each process times its own loop, so opening the shards isn't counted
+    return {'shards': n, 'ops': sum(done for done, _ in res),
+            'ops_per_sec': round(sum(done / secs for done, secs in res), 1)}
+
+
+def main():
+    conf = dict(DEFAULTS)
+    args = sys.argv[1:]
+    for key in conf:
+        if f"--{key}" in args:
+            conf[key] = args[args.index(f"--{key}") + 1]
+    conf['procs'] = int(conf['procs'])
+    conf['accounts'] = int(conf['accounts'])
+    conf['seconds'] = float(conf['seconds'])
+    conf['cross'] = float(conf['cross'])
+    conf['sync'] = conf['sync'].upper()
+    if conf['sync'] not in ('FULL', 'NORMAL'):
+        print("--sync has to be FULL or NORMAL")
+        sys.exit(1)
+    counts = [int(n) for n in str(conf['shards']).split(',')]
+
+    print(f"{conf['procs']} processes, {conf['seconds']:.0f}s each, "
+          f"{conf['cross']:.0%} cross-shard, synchronous={conf['sync']}, "
+          f"{os.cpu_count()} cpus")
+    print(f"{'Shards':>7} {'ops/sec':>10} {'speedup':>9}")
+    print("-" * 28)
+    results = []
+    for n in counts:
+        res = run(conf, n)
+        res['speedup'] = round(res['ops_per_sec'] / results[0]['ops_per_sec'], 2) \
+            if results else 1.0
+        results.append(res)
+        print(f"{n:>7} {res['ops_per_sec']:>10.1f} {res['speedup']:>8.2f}x")
+
+    if conf['json']:
+        with open(conf['json'], 'w', encoding='utf-8') as f:
+            json.dump({'config': conf, 'results': results}, f, indent=2)
+        print(f"\nWrote {conf['json']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import re
+import sys
+import time
+import random
+import datetime
+
+import validate
+
+# Records/sec of the sign up rules on generated customer records:
+#   one at a time  the check_* functions as they were before validate.py
+#                  (re.match per call, four re.search scans per password),
+#                  first problem raised
+#   check()        validate.check per field, compiled rules
+#   columns        validate.check_columns over whole columns, every problem
+#                  of every row
+# All three have to agree on which rows are bad.
+#
+# Usage: python bench_validate.py [--records N] [--bad PCT]   (200000, 20)
+
+FIELDS = ('name', 'dob', 'city', 'pwd', 'phone', 'email')
+
+
+def old_check_name(name):
+    if not name or not re.match("^[A-Za-z ]{2,50}$", name):
+        raise ValueError("Bad name! Letters only, 2-50 chars")
+    return True
+
+
+def old_check_phone(num):
+    if not re.match("^[0-9]{10}$", num):
+        raise ValueError("Phone number should be 10 digits!")
+    return True
+
+
+def old_check_email(email):
+    if not re.match(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", email):
+        raise ValueError("That's not a valid email!")
+    return True
+
+
+def old_check_pwd(pwd):
+    if len(pwd) < 8:
+        raise ValueError("Password too short! Need 8+ chars")
+    if not re.search("[A-Z]", pwd):
+        raise ValueError("Need an uppercase letter!")
+    if not re.search("[a-z]", pwd):
+        raise ValueError("Need a lowercase letter!")
+    if not re.search("[0-9]", pwd):
+        raise ValueError("Need a number!")
+    if not re.search("[!@#$%^&*(),.?\":{}|<>]", pwd):
+        raise ValueError("Need a special character!")
+    return True
+
+
+def old_check_dob(dob):
+    datetime.datetime.strptime(dob, '%Y-%m-%d')
+    return True
+
+
+def make_records(n, bad_pct, seed=7):
+    rnd = random.Random(seed)
+    cities = ['Pune', 'Delhi', 'Mumbai', 'Chennai', 'New York', 'Austin']
+    breakers = {
+        'name': lambda r: r['name'] + '9',
+        'dob': lambda r: '1990-13-40',
+        'city': lambda r: '',
+        'pwd': lambda r: r['pwd'].replace('!', 'x'),
+        'phone': lambda r: r['phone'][:9],
+        'email': lambda r: r['email'].replace('@', ''),
+    }
+    records = []
+    for i in range(n):
+        rec = {
+            'name': rnd.choice(['Asha Rao', 'John Smith', 'Li Wei', 'Maria Lopez']),
+            'dob': f"{rnd.randint(1950, 2004)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            'city': rnd.choice(cities),
+            'pwd': f"Secret{rnd.randint(0, 99999)}!pass",
+            'phone': f"{rnd.randint(6000000000, 9999999999)}",
+            'email': f"user{i}@example.com",
+        }
+        if rnd.random() * 100 < bad_pct:
+            field = rnd.choice(FIELDS)
+            rec[field] = breakers[field](rec)
+        records.append(rec)
+    return records
+
+
+def run_old(records):
+    bad = set()
+    for i, rec in enumerate(records):
+        try:
+            old_check_name(rec['name'])
+            old_check_dob(rec['dob'])
+            if not rec['city']:
+                raise ValueError("Need a city!")
+            old_check_pwd(rec['pwd'])
+            old_check_phone(rec['phone'])
+            old_check_email(rec['email'])
+        except ValueError:
+            bad.add(i)
+    return bad
+
+
+def run_check(records):
+    bad = set()
+    check = validate.check
+    for i, rec in enumerate(records):
+        try:
+            for field in FIELDS:
+                check(field, rec[field])
+        except ValueError:
+            bad.add(i)
+    return bad
+
+
+def run_columns(records):
+    columns = {field: [rec[field] for rec in records] for field in FIELDS}
+    return {i for i, _ in validate.check_columns(columns)}
+
+
+def main():
+    args = sys.argv[1:]
+    n = int(args[args.index('--records') + 1]) if '--records' in args else 200000
+    bad_pct = float(args[args.index('--bad') + 1]) if '--bad' in args else 20
+    records = make_records(n, bad_pct)
+
+    results = []
+    for name, fn in (('one at a time', run_old), ('check()', run_check),
+                     ('columns', run_columns)):
+        start = time.perf_counter()
+        bad = fn(records)
+        results.append((name, time.perf_counter() - start, bad))
+
+    print(f"{n} records, {len(results[0][2])} bad\n")
+    print(f"{'Mode':<15} {'Secs':>7} {'Records/s':>11} {'Speedup':>8}")
+    print("-" * 44)
+    base = results[0][1]
+    for name, secs, bad in results:
+        print(f"{name:<15} {secs:>7.2f} {n / secs:>11,.0f} {base / secs:>7.1f}x")
+    if any(bad != results[0][2] for _, _, bad in results):
+        print("\nThe modes don't agree on the bad rows!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import json
 import sqlite3
 
 DB_FILE = "quiz_app.db"
@@ -44,29 +45,76 @@ def setup_database():
         )
     ''')
 
+    setup_catalog_version(cursor)
+
     conn.commit()
     conn.close()
 
+def setup_catalog_version(cursor):
+    # Bumped by triggers on every change to quizzes/quiz_questions, so apps
+    # caching the catalog (with_db.py) know when to reload it. catalog_id is
+    # random per db file, versions alone repeat from one fresh db to the next.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            catalog_id TEXT
+        )
+    ''')
+    cursor.execute("PRAGMA table_info(catalog_version)")
+    if 'catalog_id' not in [c[1] for c in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE catalog_version ADD COLUMN catalog_id TEXT")
+    cursor.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+    cursor.execute('''
+        UPDATE catalog_version SET catalog_id = lower(hex(randomblob(16)))
+        WHERE id = 1 AND catalog_id IS NULL
+    ''')
+    for table in ('quizzes', 'quiz_questions'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
 def populate():
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
 
     # Seed quizzes
-    quizzes = [("Python Quiz",), ("Math Quiz",)]
+    quizzes = [("Python Quiz",), ("Math Quiz",), ("DBMS Quiz",), ("DSA Quiz",)]
     cursor.executemany("INSERT INTO quizzes (name) VALUES (?)", quizzes)
 
-    # Seed quiz questions
+    # Seed quiz questions, options as a JSON list (see quiz_bundle.py)
     questions = [
         # Python Quiz
-        (1, "What is the output of 2 + 2?", "4,5,6,3", "4"),
-        (1, "Which data type is mutable?", "List,Tuple,String,Integer", "List"),
-        (1, "What keyword is used to define a function in Python?", "def,func,function,define", "def"),
+        (1, "What is the output of 2 + 2?", ["4", "5", "6", "3"], "4"),
+        (1, "Which data type is mutable?", ["List", "Tuple", "String", "Integer"], "List"),
+        (1, "What keyword is used to define a function in Python?", ["def", "func", "function", "define"], "def"),
+        (1, "What is the correct syntax for a function in Python?", ["def function_name():", "function function_name():", "function():", "def: function_name"], "def function_name():"),
+        (1, "Which of the following is a Python keyword?", ["if", "yes", "none", "foreach"], "if"),
+        (1, "What is the default return value of a function in Python?", ["None", "0", "1", "null"], "None"),
         # Math Quiz
-        (2, "What is the square of 8?", "64,56,72,81", "64"),
-        (2, "What is 15 divided by 3?", "5,4,6,3", "5"),
-        (2, "Solve: 12 x 5.", "50,60,70,80", "60")
+        (2, "What is the square of 8?", ["64", "56", "72", "81"], "64"),
+        (2, "What is 15 divided by 3?", ["5", "4", "6", "3"], "5"),
+        (2, "Solve: 12 x 5.", ["50", "60", "70", "80"], "60"),
+        # DBMS Quiz
+        (3, "What does DBMS stand for?", ["Database Management System", "Data Base Management System", "Database Managed System", "Data Base Managed System"], "Database Management System"),
+        (3, "Which is not a DBMS model?", ["Network Model", "Hierarchical Model", "Relational Model", "Tree Model"], "Tree Model"),
+        (3, "What is normalization?", ["Process of reducing redundancy", "Process of creating tables", "Process of defining relations", "Process of deleting records"], "Process of reducing redundancy"),
+        (3, "Which of the following is a relational database?", ["MySQL", "MongoDB", "PostgreSQL", "Both MySQL and PostgreSQL"], "Both MySQL and PostgreSQL"),
+        (3, "Which SQL command is used to retrieve data from a database?", ["SELECT", "INSERT", "UPDATE", "DELETE"], "SELECT"),
+        # DSA Quiz
+        (4, "What is the time complexity of binary search?", ["O(n)", "O(log n)", "O(n^2)", "O(1)"], "O(log n)"),
+        (4, "Which data structure is used to implement a breadth-first search?", ["Stack", "Queue", "Tree", "Graph"], "Queue"),
+        (4, "Which sorting algorithm is the fastest in the average case?", ["QuickSort", "BubbleSort", "MergeSort", "SelectionSort"], "QuickSort"),
+        (4, "What is the space complexity of merge sort?", ["O(1)", "O(n)", "O(n log n)", "O(log n)"], "O(n)"),
+        (4, "Which data structure is used for recursion?", ["Stack", "Queue", "Array", "Linked List"], "Stack")
     ]
-    cursor.executemany("INSERT INTO quiz_questions (quiz_id, question, options, answer) VALUES (?, ?, ?, ?)", questions)
+    cursor.executemany("INSERT INTO quiz_questions (quiz_id, question, options, answer) VALUES (?, ?, ?, ?)",
+                       [(quiz_id, question, json.dumps(options), answer) for quiz_id, question, options, answer in questions])
 
     conn.commit()
     conn.close()
@@ -75,3 +123,4 @@ if __name__ == "__main__":
     setup_database()
     populate()
     print("Database setup complete with seed data!")
+    print("Run quiz_bundle.py to compile the quizzes for the quiz apps")
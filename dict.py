@@ -1,5 +1,7 @@
 from colorama import Fore, Style
 
+from quiz_bundle import open_bundle
+
 # Storage for user data and quiz results
 users = {}
 quizzes = {
@@ -13,6 +15,16 @@ quizzes = {
     ]
 }
 
+# Quiz name -> [(question, options, answer index)]. The compiled bundle
+# (quiz_bundle.py) replaces the built-in quizzes above when there is one,
+# its questions are only decoded when they're asked.
+bundle = open_bundle()
+if bundle is not None:
+    quizzes = {name: bundle.questions(quiz_id) for quiz_id, name in bundle.quizzes()}
+else:
+    quizzes = {name: [(q["question"], q["options"], q["options"].index(q["answer"])) for q in questions]
+               for name, questions in quizzes.items()}
+
 # Registration
 def register_user():
     print(Fore.CYAN + "\n--- Register ---" + Style.RESET_ALL)
@@ -52,13 +64,16 @@ def take_quiz(email):
         return
 
     score = 0
-    for idx, question in enumerate(quizzes[quiz_name], start=1):
-        print(Fore.CYAN + f"\nQ{idx}: {question['question']}" + Style.RESET_ALL)
-        for i, option in enumerate(question["options"], start=1):
+    for idx, (question, options, right) in enumerate(quizzes[quiz_name], start=1):
+        print(Fore.CYAN + f"\nQ{idx}: {question}" + Style.RESET_ALL)
+        for i, option in enumerate(options, start=1):
             print(f"{i}. {option}")
-        answer = input(Fore.YELLOW + "Your answer (1-4): " + Style.RESET_ALL)
+        answer = input(Fore.YELLOW + f"Your answer (1-{len(options)}): " + Style.RESET_ALL)
         try:
-            if question["options"][int(answer) - 1] == question["answer"]:
+            pick = int(answer) - 1
+            if not 0 <= pick < len(options):
+                raise IndexError(pick)
+            if pick == right:
                 score += 1
         except (ValueError, IndexError):
             print(Fore.RED + "Invalid option. Skipping." + Style.RESET_ALL)
@@ -0,0 +1,65 @@
+import sys
+
+from auth import PWD_COST
+from bank_service import BankingService, DB_FILE, read_import_file
+
+# Loads a migrated customer book into the bank.
+# Usage: python import_users.py customers.csv|customers.jsonl [map.csv]
+#                               [--no-check-digit] [--pwd-cost N]
+#
+# --pwd-cost hashes plaintext passwords with N PBKDF2 iterations instead of
+# PWD_COST (about 0.3s a row). Those hashes get upgraded to the normal cost
+# on each customer's first login.
+
+USAGE = "Usage: python import_users.py FILE [MAP_FILE] [--no-check-digit] [--pwd-cost N]"
+
+
+def parse_args(argv):
+    files, conf = [], {'check_digit': True, 'pwd_cost': PWD_COST}
+    args = iter(argv)
+    for arg in args:
+        if arg == '--no-check-digit':
+            conf['check_digit'] = False
+        elif arg == '--pwd-cost':
+            try:
+                conf['pwd_cost'] = int(next(args))
+            except (StopIteration, ValueError):
+                raise ValueError(f"{arg} needs a number of iterations")
+            if conf['pwd_cost'] < 1:
+                raise ValueError(f"{arg} needs to be positive")
+        elif arg.startswith('--'):
+            raise ValueError(f"Unknown option {arg}")
+        else:
+            files.append(arg)
+    if not 1 <= len(files) <= 2:
+        raise ValueError("Need the file to import and at most a map file")
+    conf['path'] = files[0]
+    conf['map_path'] = files[1] if len(files) > 1 else None
+    return conf
+
+
+def main():
+    try:
+        conf = parse_args(sys.argv[1:])
+    except ValueError as e:
+        print(f"{str(e)}\n{USAGE}")
+        sys.exit(1)
+
+    bank = BankingService(DB_FILE, pwd_cost=conf['pwd_cost'])
+    res = bank.import_users(read_import_file(conf['path']), check_digit=conf['check_digit'],
+                            map_path=conf['map_path'])
+    bank.close_all()
+
+    if not res['ok']:
+        print(f"Import failed: {res['error']}")
+        sys.exit(1)
+
+    print(f"Imported {res['imported']} accounts")
+    for idx, reason in res['rejected'][:50]:
+        print(f"  row {idx}: {reason}")
+    if len(res['rejected']) > 50:
+        print(f"  ... and {len(res['rejected']) - 50} more rejected rows")
+
+
+if __name__ == "__main__":
+    main()
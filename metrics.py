@@ -0,0 +1,460 @@
+import os
+import re
+import time
+import bisect
+import sqlite3
+import weakref
+import datetime
+import itertools
+import threading
+from collections import deque
+
+# Opt-in timing for the bank. Off by default, and off means off: nothing is
+# wrapped, BankingService and connect_db run exactly as without this file.
+#
+# Turned on (BankingService(..., metrics=Metrics())) it records
+#   - every service operation: calls, failures, latency histogram. The
+#     streaming ones (iter_users, iter_statement) count once per listing.
+#   - SQL statements, grouped by verb and table: calls, latency histogram,
+#     rows touched (rowcount of writes, -1 for reads is skipped). Sampled,
+#     see sql_every below.
+#   - commits, sampled along with the SQL
+#   - a slow query log for statements over slow_ms
+# render() gives the Prometheus text format, dump(path) writes it to a file
+# and BankingService.stats() returns a plain dict snapshot.
+#
+# The hot path only appends to a deque (seconds to the op's own one, or
+# (sql, seconds, rows)), which is thread safe without a lock. Samples are
+# folded into the histograms in bulk every FOLD_EVERY calls of an op and
+# before anything is read.
+#
+# What it costs: going through a Python cursor at all is ~0.5us per
+# statement and timing it another ~1us, which adds up to 10-15% on a cheap
+# write transaction. So SQL timing is sampled per operation: in every
+# sql_every-th service call this thread's connections hand out timed cursors
+# and those statements and commits count sql_every times. The other calls
+# run on plain sqlite3 cursors, the connection has no Python code between
+# them and the statement. SQL numbers, commits and the slow log are
+# estimates unless sql_every is 1 or 0, and with sampling only SQL run inside
+# a service call is seen (not the audit writer's, not a cross-shard
+# transfer's). sql_every (BANK_SQL_EVERY):
+#   1   every statement
+#   N   every Nth service call (default SQL_EVERY)
+#   0   no SQL timing, only ops and every commit
+#
+# Measured with bench_core.py's workload (2000 accounts, default mix, one
+# thread, --pwd-cost 1000, ~100us CPU per op with metrics off): CPU per op
+# against metrics off on the same bank and db, 2000-op bursts taking turns,
+# median of 100 (+-0.5% or so):
+#   sql_every 1      +7 to 9%
+#   sql_every 10     +4.5 to 5%
+#   sql_every 20     +3.5%      (default)
+#   sql_every 0      +3%
+#
+# Banking_system.py and the scripts switch it on with environment variables:
+#   BANK_METRICS=metrics.prom     dump here on exit
+#   BANK_SLOW_MS=50               slow query threshold (default 100)
+#   BANK_SLOW_LOG=slow.log        slow queries go here too
+#   BANK_SQL_EVERY=1              see above
+
+# Seconds, same as the Prometheus client defaults plus sub-ms buckets for SQL
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_MS = 100
+SLOW_KEEP = 100     # slow queries kept in memory for stats()
+LABEL_CACHE = 10000
+FOLD_EVERY = 5000
+SQL_EVERY = 20      # SQL timed in every 20th call, ~3.5% all told, see above
+
+# First table named in a statement ("CREATE INDEX x ON t" counts as t)
+_STMT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?'
+                         r'([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def add_many(self, secs, weight=1):
+        # Sorted once, then one bisect per bucket instead of one per sample
+        secs.sort()
+        prev = 0
+        for i, bound in enumerate(BUCKETS):
+            upto = bisect.bisect_right(secs, bound)
+            self.counts[i] += (upto - prev) * weight
+            prev = upto
+        self.counts[-1] += (len(secs) - prev) * weight
+        self.total += sum(secs) * weight
+        self.count += len(secs) * weight
+
+
+class Metrics:
+    def __init__(self, slow_ms=SLOW_MS, slow_log=None, dump_path=None, sql_every=SQL_EVERY):
+        self.slow_secs = slow_ms / 1000
+        self.sql_every = max(0, int(sql_every))
+        self.slow_log = slow_log
+        self.dump_path = dump_path
+        self._lock = threading.Lock()
+        self.ops = {}           # op -> [Histogram, failed]
+        self.sql = {}           # (verb, table) -> [Histogram, rows]
+        self.commits = 0
+        self.slow = deque(maxlen=SLOW_KEEP)
+        self._ops_raw = {}          # op -> (deque of secs, deque of one None per failure)
+        self._sql_raw = deque()     # (sql, secs, rowcount)
+        self._commits_raw = deque()     # one None per commit
+        self._labels = {}       # sql text -> (verb, table)
+        self._conn_class = None
+        self._timed_class = None
+        self._tick = itertools.count()      # service calls, for SQL sampling
+        self._local = threading.local()     # this thread's connections and sampling depth
+        self.started = time.time()
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        # None unless BANK_METRICS or BANK_SLOW_LOG is set
+        dump_path = environ.get('BANK_METRICS')
+        slow_log = environ.get('BANK_SLOW_LOG')
+        if not dump_path and not slow_log:
+            return None
+        return cls(float(environ.get('BANK_SLOW_MS', SLOW_MS)), slow_log, dump_path,
+                   int(environ.get('BANK_SQL_EVERY', SQL_EVERY)))
+
+
+    def op_buffers(self, name):
+        # Where one op's samples wait for fold(), made once per op so the
+        # wrappers can bind them
+        bufs = self._ops_raw.get(name)
+        if bufs is None:
+            with self._lock:
+                bufs = self._ops_raw.setdefault(name, (deque(), deque()))
+        return bufs
+
+    def record_op(self, name, secs, ok):
+        times, failures = self.op_buffers(name)
+        times.append(secs)
+        if not ok:
+            failures.append(None)
+        if len(times) > FOLD_EVERY:
+            self.fold()
+
+    def record_commit(self):
+        self._commits_raw.append(None)
+
+    def fold(self):
+        # Moves the buffered samples into the histograms
+        with self._lock:
+            # Sampled like SQL unless every commit goes through CountingConnection
+            weight = self.sql_every if self.sql_every > 1 else 1
+            self.commits += len(drain(self._commits_raw)) * weight
+            # Each op's samples go into its histogram in one go
+            for name, (times, failures) in list(self._ops_raw.items()):
+                secs = drain(times)
+                if not secs:
+                    continue
+                entry = self.ops.get(name)
+                if entry is None:
+                    entry = self.ops[name] = [Histogram(), 0]
+                entry[0].add_many(secs)
+                entry[1] += len(drain(failures))
+
+            # Grouped first, same for each statement
+            groups = {}
+            for sql, secs, rows in drain(self._sql_raw):
+                group = groups.get(sql)
+                if group is None:
+                    group = groups[sql] = ([], [])
+                group[0].append(secs)
+                group[1].append(rows)
+            for sql, (secs, rows) in groups.items():
+                label = self._labels.get(sql)
+                if label is None:
+                    label = statement_label(sql)
+                    if len(self._labels) < LABEL_CACHE:
+                        self._labels[sql] = label
+                entry = self.sql.get(label)
+                if entry is None:
+                    entry = self.sql[label] = [Histogram(), 0]
+                entry[0].add_many(secs, self.sql_every)
+                # rowcount is -1 for reads
+                entry[1] += sum(r for r in rows if r > 0) * self.sql_every
+
+    def log_slow(self, sql, secs):
+        # Only the statement, parameters can hold passwords and such
+        line = (f"{datetime.datetime.now().isoformat(timespec='milliseconds')} "
+                f"{secs * 1000:.1f}ms {' '.join(sql.split())}")
+        self.slow.append(line)
+        if self.slow_log:
+            with self._lock, open(self.slow_log, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+    def wrap(self, name, fn):
+        # Times one service operation, fn returns the usual {'ok': ...} dict
+        clock = time.perf_counter
+        times, failures = self.op_buffers(name)
+        push = times.append
+        fold = self.fold
+        sample = self.sql_sample
+        every = self.sql_every if self.sql_every > 1 else 0
+        tick = self._tick
+
+        def timed(*args, **kwargs):
+            sampled = every and not next(tick) % every
+            if sampled:
+                sample(True)
+            start = clock()
+            try:
+                res = fn(*args, **kwargs)
+            except BaseException:
+                failures.append(None)
+                raise
+            finally:
+                push(clock() - start)
+                if sampled:
+                    sample(False)
+            if not res['ok']:
+                failures.append(None)
+            if len(times) > FOLD_EVERY:
+                fold()
+            return res
+        timed.__name__ = fn.__name__
+        timed.__doc__ = fn.__doc__
+        return timed
+
+    def wrap_iter(self, name, fn):
+        # Same for a generator (iter_users, iter_statement): one sample per
+        # listing, counting only the time spent inside it and not what the
+        # caller does with the rows. A listing the caller stops early still
+        # counts, one that raises counts as failed. A sampled listing times
+        # its SQL only while it's running, not the caller's in between.
+        clock = time.perf_counter
+        record = self.record_op
+        sample = self.sql_sample
+        every = self.sql_every if self.sql_every > 1 else 0
+        tick = self._tick
+
+        def timed(*args, **kwargs):
+            spent = 0.0
+            ok = True
+            sampled = every and not next(tick) % every
+            if sampled:
+                sample(True)
+            start = clock()
+            it = iter(fn(*args, **kwargs))
+            try:
+                while True:
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        return
+                    spent += clock() - start
+                    start = None
+                    if sampled:
+                        sample(False)
+                    yield item
+                    if sampled:
+                        sample(True)
+                    start = clock()
+            except Exception:
+                ok = False
+                raise
+            finally:
+                if start is None:
+                    # Dropped by the caller while it had a row
+                    if sampled:
+                        sample(True)
+                    start = clock()
+                it.close()
+                spent += clock() - start
+                if sampled:
+                    sample(False)
+                record(name, spent, ok)
+        timed.__name__ = fn.__name__
+        timed.__doc__ = fn.__doc__
+        return timed
+
+    def connect(self, *args, **kwargs):
+        # sqlite3.connect with statements and commits recorded
+        if self._conn_class is None:
+            self._conn_class = self.connection_class()
+        db = sqlite3.connect(*args, factory=self._conn_class, **kwargs)
+        if self._timed_class:
+            # Sampled, so this thread's sql_sample() has to find it
+            refs = getattr(self._local, 'conns', None)
+            if refs is None:
+                refs = self._local.conns = []
+            refs[:] = [ref for ref in refs if ref() is not None]
+            refs.append(weakref.ref(db))
+            if getattr(self._local, 'depth', 0):
+                db.__class__ = self._timed_class
+        return db
+
+    def sql_sample(self, on):
+        # Turns this thread's connections into timed ones for a sampled call
+        # and back, same object, only the class changes. Calls inside it
+        # leave that to the outermost one.
+        local = self._local
+        depth = getattr(local, 'depth', 0) + (1 if on else -1)
+        local.depth = depth
+        if depth == (1 if on else 0):
+            cls = self._timed_class if on else self._conn_class
+            for ref in getattr(local, 'conns', ()):
+                db = ref()
+                if db is not None:
+                    db.__class__ = cls
+
+    def connection_class(self):
+        metrics = self
+
+        class CountingConnection(sqlite3.Connection):
+            def commit(self):
+                super().commit()
+                metrics.record_commit()
+
+            def __exit__(self, kind, value, tb):
+                res = super().__exit__(kind, value, tb)
+                if kind is None:
+                    metrics.record_commit()
+                return res
+
+        if not self.sql_every:
+            return CountingConnection
+
+        clock = time.perf_counter
+        execute = sqlite3.Cursor.execute
+        executemany = sqlite3.Cursor.executemany
+        push = self._sql_raw.append
+
+        class TimedCursor(sqlite3.Cursor):
+            def execute(self, sql, params=()):
+                start = clock()
+                try:
+                    return execute(self, sql, params)
+                finally:
+                    secs = clock() - start
+                    push((sql, secs, self.rowcount))
+                    if secs >= metrics.slow_secs:
+                        metrics.log_slow(sql, secs)
+
+            def executemany(self, sql, seq):
+                start = clock()
+                try:
+                    return executemany(self, sql, seq)
+                finally:
+                    secs = clock() - start
+                    push((sql, secs, self.rowcount))
+                    if secs >= metrics.slow_secs:
+                        metrics.log_slow(sql, secs)
+
+        class TimedConnection(CountingConnection):
+            # Connection.execute makes its cursor in C, so route it through ours
+            def cursor(self, factory=None):
+                return sqlite3.Connection.cursor(self, factory or TimedCursor)
+
+            def execute(self, sql, params=()):
+                return self.cursor().execute(sql, params)
+
+            def executemany(self, sql, seq):
+                return self.cursor().executemany(sql, seq)
+
+        if self.sql_every == 1:
+            return TimedConnection
+
+        class SampledConnection(sqlite3.Connection):
+            # Nothing in Python between the bank and sqlite3, it's a
+            # TimedConnection (commits counted too) only during a sampled
+            # call, see sql_sample()
+            pass
+
+        self._timed_class = TimedConnection
+        return SampledConnection
+
+
+    def snapshot(self):
+        self.fold()
+        with self._lock:
+            return {
+                'uptime_seconds': round(time.time() - self.started, 3),
+                'commits': self.commits,
+                'ops': {name: hist_dict(h, failed=failed)
+                        for name, (h, failed) in sorted(self.ops.items())},
+                'sql': {f"{verb} {table}".strip(): hist_dict(h, rows=rows)
+                        for (verb, table), (h, rows) in sorted(self.sql.items())},
+                'slow_queries': list(self.slow),
+            }
+
+    def render(self):
+        # Prometheus text exposition format
+        out = []
+        self.fold()
+        with self._lock:
+            out.append("# HELP bank_op_seconds Time spent in BankingService operations")
+            out.append("# TYPE bank_op_seconds histogram")
+            for name, (h, _) in sorted(self.ops.items()):
+                out.extend(hist_lines('bank_op_seconds', {'op': name}, h))
+            out.append("# HELP bank_op_failures_total Operations that returned ok=False")
+            out.append("# TYPE bank_op_failures_total counter")
+            for name, (_, failed) in sorted(self.ops.items()):
+                out.append(f'bank_op_failures_total{{op="{name}"}} {failed}')
+
+            out.append("# HELP bank_sql_seconds Time spent in SQL statements")
+            out.append("# TYPE bank_sql_seconds histogram")
+            for (verb, table), (h, _) in sorted(self.sql.items()):
+                out.extend(hist_lines('bank_sql_seconds', {'stmt': verb, 'table': table}, h))
+            out.append("# HELP bank_sql_rows_total Rows changed by SQL statements")
+            out.append("# TYPE bank_sql_rows_total counter")
+            for (verb, table), (_, rows) in sorted(self.sql.items()):
+                out.append(f'bank_sql_rows_total{{stmt="{verb}",table="{table}"}} {rows}')
+
+            out.append("# HELP bank_commits_total Committed transactions")
+            out.append("# TYPE bank_commits_total counter")
+            out.append(f"bank_commits_total {self.commits}")
+            out.append("# HELP bank_slow_queries Slow queries in the in-memory log")
+            out.append("# TYPE bank_slow_queries gauge")
+            out.append(f"bank_slow_queries {len(self.slow)}")
+        return '\n'.join(out) + '\n'
+
+    def dump(self, path=None):
+        # Written next to the target and renamed, so scrapers never see half a file
+        path = path or self.dump_path
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+        return path
+
+
+def drain(samples):
+    # Takes what's in the deque right now, other threads can keep appending
+    return [samples.popleft() for _ in range(len(samples))]
+
+
+def statement_label(sql):
+    # ('SELECT', 'users'), ('BEGIN', ''), ... so labels stay few
+    words = sql.split(None, 1)
+    verb = words[0].upper() if words else ''
+    match = _STMT_TABLE.search(sql)
+    return verb, match.group(1) if match else ''
+
+
+def hist_dict(h, **extra):
+    res = {'count': h.count, 'total_ms': round(h.total * 1000, 3)}
+    res.update(extra)
+    return res
+
+
+def hist_lines(name, labels, h):
+    base = ','.join(f'{k}="{v}"' for k, v in labels.items())
+    lines = []
+    running = 0
+    for bound, n in zip(BUCKETS, h.counts):
+        running += n
+        lines.append(f'{name}_bucket{{{base},le="{bound}"}} {running}')
+    lines.append(f'{name}_bucket{{{base},le="+Inf"}} {h.count}')
+    lines.append(f'{name}_sum{{{base}}} {h.total:.6f}')
+    lines.append(f'{name}_count{{{base}}} {h.count}')
+    return lines
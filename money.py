@@ -0,0 +1,42 @@
+from decimal import Decimal, InvalidOperation
+
+# Money is kept as integer cents everywhere inside the bank (db columns,
+# arithmetic, comparisons). Only the edges turn text into cents and cents
+# back into text.
+
+MIN_BALANCE = 2000                  # in dollars, for messages
+MIN_BALANCE_CENTS = MIN_BALANCE * 100
+
+
+def to_cents(value):
+    # "12.5", 12.5, Decimal('12.50') -> 1250. Anything finer than a cent is
+    # rejected instead of silently rounded.
+    try:
+        amount = Decimal(str(value).strip().replace(',', ''))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Not a valid amount: {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Not a valid amount: {value!r}")
+    cents = amount * 100
+    if cents != cents.to_integral_value():
+        raise ValueError("Amounts can't go below a cent!")
+    return int(cents)
+
+
+def as_cents(value):
+    # For values that are supposed to be cents already (service arguments)
+    if isinstance(value, bool):
+        raise ValueError(f"Not a valid amount: {value!r}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        return int(value)
+    raise ValueError(f"Amount must be whole cents: {value!r}")
+
+
+def fmt_money(cents):
+    sign = '-' if cents < 0 else ''
+    cents = abs(int(cents))
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
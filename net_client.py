@@ -0,0 +1,105 @@
+import sys
+import json
+import shlex
+import asyncio
+import itertools
+
+from net_server import HOST, PORT, MAX_LINE
+
+# Small client for net_server.py.
+#
+#   client = await BankClient.connect()
+#   res = await client.call('login', acc='1234567890', pwd='...')
+#   res = await client.call('credit', amt=5000)
+#   await client.close()
+#
+# Run it directly for a prompt that takes "op key=value ..." lines:
+#   python net_client.py [--host HOST] [--port PORT]
+#   > login acc=1234567890 pwd=Secret#123
+#   > credit amt=5000
+
+
+class BankClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self._ids = itertools.count(1)
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def connect(cls, host=HOST, port=PORT):
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+        return cls(reader, writer)
+
+    async def call(self, op, **args):
+        # One request at a time per connection, answers come back in order
+        async with self._lock:
+            req_id = next(self._ids)
+            self.writer.write(json.dumps(dict(args, op=op, id=req_id)).encode('utf-8') + b'\n')
+            await self.writer.drain()
+            line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        res = json.loads(line)
+        if res.get('id') != req_id:
+            raise ConnectionError(f"Answer for request {res.get('id')}, expected {req_id}")
+        del res['id']
+        return res
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+def parse_line(line):
+    # "credit amt=5000" -> ('credit', {'amt': 5000}), values are JSON if they parse
+    parts = shlex.split(line)
+    args = {}
+    for part in parts[1:]:
+        key, _, value = part.partition('=')
+        try:
+            args[key] = json.loads(value)
+        except ValueError:
+            args[key] = value
+    return parts[0], args
+
+
+async def prompt(host, port):
+    client = await BankClient.connect(host, port)
+    print(f"Connected to {host}:{port}, Ctrl-D to quit")
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await loop.run_in_executor(None, input, '> ')
+            if not line.strip():
+                continue
+            try:
+                op, args = parse_line(line)
+            except ValueError as e:
+                print(f"Oops: {str(e)}")
+                continue
+            print(json.dumps(await client.call(op, **args), indent=2))
+    except EOFError:
+        print()
+    finally:
+        await client.close()
+
+
+def main():
+    args = sys.argv[1:]
+    host = args[args.index('--host') + 1] if '--host' in args else HOST
+    port = int(args[args.index('--port') + 1]) if '--port' in args else PORT
+    try:
+        asyncio.run(prompt(host, port))
+    except KeyboardInterrupt:
+        print()
+    except ConnectionError as e:
+        print(f"Connection problem: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+from net_server import BankServer
+from net_client import BankClient
+from stress_test import START_CASH
+from money import MIN_BALANCE_CENTS, fmt_money
+
+# Runs lots of simulated customers against net_server.py on a temp db: each
+# one signs up, logs in, moves money around (also to the others) and logs out.
+# Afterwards every balance has to match its money_moves history.
+# Usage: python net_load_test.py [clients] [ops per client] [workers]
+
+PWD = 'Load#Test1'
+PWD_COST = 1000     # the KDF isn't what we're testing here
+
+
+def raise_fd_limit(clients):
+    # Both ends of every connection live in this process
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    want = clients * 2 + 256
+    if soft < want:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(want, hard), hard))
+
+
+async def customer(n, port, n_ops, accs, stats):
+    rnd = random.Random(n)
+    client = await BankClient.connect(port=port)
+    try:
+        res = await client.call('open_account', name='Load Test', dob='2000-01-01',
+                                city='Nowhere', pwd=PWD, cash=START_CASH,
+                                phone='0000000000', email='load@test.com')
+        if not res['ok']:
+            raise RuntimeError(res['error'])
+        acc = res['acc_num']
+        accs.append(acc)
+
+        res = await client.call('login', acc=acc, pwd=PWD)
+        if not res['ok']:
+            raise RuntimeError(res['error'])
+
+        for _ in range(n_ops):
+            amt = rnd.randint(1, 300000)
+            kind = rnd.random()
+            start = time.perf_counter()
+            if kind < 0.3:
+                res = await client.call('credit', amt=amt)
+            elif kind < 0.6:
+                res = await client.call('debit', amt=amt)
+            elif kind < 0.9 and len(accs) > 1:
+                to_acc = rnd.choice(accs)
+                if to_acc == acc:
+                    continue
+                res = await client.call('transfer', to_acc=to_acc, amt=amt)
+            else:
+                res = await client.call('statement', page_size=10)
+                stats['reads'] += 1
+            stats['latency'].append(time.perf_counter() - start)
+            # Hitting the floor is allowed, anything else is not
+            if res['ok']:
+                stats['done'] += 'moves' not in res
+            elif 'below' not in res['error']:
+                raise RuntimeError(res['error'])
+
+        res = await client.call('logout')
+        if not res['ok']:
+            raise RuntimeError(res['error'])
+    finally:
+        await client.close()
+
+
+def check(bank, done):
+    cur = bank.conn().cursor()
+    cur.execute('''
+        SELECT u.acc_num, u.cash_balance,
+            COALESCE((SELECT SUM(CASE move_type WHEN 'CREDIT' THEN amount
+                                                ELSE -amount END)
+                      FROM money_moves m WHERE m.acc_num = u.acc_num), 0)
+              + COALESCE((SELECT SUM(amount) FROM money_moves m
+                          WHERE m.to_acc = u.acc_num), 0)
+        FROM users u
+    ''')
+    rows = cur.fetchall()
+    cur.execute("SELECT COUNT(*) FROM money_moves")
+    # Opening deposits are moves too, one per account
+    moves = cur.fetchone()[0] - len(rows)
+    bad = [(acc, have, want) for acc, have, want in rows
+           if have != want or have < MIN_BALANCE_CENTS]
+
+    print(f"ops committed: {done}, money_moves rows: {moves}")
+    for acc, have, want in bad[:20]:
+        print(f"  {acc}: balance {fmt_money(have)}, history says {fmt_money(want)}")
+    return moves == done and not bad
+
+
+async def run(path, n_clients, n_ops, workers):
+    server = BankServer(path, workers, pwd_cost=PWD_COST)
+    _, port = await server.start('127.0.0.1', 0)
+    stats = {'done': 0, 'reads': 0, 'latency': []}
+    accs = []
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[customer(i, port, n_ops, accs, stats)
+                                     for i in range(n_clients)],
+                                   return_exceptions=True)
+    took = time.perf_counter() - start
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    lat = sorted(stats['latency'])
+    print(f"{n_clients} clients, {len(lat)} requests in {took:.1f}s "
+          f"({len(lat) / took:.0f}/s), {len(server.locks)} account locks left")
+    if lat:
+        print(f"latency p50 {lat[len(lat) // 2] * 1000:.1f}ms, "
+              f"p99 {lat[int(len(lat) * 0.99)] * 1000:.1f}ms")
+    for err in errors[:10]:
+        print(f"  client failed: {err!r}")
+
+    ok = check(server.bank, stats['done'])
+    await server.close()
+    return ok and not errors and not len(server.locks)
+
+
+def main():
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_ops = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    raise_fd_limit(n_clients)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'banking_system.db')
+        if asyncio.run(run(path, n_clients, n_ops, workers)):
+            print("OK - no lost updates")
+        else:
+            print("FAILED")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from bank_service import BankingService, DB_FILE
+import velocity
+
+# Network front end for the bank. Clients send one JSON object per line and
+# get one JSON object per line back, in order:
+#
+#   -> {"id": 1, "op": "login", "acc": "1234567890", "pwd": "..."}
+#   <- {"id": 1, "ok": true, "user": {...}, "token": "..."}
+#
+# Like the menu, a connection is one customer: after login the account ops
+# work on the logged in account, nobody can touch someone else's.
+# All DB work runs in a thread pool so the event loop never waits on SQLite.
+# Writes on the same account are queued up one after another here (the db is
+# safe either way, this just saves them from fighting over the write lock),
+# writes on different accounts go in parallel.
+#
+# export_users writes into the server's --export-dir (off without one) and
+# only takes a file name, clients never pick a path. The server runs due
+# standing orders like the menu does, and takes BANK_LIMITS like it too (see
+# velocity.py).
+#
+# Usage: python net_server.py [--host HOST] [--port PORT] [--db FILE] [--workers N]
+#                             [--export-dir DIR]
+
+HOST = '127.0.0.1'
+PORT = 8765
+WORKERS = 16
+MAX_LINE = 64 * 1024
+
+# op -> (service method, args the client may send, needs login, locks acc)
+# Account ops get acc filled in from the session, never from the client.
+OPS = {
+    'open_account': ('open_account', ('name', 'dob', 'city', 'pwd', 'cash',
+                                      'phone', 'email'), False, False),
+    'list_users': ('list_users', ('city', 'min_balance', 'max_balance', 'order_by',
+                                  'desc', 'page_size', 'after'), False, False),
+    'export_users': ('export_users', ('file', 'fmt', 'city', 'min_balance', 'max_balance',
+                                      'order_by', 'desc'), False, False),
+    'move_totals': ('move_totals', ('period', 'start', 'end', 'acc_num', 'move_type',
+                                    'city', 'by'), False, False),
+    'login': ('login', ('acc', 'pwd'), False, False),
+    'balance': ('balance', (), True, False),
+    'get_user': ('get_user', (), True, False),
+    'credit': ('credit', ('amt',), True, True),
+    'debit': ('debit', ('amt',), True, True),
+    'transfer': ('transfer', ('to_acc', 'amt'), True, True),
+    'change_pwd': ('change_pwd', ('old_pwd', 'new_pwd'), True, True),
+    'update_info': ('update_info', ('name', 'city', 'phone', 'email'), True, True),
+    'statement': ('statement', ('start', 'end', 'page_size', 'after'), True, False),
+    'add_standing_order': ('add_standing_order', ('to_acc', 'amt', 'every', 'start'),
+                           True, True),
+    'standing_orders': ('standing_orders', (), True, False),
+    'cancel_standing_order': ('cancel_standing_order', ('order_id',), True, True),
+    'logout': ('logout', (), True, False),
+}
+
+
+class AccountLocks:
+    # One asyncio lock per account that has a write going on. Entries go
+    # away again when nobody holds or waits on them.
+
+    def __init__(self):
+        self._locks = {}    # acc -> [lock, users]
+
+    async def hold(self, *accs):
+        # Sorted so two transfers between the same pair can't deadlock
+        accs = sorted(set(str(a) for a in accs if a))
+        taken = []
+        try:
+            for acc in accs:
+                entry = self._locks.setdefault(acc, [asyncio.Lock(), 0])
+                entry[1] += 1
+                taken.append(acc)
+                await entry[0].acquire()
+        except BaseException:
+            self.drop(taken, locked=taken[:-1])
+            raise
+        return accs
+
+    def drop(self, accs, locked=None):
+        locked = accs if locked is None else locked
+        for acc in accs:
+            entry = self._locks[acc]
+            if acc in locked:
+                entry[0].release()
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[acc]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class BankServer:
+    def __init__(self, db_path=DB_FILE, workers=WORKERS, export_dir=None, **service_args):
+        self.bank = BankingService(db_path, **service_args)
+        self.export_dir = export_dir
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='bank')
+        self.locks = AccountLocks()
+        self.clients = {}       # handler task -> writer
+        self.server = None
+
+
+    async def start(self, host=HOST, port=PORT):
+        self.server = await asyncio.start_server(self.serve, host, port,
+                                                 limit=MAX_LINE)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+        # Hang up on whoever is still connected and let their handlers log
+        # them out before the pool goes away
+        for writer in self.clients.values():
+            writer.close()
+        await asyncio.gather(*self.clients, return_exceptions=True)
+        self.pool.shutdown(wait=True)
+        self.bank.close_all()
+
+
+    async def serve(self, reader, writer):
+        # One customer session per connection
+        session = {'acc': None, 'token': None}
+        self.clients[asyncio.current_task()] = writer
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    await self.send(writer, {'ok': False, 'error': "Request too long!"})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await self.send(writer, await self.handle(session, line))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.clients[asyncio.current_task()]
+            # Dropped connections still get logged out
+            if session['acc']:
+                await self.call(self.bank.logout, session['acc'], session['token'])
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def send(self, writer, res):
+        writer.write(json.dumps(res).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, functools.partial(fn, *args, **kwargs))
+
+
+    async def handle(self, session, line):
+        try:
+            req = json.loads(line)
+            if not isinstance(req, dict):
+                raise ValueError
+        except ValueError:
+            return {'ok': False, 'error': "Request must be a JSON object!"}
+
+        res = await self.run_op(session, req)
+        if 'id' in req:
+            res['id'] = req['id']
+        return res
+
+    async def run_op(self, session, req):
+        op = req.get('op')
+        if op == 'ping':
+            return {'ok': True}
+        if op not in OPS:
+            return {'ok': False, 'error': f"Unknown op {op!r}"}
+        method, allowed, needs_login, locks = OPS[op]
+
+        extra = set(req) - set(allowed) - {'id', 'op'}
+        if extra:
+            return {'ok': False, 'error': f"Unexpected fields: {', '.join(sorted(extra))}"}
+        args = {k: req[k] for k in allowed if k in req}
+        fn = getattr(self.bank, method)
+
+        if op == 'export_users':
+            if not self.export_dir:
+                return {'ok': False, 'error': "Exports are off on this server!"}
+            name = str(args.pop('file', ''))
+            if not name or os.path.basename(name) != name or name.startswith('.'):
+                return {'ok': False, 'error': "file has to be a plain file name!"}
+            args['path'] = os.path.join(self.export_dir, name)
+
+        if not needs_login:
+            res = await self.call(fn, **args)
+            if op == 'export_users' and res['ok']:
+                # The server's directory is none of the client's business
+                res['path'] = os.path.basename(res['path'])
+            if op == 'login' and res['ok']:
+                # Switching accounts on one connection logs the old one out
+                if session['acc']:
+                    await self.call(self.bank.logout, session['acc'], session['token'])
+                session['acc'], session['token'] = res['user']['acc_num'], res['token']
+            return res
+
+        if not session['acc']:
+            return {'ok': False, 'error': "Please log in first!"}
+        # Tokens expire, and change_pwd from another connection revokes them
+        if session['acc'] != self.bank.sessions.check(session['token']):
+            session['acc'] = session['token'] = None
+            return {'ok': False, 'error': "Session expired, please log in again!"}
+
+        acc, token = session['acc'], session['token']
+        if op == 'logout':
+            session['acc'] = session['token'] = None
+            return await self.call(fn, acc, token)
+        if not locks:
+            return await self.call(fn, acc, **args)
+
+        # Transfers take both ends so nothing else lands on either one mid-way
+        held = await self.locks.hold(acc, args.get('to_acc') if op == 'transfer' else None)
+        try:
+            res = await self.call(fn, acc, **args)
+        finally:
+            self.locks.drop(held)
+        if op == 'change_pwd' and res['ok']:
+            # Every old session is gone now, this one carries on with a new token
+            session['token'] = self.bank.sessions.issue(acc)
+        return res
+
+
+async def run(db_path, host, port, workers, export_dir):
+    server = BankServer(db_path, workers, export_dir, scheduler=True,
+                        limits=velocity.from_env())
+    host, port = await server.start(host, port)
+    print(f"Bank listening on {host}:{port} (db {db_path})")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main():
+    args = sys.argv[1:]
+
+    def opt(name, default):
+        return args[args.index(name) + 1] if name in args else default
+
+    try:
+        asyncio.run(run(opt('--db', DB_FILE), opt('--host', HOST),
+                        int(opt('--port', PORT)), int(opt('--workers', WORKERS)),
+                        opt('--export-dir', None)))
+    except KeyboardInterrupt:
+        print("\nBye!")
+
+
+if __name__ == "__main__":
+    main()
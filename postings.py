@@ -0,0 +1,209 @@
+import sys
+import time
+import datetime
+
+from bank_service import BankingService, DB_FILE
+from money import MIN_BALANCE_CENTS, to_cents, fmt_money
+
+# End of day postings: interest or a maintenance fee for every account,
+# done with set-based statements instead of one credit()/debit() per
+# customer. Accounts are walked by users.id in ranges of CHUNK ids, every
+# range is one transaction that writes its money_moves rows (INSERT ...
+# SELECT), moves the balances (one UPDATE) and records how far the run got.
+# Between ranges the write lock is free for the daytime sessions.
+#
+# A run is one row in postings, keyed by (post_date, kind). A finished run
+# is never posted again, a run that died halfway picks up after the last
+# range it committed. Accounts opened after a run started aren't part of it.
+#
+# Interest credits floor(balance * rate / 365) per day, rate in basis
+# points a year. Fees are debits and never take an account below the
+# minimum balance, those accounts are skipped. Both go into money_moves as
+# plain CREDIT/DEBIT rows, so statements, rollups and reconcile.py need
+# nothing new.
+#
+# Usage: python postings.py interest --rate BP [options]
+#        python postings.py fee --fee DOLLARS [--below DOLLARS] [options]
+# options: [--date YYYY-MM-DD] [--db FILE] [--chunk N] [--pause SECS]
+#
+# --below waives the fee for balances at or above it. --date is the day
+# being posted (default today, UTC). Sharded banks: run it once per shard
+# file. Running services see the new balances once their account cache
+# entries expire, same as for any write from another process.
+
+CHUNK = 5000
+PAUSE = 0.0
+KINDS = ('interest', 'fee')
+
+
+def setup(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS postings (
+            post_date TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            below INTEGER,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            end_id INTEGER NOT NULL,
+            moves INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            started DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished DATETIME,
+            PRIMARY KEY (post_date, kind)
+        )
+    ''')
+
+
+def posting_sql(kind, amount, below):
+    # (move type, amount expression, extra condition, params for both)
+    if kind == 'interest':
+        # Integer division in SQLite rounds down, part cents stay with the bank
+        return 'CREDIT', 'cash_balance * ? / 3650000', 'cash_balance * ? / 3650000 > 0', \
+            (amount,), (amount,)
+    where = 'cash_balance - ? >= ?'
+    params = (amount, MIN_BALANCE_CENTS)
+    if below is not None:
+        where += ' AND cash_balance < ?'
+        params += (below,)
+    return 'DEBIT', '?', where, (amount,), params
+
+
+def start_run(bank, post_date, kind, amount, below):
+    # The postings row of this run, made on the first call. Returns
+    # (last_id, end_id, finished).
+    def work(cur):
+        setup(cur)
+        cur.execute('''
+            SELECT amount, below, last_id, end_id, finished FROM postings
+            WHERE post_date = ? AND kind = ?
+        ''', (post_date, kind))
+        row = cur.fetchone()
+        if row:
+            if (row[0], row[1]) != (amount, below):
+                raise ValueError(f"{kind} for {post_date} was started with other amounts")
+            return row[2], row[3], row[4]
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+        end_id = cur.fetchone()[0]
+        cur.execute('''
+            INSERT INTO postings (post_date, kind, amount, below, end_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (post_date, kind, amount, below, end_id))
+        return 0, end_id, None
+
+    return bank.run_write(work)
+
+
+def post_chunk(bank, post_date, kind, amount, below, chunk=CHUNK):
+    # Posts the next range of ids. Returns (moves, total, done).
+    move_type, amt_expr, where, amt_params, where_params = posting_sql(kind, amount, below)
+
+    def work(cur):
+        cur.execute('''
+            SELECT last_id, end_id, finished FROM postings
+            WHERE post_date = ? AND kind = ?
+        ''', (post_date, kind))
+        lo, end_id, finished = cur.fetchone()
+        if finished:
+            return 0, 0, True
+        hi = min(lo + chunk, end_id)
+        rng = (lo, hi)
+
+        cur.execute(f'''
+            SELECT COUNT(*), COALESCE(SUM({amt_expr}), 0) FROM users
+            WHERE id > ? AND id <= ? AND {where}
+        ''', amt_params + rng + where_params)
+        moves, total = cur.fetchone()
+
+        # Moves first, they need the balances from before the UPDATE
+        cur.execute(f'''
+            INSERT INTO money_moves (acc_num, move_type, amount, via)
+            SELECT acc_num, '{move_type}', {amt_expr}, 'posting' FROM users
+            WHERE id > ? AND id <= ? AND {where}
+            ORDER BY id
+        ''', amt_params + rng + where_params)
+        if cur.rowcount != moves:
+            raise ValueError("Accounts changed while posting, nothing was written")
+        sign = '+' if move_type == 'CREDIT' else '-'
+        cur.execute(f'''
+            UPDATE users
+            SET cash_balance = cash_balance {sign} {amt_expr}, version = version + 1
+            WHERE id > ? AND id <= ? AND {where}
+        ''', amt_params + rng + where_params)
+        if cur.rowcount != moves:
+            raise ValueError("Accounts changed while posting, nothing was written")
+
+        done = hi >= end_id
+        cur.execute(f'''
+            UPDATE postings
+            SET last_id = ?, moves = moves + ?, total = total + ?
+                {', finished = CURRENT_TIMESTAMP' if done else ''}
+            WHERE post_date = ? AND kind = ?
+        ''', (hi, moves, total, post_date, kind))
+        return moves, total, done
+
+    return bank.run_write(work)
+
+
+def post(bank, kind, amount, post_date=None, below=None, chunk=CHUNK, pause=PAUSE):
+    if kind not in KINDS:
+        raise ValueError(f"Unknown posting {kind!r}")
+    if amount <= 0:
+        raise ValueError("Amount needs to be positive!")
+    post_date = post_date or datetime.datetime.utcnow().strftime('%Y-%m-%d')
+    datetime.datetime.strptime(post_date, '%Y-%m-%d')
+
+    last_id, end_id, finished = start_run(bank, post_date, kind, amount, below)
+    res = {'date': post_date, 'kind': kind, 'resumed_at': last_id,
+           'moves': 0, 'total': 0, 'already_done': bool(finished)}
+    done = bool(finished)
+    while not done:
+        moves, total, done = post_chunk(bank, post_date, kind, amount, below, chunk)
+        res['moves'] += moves
+        res['total'] += total
+        if pause and not done:
+            time.sleep(pause)
+    # Our own cached balances are all stale now
+    bank.cache.clear()
+    return res
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] not in KINDS:
+        print("Usage: python postings.py interest|fee [--rate BP | --fee DOLLARS] ...")
+        sys.exit(1)
+    kind = args[0]
+
+    def opt(name, default=None):
+        return args[args.index(name) + 1] if name in args else default
+
+    db_path = opt('--db', DB_FILE)
+    if kind == 'interest':
+        amount = int(opt('--rate', 0))
+        below = None
+    else:
+        amount = to_cents(opt('--fee', 0))
+        below = to_cents(opt('--below')) if '--below' in args else None
+
+    bank = BankingService(db_path)
+    start = time.perf_counter()
+    try:
+        res = post(bank, kind, amount, opt('--date'), below,
+                   int(opt('--chunk', CHUNK)), float(opt('--pause', PAUSE)))
+    except ValueError as e:
+        print(str(e))
+        sys.exit(1)
+    finally:
+        bank.close_all()
+
+    if res['already_done']:
+        print(f"{kind} for {res['date']} was posted already")
+        return
+    if res['resumed_at']:
+        print(f"Resumed after account id {res['resumed_at']}")
+    print(f"Posted {kind} for {res['date']}: {res['moves']} accounts, "
+          f"${fmt_money(res['total'])} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import sqlite3
+
+# Quizzes compiled out of quiz_app.db into one read-only binary file, so the
+# quiz apps (with_db.py, with_file.py, dict.py) start without querying or
+# parsing anything: the loader maps the file and decodes a question only
+# when it's asked for.
+#
+# Layout, little endian:
+#   header    magic, format version, counts, catalog_version and catalog_id
+#             of the db it was built from, offsets of the parts below
+#   blob      question records back to back: option count, answer index,
+#             byte lengths of the question and every option, then their
+#             UTF-8 text. Options are kept as a list, so commas are fine.
+#   names     quiz names, UTF-8
+#   quizzes   per quiz: id, first question, question count, name offset/length
+#   index     per question: blob offset, record length
+# Questions of one quiz are consecutive, in quiz_questions id order.
+#
+# quiz_questions.options is a JSON list, or the old "A,B,C,D" text.
+# A question whose answer isn't one of its options stops the build.
+#
+# A bundle only stands for its db while both the version and the id match:
+# every fresh db starts at version 0, the random catalog_id (db_init.py)
+# tells two of them apart. Bundles of a db without an id never match.
+#
+# Usage: python quiz_bundle.py [--db FILE] [--out FILE]
+
+DB_FILE = "quiz_app.db"
+BUNDLE_FILE = "quiz_app.qzb"
+
+MAGIC = b'QZBN'
+FORMAT = 2
+HEADER = struct.Struct('<4sHHIIq16sQQQQ')
+NO_ID = bytes(16)
+QUIZ = struct.Struct('<qIIQI')
+INDEX = struct.Struct('<QI')
+QUESTION = struct.Struct('<BB')
+
+
+def parse_options(text):
+    # JSON list, or the comma-joined text of older rows
+    if text.startswith('['):
+        return [str(opt) for opt in json.loads(text)]
+    return text.split(",")
+
+
+def encode_question(question, options, answer_idx):
+    parts = [question.encode('utf-8')] + [opt.encode('utf-8') for opt in options]
+    return (QUESTION.pack(len(options), answer_idx)
+            + struct.pack(f'<{len(parts)}I', *map(len, parts)) + b''.join(parts))
+
+
+def build(db_path=DB_FILE, out=BUNDLE_FILE):
+    # Writes the bundle next to out and renames it over, returns counts
+    conn = sqlite3.connect(db_path)
+    tmp = f"{out}.tmp"
+    try:
+        cursor = conn.cursor()
+        # One read transaction, the catalog can't change halfway
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT name FROM pragma_table_info('catalog_version')")
+        cols = [r[0] for r in cursor.fetchall()]
+        version, catalog_id = -1, None
+        if 'catalog_id' in cols:
+            cursor.execute("SELECT version, catalog_id FROM catalog_version WHERE id = 1")
+            row = cursor.fetchone()
+            if row:
+                version, catalog_id = row
+        elif cols:
+            cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+            row = cursor.fetchone()
+            version = row[0] if row else -1
+        cursor.execute("SELECT id, name FROM quizzes ORDER BY id")
+        quizzes = cursor.fetchall()
+
+        counts = {}
+        index = []
+        with open(tmp, 'wb') as f:
+            f.write(b'\0' * HEADER.size)
+            pos = HEADER.size
+            cursor.execute("""
+                SELECT quiz_id, id, question, options, answer FROM quiz_questions
+                ORDER BY quiz_id, id
+            """)
+            quiz_ids = {quiz_id for quiz_id, _ in quizzes}
+            first = {}
+            for quiz_id, q_id, question, options, answer in cursor:
+                if quiz_id not in quiz_ids:
+                    continue
+                options = parse_options(options)
+                if len(options) > 255:
+                    raise ValueError(f"Question {q_id}: more than 255 options")
+                if answer not in options:
+                    raise ValueError(f"Question {q_id}: answer {answer!r} isn't one of its options")
+                rec = encode_question(question, options, options.index(answer))
+                first.setdefault(quiz_id, len(index))
+                counts[quiz_id] = counts.get(quiz_id, 0) + 1
+                index.append((pos, len(rec)))
+                f.write(rec)
+                pos += len(rec)
+
+            names_off = pos
+            names = []
+            for quiz_id, name in quizzes:
+                data = name.encode('utf-8')
+                names.append((pos - names_off, len(data)))
+                f.write(data)
+                pos += len(data)
+
+            quiz_off = pos
+            for (quiz_id, _), (name_at, name_len) in zip(quizzes, names):
+                f.write(QUIZ.pack(quiz_id, first.get(quiz_id, 0), counts.get(quiz_id, 0),
+                                  name_at, name_len))
+            index_off = quiz_off + QUIZ.size * len(quizzes)
+            f.write(b''.join(INDEX.pack(*entry) for entry in index))
+
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, FORMAT, 0, len(quizzes), len(index), version,
+                                bytes.fromhex(catalog_id) if catalog_id else NO_ID,
+                                HEADER.size, names_off, quiz_off, index_off))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, out)
+    finally:
+        conn.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return {'quizzes': len(quizzes), 'questions': len(index), 'bytes': os.path.getsize(out),
+            'catalog_version': version, 'catalog_id': catalog_id}
+
+
+class Questions:
+    # One quiz's questions, decoded on access: (question, [options], answer index)
+    def __init__(self, bundle, first, count):
+        self._bundle = bundle
+        self._first = first
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._bundle.question(self._first + i)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._bundle.question(self._first + i)
+
+
+class Bundle:
+    def __init__(self, path=BUNDLE_FILE):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} isn't a quiz bundle")
+        (magic, fmt, _, n_quizzes, n_questions, self.catalog_version, catalog_id,
+         self._blob, names_off, quiz_off, self._index) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't a quiz bundle")
+        if fmt != FORMAT:
+            raise ValueError(f"{path} is bundle format {fmt}, this loader reads {FORMAT}")
+        self.n_questions = n_questions
+        self.catalog_id = None if catalog_id == NO_ID else catalog_id.hex()
+
+        # The quiz table is small, the questions stay in the file
+        self._quizzes = {}
+        self._order = []
+        for i in range(n_quizzes):
+            quiz_id, first, count, name_at, name_len = QUIZ.unpack_from(self._map, quiz_off + i * QUIZ.size)
+            start = names_off + name_at
+            name = self._map[start:start + name_len].decode('utf-8')
+            self._quizzes[quiz_id] = (name, first, count)
+            self._order.append((quiz_id, name))
+
+    def matches(self, stamp):
+        # stamp is (catalog_id, version) of a db: built from that very db at
+        # that version
+        catalog_id, version = stamp
+        return (self.catalog_id is not None and self.catalog_id == catalog_id
+                and self.catalog_version == version)
+
+    def quizzes(self):
+        # [(id, name)] in id order
+        return list(self._order)
+
+    def find(self, name):
+        # Id of the quiz with that name (case doesn't matter), or None
+        name = name.lower()
+        for quiz_id, quiz_name in self._order:
+            if quiz_name.lower() == name:
+                return quiz_id
+        return None
+
+    def questions(self, quiz_id):
+        _, first, count = self._quizzes[quiz_id]
+        return Questions(self, first, count)
+
+    def question(self, n):
+        at, length = INDEX.unpack_from(self._map, self._index + n * INDEX.size)
+        n_options, answer_idx = QUESTION.unpack_from(self._map, at)
+        lens = struct.unpack_from(f'<{n_options + 1}I', self._map, at + QUESTION.size)
+        pos = at + QUESTION.size + 4 * len(lens)
+        texts = []
+        for size in lens:
+            texts.append(self._map[pos:pos + size].decode('utf-8'))
+            pos += size
+        return texts[0], texts[1:], answer_idx
+
+    def close(self):
+        self._map.close()
+
+
+def open_bundle(path=BUNDLE_FILE):
+    # The bundle if there's a readable one, None means use the built-in or
+    # db questions
+    try:
+        return Bundle(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def main():
+    args = sys.argv[1:]
+    db_path = args[args.index('--db') + 1] if '--db' in args else DB_FILE
+    out = args[args.index('--out') + 1] if '--out' in args else BUNDLE_FILE
+    if not os.path.exists(db_path):
+        print(f"{db_path} doesn't exist")
+        sys.exit(1)
+    try:
+        res = build(db_path, out)
+    except ValueError as e:
+        print(f"Build failed: {str(e)}")
+        sys.exit(1)
+    print(f"Wrote {out}: {res['quizzes']} quizzes, {res['questions']} questions, "
+          f"{res['bytes']} bytes (catalog {res['catalog_id']} version {res['catalog_version']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import sys
+
+import numpy as np
+
+from bank_service import BankingService, DB_FILE, connect_db
+from money import fmt_money
+from shards import ShardedBank
+
+# Ledger check: every users.cash_balance has to equal the net of its
+# money_moves (credits in, debits and outgoing transfers out, incoming
+# transfers in). money_moves is streamed in big chunks into NumPy arrays and
+# netted per account with grouped adds, so memory depends on the number of
+# accounts and the chunk size, never on the length of the history.
+#
+# Usage: python reconcile.py [--incremental] [--db FILE] [--shards N] [--show N]
+#
+# --incremental starts from the expected balances saved by the last run and
+# only nets moves after its checkpoint id. Accounts opened before opening
+# deposits were written to money_moves show that deposit as their difference.
+#
+# Archived months (archive_moves.py) come in through archive_net, the net
+# the archiver kept per account. If a month got archived past the
+# checkpoint, --incremental falls back to a full run.
+#
+# Sharded banks (--shards N, see shards.py) are checked shard by shard. A
+# cross-shard transfer leaves a TRANSFER row on both shards, each with one
+# end that lives elsewhere. Every such copy is matched to its own xfer_out
+# (sender, committed or done) or xfer_in (receiver, done) row, and only the
+# rows left over count as orphans.
+
+CHUNK_ROWS = 1000000
+
+
+def setup_recon_tables(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS recon_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_move_id INTEGER NOT NULL,
+            run_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # What the ledger says each account should hold as of last_move_id
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS recon_balances (
+            acc_num TEXT PRIMARY KEY,
+            expected INTEGER NOT NULL
+        )
+    ''')
+
+
+def locate(accs, keys):
+    # Positions of keys in the sorted accs array, plus which ones exist at all
+    if not len(accs):
+        return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+    pos = np.searchsorted(accs, keys)
+    pos[pos >= len(accs)] = len(accs) - 1
+    return pos, accs[pos] == keys
+
+
+def fetch_columns(cur, chunk_rows):
+    # Yields each fetchmany() chunk turned into a tuple of columns
+    while True:
+        rows = cur.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield tuple(zip(*rows))
+
+
+def load_accounts(cur, chunk_rows):
+    # acc_num as bytes keeps the arrays compact ('S10' instead of 'U10')
+    cur.execute("SELECT CAST(acc_num AS BLOB), cash_balance FROM users")
+    accs, bals = [], []
+    for acc_col, bal_col in fetch_columns(cur, chunk_rows):
+        accs.append(np.array(acc_col))
+        bals.append(np.array(bal_col, dtype=np.int64))
+    if not accs:
+        return np.array([], dtype='S10'), np.array([], dtype=np.int64)
+
+    accs = np.concatenate(accs)
+    bals = np.concatenate(bals)
+    order = np.argsort(accs, kind='stable')
+    return accs[order], bals[order]
+
+
+def load_expected(cur, accs, chunk_rows):
+    expected = np.zeros(len(accs), dtype=np.int64)
+    cur.execute("SELECT CAST(acc_num AS BLOB), expected FROM recon_balances")
+    for acc_col, exp_col in fetch_columns(cur, chunk_rows):
+        pos, found = locate(accs, np.array(acc_col))
+        expected[pos[found]] = np.array(exp_col, dtype=np.int64)[found]
+    return expected
+
+
+def load_archived(cur, accs, chunk_rows):
+    net = np.zeros(len(accs), dtype=np.int64)
+    cur.execute("SELECT CAST(acc_num AS BLOB), net FROM archive_net")
+    for acc_col, net_col in fetch_columns(cur, chunk_rows):
+        pos, found = locate(accs, np.array(acc_col))
+        np.add.at(net, pos[found], np.array(net_col, dtype=np.int64)[found])
+    return net
+
+
+def net_moves(cur, accs, after_id, upto_id, chunk_rows):
+    # Net cents per account for moves in (after_id, upto_id]
+    net = np.zeros(len(accs), dtype=np.int64)
+    moves = 0
+    orphans = 0
+
+    cur.execute('''
+        SELECT CAST(acc_num AS BLOB), move_type, amount,
+               COALESCE(CAST(to_acc AS BLOB), X'')
+        FROM money_moves
+        WHERE id > ? AND id <= ?
+    ''', (after_id, upto_id))
+
+    for src, kind, amount, dst in fetch_columns(cur, chunk_rows):
+        kind = np.array(kind)
+        amount = np.array(amount, dtype=np.int64)
+        credit = kind == 'CREDIT'
+        transfer = kind == 'TRANSFER'
+
+        # Sender side: credits add, debits and transfers take away
+        pos, found = locate(accs, np.array(src))
+        signed = np.where(credit, amount, -amount)
+        np.add.at(net, pos[found], signed[found])
+
+        # Receiver side of transfers
+        to_pos, to_found = locate(accs, np.array(dst))
+        to_found &= transfer
+        np.add.at(net, to_pos[to_found], amount[to_found])
+
+        moves += len(amount)
+        orphans += int((~found).sum() + (transfer & ~to_found).sum())
+
+    return net, moves, orphans
+
+
+def cross_shard_copies(cur, after_id, upto_id):
+    # TRANSFER rows in (after_id, upto_id] that are one shard's half of a
+    # cross-shard transfer. One row per xfer row, so a stray copy that looks
+    # like a real one still counts as an orphan.
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'shard_info'")
+    if not cur.fetchone():
+        return 0
+    cur.execute('''
+        SELECT COALESCE(SUM(MIN(m.n, x.n)), 0)
+        FROM (
+            SELECT acc_num, to_acc, amount, when_moved, COUNT(*) AS n
+            FROM money_moves
+            WHERE id > ? AND id <= ? AND move_type = 'TRANSFER'
+            GROUP BY acc_num, to_acc, amount, when_moved
+        ) m
+        JOIN (
+            SELECT from_acc, to_acc, amount, when_moved, COUNT(*) AS n
+            FROM (
+                SELECT from_acc, to_acc, amount, when_moved FROM xfer_out
+                WHERE state IN ('committed', 'done')
+                UNION ALL
+                SELECT from_acc, to_acc, amount, when_moved FROM xfer_in
+                WHERE state = 'done'
+            )
+            GROUP BY from_acc, to_acc, amount, when_moved
+        ) x ON x.from_acc = m.acc_num AND x.to_acc = m.to_acc
+           AND x.amount = m.amount AND x.when_moved = m.when_moved
+    ''', (after_id, upto_id))
+    return cur.fetchone()[0]
+
+
+def reconcile(bank, incremental=False, chunk_rows=CHUNK_ROWS, show=20):
+    if hasattr(bank, 'shards'):
+        return reconcile_shards(bank, incremental, chunk_rows, show)
+    bank.run_write(setup_recon_tables)
+
+    # Own connection and one read transaction, so balances and history come
+    # from the same snapshot while writers keep going (WAL)
+    db = connect_db(bank.db_path)
+    cur = db.cursor()
+    try:
+        cur.execute("BEGIN")
+        accs, balances = load_accounts(cur, chunk_rows)
+
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM money_moves")
+        upto_id = cur.fetchone()[0]
+
+        after_id = 0
+        if incremental:
+            cur.execute("SELECT last_move_id FROM recon_checkpoint WHERE id = 1")
+            row = cur.fetchone()
+            if row:
+                after_id = row[0]
+            # Archived rows the checkpoint hasn't seen are gone from money_moves
+            cur.execute("SELECT 1 FROM archive_months WHERE last_id > ?", (after_id,))
+            if cur.fetchone():
+                after_id = 0
+        prior = load_expected(cur, accs, chunk_rows) if after_id else \
+            load_archived(cur, accs, chunk_rows)
+
+        net, moves, orphans = net_moves(cur, accs, after_id, upto_id, chunk_rows)
+        cross = cross_shard_copies(cur, after_id, upto_id)
+    finally:
+        db.rollback()
+        db.close()
+
+    expected = prior + net
+    bad = np.nonzero(balances != expected)[0]
+
+    # Only rows that moved need writing back
+    changed = np.nonzero(expected != prior)[0] if after_id else np.arange(len(accs))
+
+    def save(cur):
+        if not after_id:
+            cur.execute("DELETE FROM recon_balances")
+        for i in range(0, len(changed), chunk_rows):
+            part = changed[i:i + chunk_rows]
+            cur.executemany(
+                "INSERT OR REPLACE INTO recon_balances (acc_num, expected) VALUES (?, ?)",
+                zip((a.decode() for a in accs[part]), expected[part].tolist()))
+        cur.execute('''
+            INSERT OR REPLACE INTO recon_checkpoint (id, last_move_id, run_at)
+            VALUES (1, ?, CURRENT_TIMESTAMP)
+        ''', (upto_id,))
+
+    bank.run_write(save)
+
+    return {
+        'accounts': len(accs),
+        'moves': moves,
+        'from_move_id': after_id,
+        'last_move_id': upto_id,
+        'orphan_moves': orphans - cross,
+        'cross_shard_moves': cross,
+        'mismatch_count': len(bad),
+        'mismatches': [(accs[i].decode(), int(balances[i]), int(expected[i]))
+                       for i in bad[:show]],
+    }
+
+
+def reconcile_shards(bank, incremental=False, chunk_rows=CHUNK_ROWS, show=20):
+    # Every shard on its own, move ids are per shard so only the counts add up
+    total = {'accounts': 0, 'moves': 0, 'orphan_moves': 0, 'cross_shard_moves': 0,
+             'mismatch_count': 0, 'mismatches': [], 'shards': []}
+    for shard in bank.shards:
+        res = reconcile(shard, incremental, chunk_rows, show)
+        total['shards'].append(res)
+        for key in ('accounts', 'moves', 'orphan_moves', 'cross_shard_moves', 'mismatch_count'):
+            total[key] += res[key]
+        total['mismatches'].extend(res['mismatches'])
+    total['mismatches'] = total['mismatches'][:show]
+    return total
+
+
+def main():
+    args = sys.argv[1:]
+    db_path = DB_FILE
+    show = 20
+    if '--db' in args:
+        db_path = args[args.index('--db') + 1]
+    if '--show' in args:
+        show = int(args[args.index('--show') + 1])
+    n_shards = int(args[args.index('--shards') + 1]) if '--shards' in args else 1
+
+    if n_shards > 1:
+        bank = ShardedBank(db_path, n_shards)
+    else:
+        bank = BankingService(db_path)
+    res = reconcile(bank, incremental='--incremental' in args, show=show)
+    bank.close_all()
+
+    if n_shards > 1:
+        print(f"Checked {res['accounts']} accounts against {res['moves']} moves "
+              f"on {n_shards} shards ({res['cross_shard_moves']} cross-shard copies)")
+    else:
+        print(f"Checked {res['accounts']} accounts against {res['moves']} moves "
+              f"(ids {res['from_move_id'] + 1}..{res['last_move_id']})")
+    if res['orphan_moves']:
+        print(f"{res['orphan_moves']} moves point at accounts that don't exist")
+    if not res['mismatch_count']:
+        print("All balances match the ledger")
+        return
+
+    print(f"{res['mismatch_count']} accounts don't match:")
+    print(f"{'Account #':<15} {'Balance':>14} {'Ledger':>14} {'Diff':>14}")
+    for acc, have, want in res['mismatches']:
+        print(f"{acc:<15} {fmt_money(have):>14} {fmt_money(want):>14} {fmt_money(have - want):>14}")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import os
+import sys
+
+import rollups
+from bank_service import BankingService, DB_FILE, USER_COLS, MOVE_COLS
+from shards import ShardedBank, shard_index, shard_paths
+
+# Splits a single-file bank into N shards (see shards.py). The source file is
+# only read, the shards are new files next to it (or next to --out).
+# Run it with the bank stopped, writes made while it copies are not carried over.
+#
+# Usage: python reshard.py N [--db FILE] [--out FILE]
+#   python reshard.py 4   ->   banking_system.shard0of4.db ... shard3of4.db
+# then start the bank with BANK_SHARDS=4.
+
+CHUNK = 20000
+
+LOGIN_COLS = ('id', 'acc_num', 'login_time', 'logout_time', 'event_id')
+
+
+def copy_table(src, bank, table, cols, route):
+    # Streams table from src in id order. route(row) gives the shard(s) a
+    # row goes to, every shard gets one executemany per chunk.
+    n = len(bank.shards)
+    names = ', '.join(cols)
+    marks = ', '.join('?' * len(cols))
+    cur = src.cursor()
+    cur.execute(f"SELECT {names} FROM {table} ORDER BY id")
+    copied = 0
+    while True:
+        rows = cur.fetchmany(CHUNK)
+        if not rows:
+            return copied
+        parts = [[] for _ in range(n)]
+        for row in rows:
+            for idx in route(row):
+                parts[idx].append(row)
+        for idx, part in enumerate(parts):
+            if part:
+                bank.shards[idx].run_write(lambda c: c.executemany(
+                    f"INSERT INTO {table} ({names}) VALUES ({marks})", part))
+        copied += len(rows)
+
+
+def reshard(src_path, n, out_path=None):
+    out_path = out_path or src_path
+    for path in shard_paths(out_path, n):
+        if os.path.exists(path):
+            raise ValueError(f"{path} already exists, not overwriting it")
+
+    # Opening it brings older files up to the current schema first
+    source = BankingService(src_path)
+    src = source.conn()
+    # Archive files belong to one db file, the shards would lose them
+    if src.execute("SELECT 1 FROM archive_months LIMIT 1").fetchone():
+        source.close_all()
+        raise ValueError("This bank has archived months, resharding only copies live moves")
+    bank = ShardedBank(out_path, n)
+
+    acc_col = USER_COLS.index('acc_num')
+    users = copy_table(src, bank, 'users', USER_COLS,
+                       lambda row: (shard_index(row[acc_col], n),))
+
+    logins = copy_table(src, bank, 'login_info', LOGIN_COLS,
+                        lambda row: (shard_index(row[1], n),))
+
+    # Transfers between shards go to both sides, like ShardedBank.transfer
+    def move_route(row):
+        src_idx = shard_index(row[1], n)
+        to_acc = row[MOVE_COLS.index('to_acc')]
+        if to_acc:
+            dst_idx = shard_index(to_acc, n)
+            if dst_idx != src_idx:
+                return src_idx, dst_idx
+        return (src_idx,)
+
+    moves = copy_table(src, bank, 'money_moves', MOVE_COLS + ('via',), move_route)
+
+    # The triggers counted the receivers' copies too
+    for shard in bank.shards:
+        shard.run_write(lambda cur: rollups.uncount(
+            cur, "to_acc IS NOT NULL AND acc_num NOT IN (SELECT acc_num FROM users)"))
+
+    # New account numbers carry on where the old file stopped
+    rows = src.execute("SELECT name, next_val FROM acc_seq").fetchall()
+    bank.shards[0].run_write(lambda cur: cur.executemany('''
+        INSERT INTO acc_seq (name, next_val) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET next_val = MAX(next_val, excluded.next_val)
+    ''', rows))
+
+    # Same accounts and the same money on both sides, or it didn't work
+    want = src.execute("SELECT COUNT(*), COALESCE(SUM(cash_balance), 0) FROM users").fetchone()
+    got = [0, 0]
+    for shard in bank.shards:
+        count, total = shard.conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(cash_balance), 0) FROM users").fetchone()
+        got[0] += count
+        got[1] += total
+
+    source.close_all()
+    bank.close_all()
+    if tuple(got) != tuple(want):
+        raise ValueError(f"Shards hold {got[0]} accounts / {got[1]} cents, "
+                         f"source has {want[0]} / {want[1]}")
+    return {'users': users, 'logins': logins, 'moves': moves,
+            'paths': shard_paths(out_path, n)}
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or not args[0].isdigit() or int(args[0]) < 2:
+        print("Usage: python reshard.py N [--db FILE] [--out FILE]   (N >= 2)")
+        sys.exit(1)
+    src = args[args.index('--db') + 1] if '--db' in args else DB_FILE
+    out = args[args.index('--out') + 1] if '--out' in args else None
+    if not os.path.exists(src):
+        print(f"{src} doesn't exist")
+        sys.exit(1)
+
+    try:
+        res = reshard(src, int(args[0]), out)
+    except ValueError as e:
+        print(f"Reshard failed: {str(e)}")
+        sys.exit(1)
+
+    print(f"Copied {res['users']} accounts, {res['logins']} logins and "
+          f"{res['moves']} money moves into:")
+    for path in res['paths']:
+        print(f"  {path}")
+
+
+if __name__ == "__main__":
+    main()
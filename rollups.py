@@ -0,0 +1,160 @@
+# Daily and monthly totals of money_moves per (period, acc_num, move_type).
+# A trigger keeps them up to date inside the same transaction as every move
+# insert, so the current period is as exact as the closed ones and reports
+# never have to touch the raw table. Rows archived or deleted from
+# money_moves stay counted here on purpose.
+
+PERIODS = {
+    # period -> (table, key column, length of the when_moved prefix)
+    'day': ('moves_daily', 'day', 10),
+    'month': ('moves_monthly', 'month', 7),
+}
+
+GROUPS = ('period', 'acc_num', 'move_type', 'city')
+
+BACKFILL_CHUNK = 200000
+
+
+def install(cur):
+    # Tables and triggers, plus the backfill range for moves that were
+    # already there. Has to run in one transaction so no move is counted
+    # twice or missed.
+    for table, key, size in PERIODS.values():
+        cur.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} TEXT NOT NULL,
+                acc_num TEXT NOT NULL,
+                move_type TEXT NOT NULL,
+                moves INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                PRIMARY KEY ({key}, acc_num, move_type)
+            ) WITHOUT ROWID
+        ''')
+        # Per-account dashboards
+        cur.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table}_acc ON {table} (acc_num, {key})
+        ''')
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_add
+            AFTER INSERT ON money_moves BEGIN
+                INSERT INTO {table} ({key}, acc_num, move_type, moves, total)
+                VALUES (substr(NEW.when_moved, 1, {size}), NEW.acc_num,
+                        NEW.move_type, 1, NEW.amount)
+                ON CONFLICT ({key}, acc_num, move_type) DO UPDATE
+                SET moves = moves + 1, total = total + excluded.total;
+            END
+        ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_id INTEGER NOT NULL,
+            upto_id INTEGER NOT NULL
+        )
+    ''')
+    cur.execute("SELECT 1 FROM rollup_state WHERE id = 1")
+    if not cur.fetchone():
+        # Everything up to here predates the trigger and still has to be added
+        cur.execute('''
+            INSERT INTO rollup_state (id, next_id, upto_id)
+            SELECT 1, 1, COALESCE(MAX(id), 0) FROM money_moves
+        ''')
+
+
+def backfill_chunk(cur, chunk=BACKFILL_CHUNK):
+    # Folds the next id range of pre-trigger moves into the rollups.
+    # Returns False once there's nothing left.
+    cur.execute("SELECT next_id, upto_id FROM rollup_state WHERE id = 1")
+    next_id, upto_id = cur.fetchone()
+    if next_id > upto_id:
+        return False
+
+    hi = min(next_id + chunk - 1, upto_id)
+    for table, key, size in PERIODS.values():
+        # "WHERE true" keeps SQLite from reading ON CONFLICT as a join clause
+        cur.execute(f'''
+            INSERT INTO {table} ({key}, acc_num, move_type, moves, total)
+            SELECT substr(when_moved, 1, {size}), acc_num, move_type,
+                   COUNT(*), SUM(amount)
+            FROM money_moves
+            WHERE true AND id BETWEEN ? AND ?
+            GROUP BY 1, 2, 3
+            ON CONFLICT ({key}, acc_num, move_type) DO UPDATE
+            SET moves = moves + excluded.moves, total = total + excluded.total
+        ''', (next_id, hi))
+    cur.execute("UPDATE rollup_state SET next_id = ? WHERE id = 1", (hi + 1,))
+    return True
+
+
+def uncount(cur, where, params=()):
+    # Takes moves matching where back out of the rollups. Used by shards.py
+    # for the receiver's copy of a cross-shard transfer, which the sender's
+    # shard already counts.
+    for table, key, size in PERIODS.values():
+        cur.execute(f'''
+            INSERT INTO {table} ({key}, acc_num, move_type, moves, total)
+            SELECT substr(when_moved, 1, {size}), acc_num, move_type,
+                   -COUNT(*), -SUM(amount)
+            FROM money_moves
+            WHERE true AND ({where})
+            GROUP BY 1, 2, 3
+            ON CONFLICT ({key}, acc_num, move_type) DO UPDATE
+            SET moves = moves + excluded.moves, total = total + excluded.total
+        ''', params)
+        cur.execute(f'''
+            DELETE FROM {table}
+            WHERE moves = 0 AND ({key}, acc_num, move_type) IN (
+                SELECT substr(when_moved, 1, {size}), acc_num, move_type
+                FROM money_moves WHERE {where}
+            )
+        ''', params)
+
+
+def report_query(period='day', start=None, end=None, acc_num=None,
+                 move_type=None, city=None, by=('period', 'move_type')):
+    # SQL for totals grouped by any of GROUPS, reading only the rollups
+    # (plus users when city is involved). start/end are inclusive period keys
+    # like '2026-03-01' or '2026-03'.
+    if period not in PERIODS:
+        raise ValueError(f"Period must be one of {', '.join(PERIODS)}")
+    # A list is fine too (JSON from net_server)
+    by = (by,) if isinstance(by, str) else tuple(by)
+    for g in by:
+        if g not in GROUPS:
+            raise ValueError(f"Can't group by {g!r}")
+
+    table, key, size = PERIODS[period]
+    cols = {
+        'period': f"r.{key}",
+        'acc_num': "r.acc_num",
+        'move_type': "r.move_type",
+        'city': "u.city",
+    }
+
+    where, params = [], []
+    if start:
+        where.append(f"r.{key} >= ?")
+        params.append(str(start)[:size])
+    if end:
+        where.append(f"r.{key} <= ?")
+        params.append(str(end)[:size])
+    if acc_num:
+        where.append("r.acc_num = ?")
+        params.append(acc_num)
+    if move_type:
+        where.append("r.move_type = ?")
+        params.append(move_type.upper())
+    if city:
+        where.append("u.city = ?")
+        params.append(city)
+
+    select = [f"{cols[g]} AS {g}" for g in by]
+    sql = f"SELECT {', '.join(select + ['SUM(r.moves)', 'SUM(r.total)'])} FROM {table} r"
+    if city or 'city' in by:
+        sql += " JOIN users u ON u.acc_num = r.acc_num"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if by:
+        sql += f" GROUP BY {', '.join(cols[g] for g in by)}"
+        sql += f" ORDER BY {', '.join(cols[g] for g in by)}"
+    return sql, params, tuple(by)
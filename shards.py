@@ -0,0 +1,529 @@
+import os
+import time
+import uuid
+import zlib
+import heapq
+import itertools
+import sqlite3
+import datetime
+
+from auth import SESSION_TTL, MAX_SESSIONS, SessionCache
+from bank_service import (BankingService, DB_FILE, ACC_SEQ, ACC_CHECK_DIGIT,
+                          LIST_COLS, acc_num_for, service_call)
+from money import as_cents
+import rollups
+
+# The bank split over N SQLite files, so N writers can commit at once instead
+# of one. An account lives in shard crc32(acc_num) % N, together with its
+# login_info and money_moves. Every shard is a normal BankingService file.
+#
+# Transfers inside one shard are the usual single transaction. Across shards
+# they go through two phases:
+#   1. prepare:  the receiver's shard checks the account and records the
+#                transfer in xfer_in as 'prepared'
+#   2. decide:   one transaction on the sender's shard takes the money, writes
+#                the money_moves row and records 'committed' in xfer_out.
+#                That row is the decision, no row means nothing happened.
+#   3. apply:    the receiver's shard adds the money, writes its copy of the
+#                money_moves row and marks xfer_in 'done'
+#   4. the sender's xfer_out goes to 'done'
+# recover() (run on every start) finishes committed transfers and aborts
+# prepared ones that never got a decision. Aborting inserts an 'aborted'
+# row on the sender's shard under the same id, so a slow sender that shows
+# up later fails on the primary key instead of moving money.
+#
+# Both shards keep a copy of the TRANSFER row, so statements and reconcile
+# work per shard. The receiver's copy is taken back out of its rollups.
+#
+# Account numbers: shard k hands out the sequence numbers that are k mod N,
+# and openings take turns over the shards, so they don't all queue up for
+# one file's write lock. Where the new account then lives is still up to
+# the hash. The strided sequences start past shard 0's old shared one (and
+# past what reshard.py carried over).
+# Files: banking_system.db with 4 shards is banking_system.shard0of4.db ...
+# reshard.py splits an existing single file.
+
+RECOVER_AFTER = 60      # seconds before an undecided transfer is aborted
+OPEN_RETRIES = 5
+
+
+def shard_index(acc, n):
+    return zlib.crc32(str(acc).encode('utf-8')) % n
+
+
+def shard_paths(db_path, n):
+    stem, ext = os.path.splitext(db_path)
+    return [f"{stem}.shard{i}of{n}{ext or '.db'}" for i in range(n)]
+
+
+def now():
+    # Same text format as CURRENT_TIMESTAMP (UTC)
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def setup_shard(cur, idx, n):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS shard_info (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            idx INTEGER NOT NULL,
+            count INTEGER NOT NULL
+        )
+    ''')
+    cur.execute("SELECT idx, count FROM shard_info WHERE id = 1")
+    row = cur.fetchone()
+    if row and row != (idx, n):
+        raise ValueError(f"This file is shard {row[0]} of {row[1]}, not {idx} of {n}")
+    if not row:
+        cur.execute("INSERT INTO shard_info (id, idx, count) VALUES (1, ?, ?)", (idx, n))
+
+    for table in ('xfer_out', 'xfer_in'):
+        # state: xfer_out committed/aborted/done, xfer_in prepared/aborted/done
+        cur.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                xid TEXT PRIMARY KEY,
+                from_acc TEXT NOT NULL,
+                to_acc TEXT NOT NULL,
+                amount INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                when_moved DATETIME NOT NULL,
+                created REAL NOT NULL
+            )
+        ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_xfer_out_open ON xfer_out (xid)
+        WHERE state = 'committed'
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_xfer_in_open ON xfer_in (created)
+        WHERE state = 'prepared'
+    ''')
+
+
+class ShardedBank:
+    # Same calls and results as BankingService, routed by account number
+
+    def __init__(self, db_path=DB_FILE, n_shards=4, session_ttl=SESSION_TTL,
+                 max_sessions=MAX_SESSIONS, **service_args):
+        if n_shards < 1:
+            raise ValueError("Need at least one shard")
+        self.db_path = db_path
+        self.paths = shard_paths(db_path, n_shards)
+        self.shards = []
+        for idx, path in enumerate(self.paths):
+            shard = BankingService(path, session_ttl=session_ttl,
+                                   max_sessions=max_sessions, **service_args)
+            shard.run_write(lambda cur: setup_shard(cur, idx, n_shards))
+            self.shards.append(shard)
+        self._seq_turn = itertools.count()
+
+        # One token store, a session doesn't care where its account lives
+        self.sessions = SessionCache(session_ttl, max_sessions)
+        for shard in self.shards:
+            shard.sessions = self.sessions
+
+        self.recover()
+
+
+    def index(self, acc):
+        return shard_index(acc, len(self.shards))
+
+    def shard(self, acc):
+        return self.shards[self.index(acc)]
+
+    def release(self):
+        for shard in self.shards:
+            shard.release()
+
+    def close_all(self):
+        for shard in self.shards:
+            shard.close_all()
+
+
+    def take_acc_num(self, check_digit=ACC_CHECK_DIGIT):
+        # Next number from the strided sequence of the shard whose turn it is
+        seq, first, last = ACC_SEQ[check_digit]
+        n = len(self.shards)
+        idx = next(self._seq_turn) % n
+        name = f"{seq}.strided"
+
+        def work(cur):
+            cur.execute("SELECT next_val FROM acc_seq WHERE name = ?", (name,))
+            row = cur.fetchone()
+            if row:
+                num = row[0]
+            else:
+                # First one here, carry on after the shared sequence
+                old = self.shards[0].conn().execute(
+                    "SELECT next_val FROM acc_seq WHERE name = ?", (seq,)).fetchone()
+                num = old[0] if old else first
+                num += (idx - num) % n
+            if num > last:
+                raise ValueError("Ran out of account numbers!")
+            cur.execute("INSERT OR REPLACE INTO acc_seq (name, next_val) VALUES (?, ?)",
+                        (name, num + n))
+            return acc_num_for(num, check_digit)
+
+        return self.shards[idx].run_write(work)
+
+    @service_call
+    def open_account(self, name, dob, city, pwd, cash, phone, email):
+        for _ in range(OPEN_RETRIES):
+            acc = self.take_acc_num()
+            res = self.shard(acc).open_account(name, dob, city, pwd, cash,
+                                               phone, email, acc_num=acc)
+            # An old number from before the sequence can already be taken
+            if res['ok'] or 'UNIQUE' not in res['error']:
+                if not res['ok']:
+                    raise ValueError(res['error'])
+                return {'acc_num': res['acc_num']}
+        raise ValueError("Couldn't find a free account number, try again")
+
+
+    # Account calls just go to the right shard
+
+    def login(self, acc, pwd):
+        return self.shard(acc).login(acc, pwd)
+
+    @service_call
+    def check_session(self, token):
+        acc = self.sessions.check(token)
+        if acc is None:
+            raise ValueError("Session expired, please log in again!")
+        return {'acc_num': acc}
+
+    def logout(self, acc, token=None):
+        return self.shard(acc).logout(acc, token)
+
+    def get_user(self, acc):
+        return self.shard(acc).get_user(acc)
+
+    def balance(self, acc):
+        return self.shard(acc).balance(acc)
+
+    def credit(self, acc, amt):
+        return self.shard(acc).credit(acc, amt)
+
+    def debit(self, acc, amt):
+        return self.shard(acc).debit(acc, amt)
+
+    def statement(self, acc, start=None, end=None, page_size=50, after=None):
+        # Both sides of every transfer are in the account's own shard
+        return self.shard(acc).statement(acc, start, end, page_size, after)
+
+    def iter_statement(self, acc, start=None, end=None, page_size=50):
+        return self.shard(acc).iter_statement(acc, start, end, page_size)
+
+    def change_pwd(self, acc, old_pwd, new_pwd):
+        return self.shard(acc).change_pwd(acc, old_pwd, new_pwd)
+
+    def update_info(self, acc, name=None, city=None, phone=None, email=None):
+        return self.shard(acc).update_info(acc, name, city, phone, email)
+
+
+    @service_call
+    def transfer(self, acc, to_acc, amt):
+        return self._transfer(acc, to_acc, amt)
+
+    @service_call
+    def _batch_transfer(self, acc, to_acc, amt):
+        # Cross-shard rows of apply_batch: two phases like any transfer, but
+        # like every batch move not held to the velocity limits
+        return self._transfer(acc, to_acc, amt, via='batch')
+
+    def _transfer(self, acc, to_acc, amt, via=None):
+        amt = as_cents(amt)
+        if amt <= 0:
+            raise ValueError("Amount needs to be positive!")
+        if to_acc == acc:
+            raise ValueError("Can't send money to yourself!")
+        src, dst = self.index(acc), self.index(to_acc)
+        if src == dst:
+            res = self.shards[src].transfer(acc, to_acc, amt)
+            if not res['ok']:
+                raise ValueError(res['error'])
+            del res['ok']
+            return res
+
+        xid = uuid.uuid4().hex
+        when = now()
+        sender, receiver = self.shards[src], self.shards[dst]
+
+        # 1. prepare
+        def prepare(cur):
+            cur.execute("SELECT 1 FROM users WHERE acc_num = ?", (to_acc,))
+            if not cur.fetchone():
+                raise ValueError("Account not found!")
+            cur.execute('''
+                INSERT INTO xfer_in (xid, from_acc, to_acc, amount, state, when_moved, created)
+                VALUES (?, ?, ?, ?, 'prepared', ?, ?)
+            ''', (xid, acc, to_acc, amt, when, time.time()))
+
+        receiver.run_write(prepare)
+
+        # 2. decide
+        def decide(cur):
+            try:
+                cur.execute('''
+                    INSERT INTO xfer_out (xid, from_acc, to_acc, amount, state, when_moved, created)
+                    VALUES (?, ?, ?, ?, 'committed', ?, ?)
+                ''', (xid, acc, to_acc, amt, when, time.time()))
+            except sqlite3.IntegrityError:
+                raise ValueError("Transfer timed out, nothing was moved. Please try again!")
+            sender._take_cash(cur, acc, amt)
+            cur.execute('''
+                INSERT INTO money_moves (acc_num, move_type, amount, to_acc, when_moved, via)
+                VALUES (?, 'TRANSFER', ?, ?, ?, ?)
+            ''', (acc, amt, to_acc, when, via))
+            return sender._new_balance(cur, acc)
+
+        try:
+            if via:
+                balance, version = sender.run_write(decide)
+            else:
+                balance, version = sender.limited(acc, amt, decide)
+        except (ValueError, sqlite3.Error):
+            self.abort(xid, src, dst)
+            raise
+        sender.cache.write(acc, version, cash_balance=balance)
+
+        # 3. + 4. apply. The money has left already, if this fails now
+        # recover() finishes it
+        try:
+            self.finish(xid, src, dst)
+        except (ValueError, sqlite3.Error):
+            pass
+        return {'amount': amt, 'to_acc': to_acc, 'balance': balance}
+
+    def finish(self, xid, src, dst):
+        def apply(cur):
+            cur.execute('''
+                SELECT from_acc, to_acc, amount, when_moved FROM xfer_in
+                WHERE xid = ? AND state = 'prepared'
+            ''', (xid,))
+            row = cur.fetchone()
+            if not row:
+                return
+            from_acc, to_acc, amt, when = row
+            self.shards[dst]._add_cash(cur, to_acc, amt)
+            cur.execute('''
+                INSERT INTO money_moves (acc_num, move_type, amount, to_acc, when_moved)
+                VALUES (?, 'TRANSFER', ?, ?, ?)
+            ''', (from_acc, amt, to_acc, when))
+            rollups.uncount(cur, "id = ?", (cur.lastrowid,))
+            cur.execute("UPDATE xfer_in SET state = 'done' WHERE xid = ?", (xid,))
+            return to_acc
+
+        to_acc = self.shards[dst].run_write(apply)
+        if to_acc:
+            self.shards[dst].cache.drop(to_acc)
+        self.shards[src].run_write(lambda cur: cur.execute(
+            "UPDATE xfer_out SET state = 'done' WHERE xid = ? AND state = 'committed'", (xid,)))
+
+    def abort(self, xid, src, dst):
+        # Returns True if it's aborted now, False if the sender already committed
+        def decide_abort(cur):
+            # Only the id matters here, it's what blocks a late commit
+            cur.execute('''
+                INSERT OR IGNORE INTO xfer_out (xid, from_acc, to_acc, amount, state, when_moved, created)
+                VALUES (?, '', '', 0, 'aborted', '', ?)
+            ''', (xid, time.time()))
+            cur.execute("SELECT state FROM xfer_out WHERE xid = ?", (xid,))
+            return cur.fetchone()[0]
+
+        if self.shards[src].run_write(decide_abort) != 'aborted':
+            return False
+        self.shards[dst].run_write(lambda cur: cur.execute(
+            "UPDATE xfer_in SET state = 'aborted' WHERE xid = ? AND state = 'prepared'", (xid,)))
+        return True
+
+    def recover(self, max_age=RECOVER_AFTER):
+        # Finishes what a crash left half done. Prepared transfers younger
+        # than max_age are left alone, their sender may still be on it.
+        n = len(self.shards)
+        finished = aborted = 0
+        for src, shard in enumerate(self.shards):
+            cur = shard.conn().cursor()
+            cur.execute("SELECT xid, to_acc FROM xfer_out WHERE state = 'committed'")
+            for xid, to_acc in cur.fetchall():
+                self.finish(xid, src, shard_index(to_acc, n))
+                finished += 1
+
+        cutoff = time.time() - max_age
+        for dst, shard in enumerate(self.shards):
+            cur = shard.conn().cursor()
+            cur.execute('''
+                SELECT xid, from_acc FROM xfer_in
+                WHERE state = 'prepared' AND created < ?
+            ''', (cutoff,))
+            for xid, from_acc in cur.fetchall():
+                src = shard_index(from_acc, n)
+                if self.abort(xid, src, dst):
+                    aborted += 1
+                else:
+                    self.finish(xid, src, dst)
+                    finished += 1
+        return {'finished': finished, 'aborted': aborted}
+
+
+    # Calls that need every shard
+
+    @service_call
+    def list_users(self, city=None, min_balance=None, max_balance=None,
+                   order_by='acc_num', desc=False, page_size=100, after=None):
+        # Same as BankingService.list_users, except 'next' holds one keyset
+        # cursor per shard. Every shard gives its next page_size rows and the
+        # smallest page_size of them make the page.
+        n = len(self.shards)
+        afters = list(after) if after else [None] * n
+        if len(afters) != n:
+            raise ValueError("That page is from a different number of shards")
+
+        rows = []
+        for idx, shard in enumerate(self.shards):
+            sql, params = shard._users_query(city, min_balance, max_balance, order_by,
+                                             desc, afters[idx], page_size)
+            cur = shard.read_conn().cursor()
+            cur.execute(sql, params)
+            rows.extend((r[-2], idx, r[-1], r) for r in cur.fetchall())
+
+        rows.sort(key=lambda r: r[:3], reverse=bool(desc))
+        page = rows[:int(page_size)]
+        for _, idx, _, r in page:
+            afters[idx] = tuple(r[-2:])
+
+        nxt = afters if len(page) == int(page_size) else None
+        return {'users': [dict(zip(LIST_COLS, r)) for *_, r in page], 'next': nxt}
+
+    def iter_users(self, city=None, min_balance=None, max_balance=None,
+                   order_by='acc_num', desc=False, batch_size=1000):
+        # Merged like list_users pages, on (sort column, shard, id), so it
+        # works for every order, 'id' too
+        sql, params = self.shards[0]._users_query(city, min_balance, max_balance,
+                                                  order_by, desc)
+        streams = [self._user_rows(idx, sql, params, batch_size)
+                   for idx in range(len(self.shards))]
+        for *_, r in heapq.merge(*streams, reverse=bool(desc)):
+            yield dict(zip(LIST_COLS, r))
+
+    def _user_rows(self, idx, sql, params, batch_size):
+        # (sort value, shard, id, row) from one shard, fetchmany at a time
+        cur = self.shards[idx].read_conn().cursor()
+        cur.execute(sql, params)
+        try:
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                for r in rows:
+                    yield (r[-2], idx, r[-1], r)
+        finally:
+            cur.close()
+
+    # Only needs iter_users
+    export_users = BankingService.export_users
+
+    @service_call
+    def move_totals(self, period='day', start=None, end=None, acc_num=None,
+                    move_type=None, city=None, by=('period', 'move_type')):
+        shards = [self.shard(acc_num)] if acc_num else self.shards
+        totals = {}
+        for shard in shards:
+            res = shard.move_totals(period, start, end, acc_num, move_type, city, by)
+            if not res['ok']:
+                raise ValueError(res['error'])
+            for row in res['rows']:
+                key = tuple((k, v) for k, v in row.items() if k not in ('moves', 'total'))
+                entry = totals.setdefault(key, [0, 0])
+                entry[0] += row['moves']
+                entry[1] += row['total']
+        return {'rows': [dict(key, moves=m, total=t)
+                         for key, (m, t) in sorted(totals.items())]}
+
+    @service_call
+    def prune_logins(self, keep_days):
+        gone = 0
+        for shard in self.shards:
+            res = shard.prune_logins(keep_days)
+            if not res['ok']:
+                raise ValueError(res['error'])
+            gone += res['deleted']
+        return {'deleted': gone}
+
+    @service_call
+    def refresh_snapshot(self):
+        for shard in self.shards:
+            res = shard.refresh_snapshot()
+            if not res['ok']:
+                raise ValueError(res['error'])
+        return {'snapshots': [shard.replica.stats() for shard in self.shards]}
+
+    @service_call
+    def cache_stats(self):
+        # Every shard has its own account cache, the counts are added up
+        stats = [shard.cache.stats() for shard in self.shards]
+        total = {key: sum(s[key] for s in stats)
+                 for key in ('size', 'max_size', 'hits', 'misses', 'expired',
+                             'evicted', 'reconciled')}
+        looked = total['hits'] + total['misses']
+        total['ttl'] = stats[0]['ttl']
+        total['hit_rate'] = round(total['hits'] / looked, 4) if looked else None
+        return {'cache': total}
+
+    @service_call
+    def apply_batch(self, moves, chunk_size=500):
+        # Moves inside one shard go in batches per shard. A cross-shard
+        # transfer is a full two-phase transfer, and the batches are flushed
+        # before it so every account still sees its moves in file order.
+        buffers = [[] for _ in self.shards]
+        applied = 0
+        rejected = []
+
+        def flush(idx):
+            nonlocal applied
+            items = buffers[idx]
+            if not items:
+                return
+            buffers[idx] = []
+            res = self.shards[idx].apply_batch([m for _, m in items], chunk_size)
+            if not res['ok']:
+                rejected.extend((i, res['error']) for i, _ in items)
+                return
+            applied += res['applied']
+            rejected.extend((items[i][0], why) for i, why in res['rejected'])
+
+        for idx, move in enumerate(moves):
+            acc = str(move.get('acc_num', ''))
+            src = self.index(acc)
+            to_acc = move.get('to_acc')
+            if (str(move.get('move_type', '')).upper() == 'TRANSFER' and to_acc
+                    and self.index(to_acc) != src):
+                for i in range(len(buffers)):
+                    flush(i)
+                res = self._batch_transfer(acc, str(to_acc), move.get('amount'))
+                if res['ok']:
+                    applied += 1
+                else:
+                    rejected.append((idx, res['error']))
+                continue
+            buffers[src].append((idx, move))
+            if len(buffers[src]) >= chunk_size:
+                flush(src)
+
+        for i in range(len(buffers)):
+            flush(i)
+        rejected.sort()
+        return {'applied': applied, 'rejected': rejected}
+
+    # Standing orders run on one file (standing.py), their transfers would
+    # need the two-phase path here
+    @service_call
+    def add_standing_order(self, acc, to_acc, amt, every, start=None):
+        raise ValueError("Standing orders need an unsharded bank!")
+
+    @service_call
+    def standing_orders(self, acc):
+        return {'orders': []}
+
+    @service_call
+    def cancel_standing_order(self, acc, order_id):
+        raise ValueError("Standing order not found!")
@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+# Read-only copy of the bank for listings, exports and dashboards, so long
+# scans run on their own file instead of next to the money moves.
+#
+# A background thread copies the live file with SQLite's online backup API
+# every refresh_every seconds. The copy goes to a temp file in one backup
+# step: that's a single read transaction on the live db, which in WAL mode
+# never blocks writers (stepping it in small chunks would make SQLite start
+# over every time someone commits). The finished copy is renamed over the
+# old one, readers open it read-only and switch to the new file on their
+# next call.
+#
+# max_age is the staleness bound: a read that finds the copy older than
+# that refreshes it first. refresh() forces a new copy right away.
+#
+# Usage: python snapshot.py [--db FILE]   (one copy, e.g. before a report)
+
+MAX_AGE = 60.0          # seconds a report may be behind the live db
+REFRESH_EVERY = None    # background refresh period, None = half of max_age
+
+
+def snapshot_path(db_path):
+    stem, ext = os.path.splitext(db_path)
+    return f"{stem}.snapshot{ext or '.db'}"
+
+
+class SnapshotReplica:
+    def __init__(self, db_path, max_age=MAX_AGE, refresh_every=REFRESH_EVERY,
+                 path=None, connect=sqlite3.connect):
+        self.db_path = db_path
+        self.path = path or snapshot_path(db_path)
+        self.max_age = max_age
+        self.refresh_every = refresh_every or max_age / 2
+        self._connect = connect
+        self._lock = threading.Lock()   # one copy at a time
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._pool = []
+        self.taken = None       # time.time() of the current copy
+        self.gen = 0            # bumped by every copy, readers reopen on change
+        self.refreshes = 0
+        self.last_secs = None   # how long the last copy took
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # First copy now, then the background refresher
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name='snapshot', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_every):
+            try:
+                self.refresh()
+            except sqlite3.Error:
+                # Try again next round, readers refresh themselves if it
+                # gets too old
+                pass
+
+    def refresh(self):
+        with self._lock:
+            return self._copy()
+
+    def _copy(self):
+        start = time.perf_counter()
+        taken = time.time()
+        tmp = f"{self.path}.tmp"
+        src = self._connect(self.db_path)
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+            # The copy would still say WAL, read-only openers can't make
+            # the -shm file for that
+            dst.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            dst.close()
+            src.close()
+        os.replace(tmp, self.path)
+        self.taken = taken
+        self.gen += 1
+        self.refreshes += 1
+        self.last_secs = time.perf_counter() - start
+        return taken
+
+    def is_stale(self):
+        return self.taken is None or time.time() - self.taken > self.max_age
+
+    def age(self):
+        return None if self.taken is None else time.time() - self.taken
+
+    def conn(self):
+        # This thread's read-only connection to the current copy
+        if self.is_stale():
+            with self._lock:
+                # Another thread may have just made one
+                if self.is_stale():
+                    self._copy()
+
+        db, gen = getattr(self._local, 'db', None) or (None, None)
+        if db is not None and gen == self.gen:
+            return db
+        if db is not None:
+            self._drop(db)
+        gen = self.gen
+        db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True,
+                             check_same_thread=False)
+        self._local.db = (db, gen)
+        with self._pool_lock:
+            self._pool.append(db)
+        return db
+
+    def _drop(self, db):
+        with self._pool_lock:
+            if db in self._pool:
+                self._pool.remove(db)
+        db.close()
+
+    def release(self):
+        entry = getattr(self._local, 'db', None)
+        if entry is not None:
+            self._local.db = None
+            self._drop(entry[0])
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for db in pool:
+            db.close()
+        self._local = threading.local()
+
+    def stats(self):
+        age = self.age()
+        return {
+            'path': self.path,
+            'age_seconds': None if age is None else round(age, 3),
+            'max_age': self.max_age,
+            'refresh_every': self.refresh_every,
+            'refreshes': self.refreshes,
+            'last_copy_seconds': None if self.last_secs is None else round(self.last_secs, 3),
+        }
+
+
+def main():
+    # bank_service imports this file
+    from bank_service import DB_FILE
+
+    args = sys.argv[1:]
+    db_path = args[args.index('--db') + 1] if '--db' in args else DB_FILE
+    if not os.path.exists(db_path):
+        print(f"{db_path} doesn't exist")
+        sys.exit(1)
+    replica = SnapshotReplica(db_path)
+    replica.refresh()
+    print(f"Copied {db_path} to {replica.path} in {replica.last_secs:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
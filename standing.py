@@ -0,0 +1,296 @@
+import sys
+import time
+import heapq
+import calendar
+import datetime
+import threading
+
+# Standing orders: transfers that repeat every day, week or month. An order
+# row keeps its schedule (every + start, the first run) and next_run, the
+# next time it's due, all UTC text like CURRENT_TIMESTAMP.
+#
+# BankingService.run_standing_orders() executes everything that's due, up to
+# CHUNK orders per transaction through the same checks as apply_batch
+# (minimum balance, receiver exists). The transfers and the new next_run of
+# their orders commit together, so a due order runs exactly once even with
+# several schedulers on one file. A salary day with tens of thousands of
+# orders due at once is a handful of transactions.
+#
+# A failed order is tried again after each of RETRY_DELAYS, then it skips
+# to its next regular run (missed goes up, last_error says why). A
+# scheduler that was down runs each missed order once, not once per missed
+# period. Standing orders don't count against the velocity limits, same as
+# batch files.
+#
+# Scheduler is the in-process timer: a heap of the orders due within the
+# next HORIZON seconds, the thread sleeps until the first of them (or the
+# next reload) and wakes right away when this process adds an earlier one.
+# Orders added by other processes show up at the next reload. A run that
+# fails (db trouble, a bug) is printed to stderr and counted in stats() (and
+# in the metrics as a failed run_standing_orders), and the thread waits
+# FAIL_PAUSE seconds before it looks again instead of stopping.
+#
+# Usage: python standing.py [--db FILE] [--once]
+# Runs the scheduler in the foreground, --once just runs what's due now.
+
+EVERY = ('day', 'week', 'month')
+CHUNK = 2000
+RETRY_DELAYS = (60, 900, 3600)  # seconds after the 1st, 2nd, 3rd failure
+HORIZON = 60.0
+FAIL_PAUSE = 5.0
+FMT = '%Y-%m-%d %H:%M:%S'
+
+ORDER_COLS = ('id', 'acc_num', 'to_acc', 'amount', 'every', 'start', 'next_run',
+              'last_run', 'failures', 'missed', 'last_error', 'active')
+
+
+def setup(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS standing_orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            acc_num TEXT NOT NULL,
+            to_acc TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            every TEXT NOT NULL,
+            start DATETIME NOT NULL,
+            next_run DATETIME NOT NULL,
+            last_run DATETIME,
+            failures INTEGER NOT NULL DEFAULT 0,
+            missed INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            active INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY (acc_num) REFERENCES users(acc_num)
+        )
+    ''')
+    # The scheduler only ever looks for active orders by due time
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_standing_due
+        ON standing_orders (next_run) WHERE active = 1
+    ''')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_standing_acc ON standing_orders (acc_num)")
+
+
+def now():
+    return datetime.datetime.utcnow().strftime(FMT)
+
+
+def parse_start(text):
+    # 'YYYY-MM-DD' (midnight UTC) or 'YYYY-MM-DD HH:MM:SS'
+    text = str(text).strip()
+    for fmt in (FMT, '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(text, fmt).strftime(FMT)
+        except ValueError:
+            pass
+    raise ValueError("Start has to be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS!")
+
+
+def to_epoch(text):
+    return datetime.datetime.strptime(text, FMT).replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+def add_months(when, n):
+    # Same day of the month, or the last day of shorter months
+    year, month = divmod(when.month - 1 + n, 12)
+    year += when.year
+    day = min(when.day, calendar.monthrange(year, month + 1)[1])
+    return when.replace(year=year, month=month + 1, day=day)
+
+
+def next_due(every, start, after):
+    # First run of the schedule later than after (all text)
+    start = datetime.datetime.strptime(start, FMT)
+    after = datetime.datetime.strptime(after, FMT)
+    if start > after:
+        return start.strftime(FMT)
+    if every == 'month':
+        # Counted from start every time, so Jan 31 gives Feb 28 then Mar 31
+        n = (after.year - start.year) * 12 + after.month - start.month
+        due = add_months(start, n)
+        if due <= after:
+            due = add_months(start, n + 1)
+    else:
+        step = datetime.timedelta(days=1 if every == 'day' else 7)
+        due = start + ((after - start) // step + 1) * step
+    return due.strftime(FMT)
+
+
+def due_orders(cur, when, limit):
+    cur.execute('''
+        SELECT id, acc_num, to_acc, amount, every, start, failures
+        FROM standing_orders
+        WHERE active = 1 AND next_run <= ?
+        ORDER BY next_run, id
+        LIMIT ?
+    ''', (when, limit))
+    return cur.fetchall()
+
+
+def reschedule(cur, orders, rejected, when):
+    # New next_run for orders that just ran (rejected: position -> reason)
+    done, failed = [], []
+    for pos, (order_id, _, _, _, every, start, failures) in enumerate(orders):
+        regular = next_due(every, start, when)
+        if pos not in rejected:
+            done.append((regular, when, order_id))
+            continue
+        failures += 1
+        if failures <= len(RETRY_DELAYS):
+            retry = datetime.datetime.strptime(when, FMT) + datetime.timedelta(
+                seconds=RETRY_DELAYS[failures - 1])
+            failed.append((min(retry.strftime(FMT), regular), failures, 0,
+                           rejected[pos], order_id))
+        else:
+            failed.append((regular, 0, 1, rejected[pos], order_id))
+
+    cur.executemany('''
+        UPDATE standing_orders
+        SET next_run = ?, last_run = ?, failures = 0, last_error = NULL
+        WHERE id = ?
+    ''', done)
+    cur.executemany('''
+        UPDATE standing_orders
+        SET next_run = ?, failures = ?, missed = missed + ?, last_error = ?
+        WHERE id = ?
+    ''', failed)
+
+
+class Scheduler:
+    def __init__(self, bank, horizon=HORIZON):
+        self.bank = bank
+        self.horizon = horizon
+        self._heap = []         # (epoch seconds, order id), soonest first
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self.runs = 0
+        self.last = None        # result of the last run
+        self.failures = 0
+        self.last_error = None
+
+    def start(self):
+        self.load()
+        self._thread = threading.Thread(target=self._run, name='standing', daemon=True)
+        self._thread.start()
+
+    def load(self):
+        # Orders due before the next reload, fresh from the db
+        cur = self.bank.conn().cursor()
+        cur.execute('''
+            SELECT next_run, id FROM standing_orders
+            WHERE active = 1 AND next_run < ?
+        ''', (datetime.datetime.utcfromtimestamp(time.time() + self.horizon).strftime(FMT),))
+        heap = [(to_epoch(when), order_id) for when, order_id in cur.fetchall()]
+        heapq.heapify(heap)
+        with self._cond:
+            self._heap = heap
+            self._cond.notify()
+
+    def add(self, next_run, order_id):
+        due = to_epoch(next_run)
+        if due >= time.time() + self.horizon:
+            return
+        with self._cond:
+            heapq.heappush(self._heap, (due, order_id))
+            self._cond.notify()
+
+    def _run(self):
+        reload_at = time.time() + self.horizon
+        paused_until = 0
+        try:
+            while True:
+                with self._cond:
+                    while not self._stop:
+                        wake = min(self._heap[0][0], reload_at) if self._heap else reload_at
+                        wake = max(wake, paused_until)
+                        if wake <= time.time():
+                            break
+                        self._cond.wait(wake - time.time())
+                    if self._stop:
+                        return
+                    due = bool(self._heap) and self._heap[0][0] <= time.time()
+                if due and not self._run_due():
+                    paused_until = time.time() + FAIL_PAUSE
+                try:
+                    self.load()
+                except Exception:
+                    # Keep the old heap, try again at the next reload
+                    pass
+                reload_at = time.time() + self.horizon
+        finally:
+            self.bank.release()
+
+    def _run_due(self):
+        # The db decides what's due, the heap only says when to look.
+        # False if the run failed, nothing gets out of here.
+        start = time.perf_counter()
+        try:
+            self.last = self.bank.run_standing_orders()
+            self.runs += 1
+            if self.last['ok']:
+                return True
+            error = self.last['error']
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if self.bank.metrics:
+                self.bank.metrics.record_op('run_standing_orders',
+                                            time.perf_counter() - start, False)
+        self.failures += 1
+        self.last_error = error
+        print(f"{now()} standing orders: run failed, trying again in {FAIL_PAUSE:g}s: {error}",
+              file=sys.stderr)
+        return False
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._heap)
+            soonest = self._heap[0][0] if self._heap else None
+        return {
+            'pending': pending,
+            'next_in_seconds': None if soonest is None else round(max(soonest - time.time(), 0), 3),
+            'horizon': self.horizon,
+            'runs': self.runs,
+            'last': self.last,
+            'failures': self.failures,
+            'last_error': self.last_error,
+        }
+
+
+def main():
+    # bank_service imports this file
+    from bank_service import BankingService, DB_FILE
+
+    args = sys.argv[1:]
+    db_path = args[args.index('--db') + 1] if '--db' in args else DB_FILE
+    if '--once' in args:
+        bank = BankingService(db_path)
+        res = bank.run_standing_orders()
+        bank.close_all()
+        if not res['ok']:
+            print(f"Error: {res['error']}")
+            sys.exit(1)
+        print(f"Ran {res['applied']} standing orders, {res['failed']} failed")
+        return
+
+    bank = BankingService(db_path, scheduler=True)
+    print("Running standing orders, Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bank.close_all()
+
+
+if __name__ == "__main__":
+    main()
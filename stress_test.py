@@ -0,0 +1,102 @@
+import os
+import sys
+import random
+import tempfile
+import multiprocessing
+
+from bank_service import BankingService
+from money import MIN_BALANCE_CENTS, fmt_money
+
+# Hammers one db file from many processes and checks that no update got lost.
+# Usage: python stress_test.py [processes] [ops per process] [accounts]
+
+START_CASH = 1000000   # cents
+
+
+def seed(path, n_accs):
+    bank = BankingService(path)
+    db = bank.conn()
+    db.executemany('''
+        INSERT INTO users (name, acc_num, dob, city, pwd, cash_balance,
+                           phone, email)
+        VALUES ('Stress Test', ?, '2000-01-01', 'Nowhere', 'x', ?,
+                '0000000000', 'stress@test.com')
+    ''', [(f"{i:010d}", START_CASH) for i in range(n_accs)])
+    db.commit()
+    bank.close_all()
+
+
+def worker(path, n_ops, n_accs, seed_num):
+    rnd = random.Random(seed_num)
+    bank = BankingService(path)
+    done = 0
+    for _ in range(n_ops):
+        # Few accounts on purpose, so everybody fights over the same rows
+        acc = f"{rnd.randrange(n_accs):010d}"
+        amt = rnd.randint(1, 300000)
+        kind = rnd.random()
+        if kind < 0.3:
+            res = bank.credit(acc, amt)
+        elif kind < 0.6:
+            res = bank.debit(acc, amt)
+        else:
+            to_acc = f"{rnd.randrange(n_accs):010d}"
+            if to_acc == acc:
+                continue
+            res = bank.transfer(acc, to_acc, amt)
+        # Hitting the floor is allowed, anything else is not
+        if res['ok']:
+            done += 1
+        elif 'below' not in res['error']:
+            raise RuntimeError(res['error'])
+    bank.close_all()
+    return done
+
+
+def check(path, n_accs, done):
+    bank = BankingService(path)
+    cur = bank.conn().cursor()
+    cur.execute("SELECT COUNT(*) FROM money_moves")
+    moves = cur.fetchone()[0]
+
+    cur.execute('''
+        SELECT u.acc_num, u.cash_balance,
+            ? + COALESCE((SELECT SUM(CASE move_type WHEN 'CREDIT' THEN amount
+                                                   ELSE -amount END)
+                          FROM money_moves m WHERE m.acc_num = u.acc_num), 0)
+              + COALESCE((SELECT SUM(amount) FROM money_moves m
+                          WHERE m.to_acc = u.acc_num), 0)
+        FROM users u
+    ''', (START_CASH,))
+    bad = [(acc, have, want) for acc, have, want in cur.fetchall()
+           if have != want or have < MIN_BALANCE_CENTS]
+    bank.close_all()
+
+    print(f"ops committed: {done}, money_moves rows: {moves}")
+    for acc, have, want in bad:
+        print(f"  {acc}: balance {fmt_money(have)}, history says {fmt_money(want)}")
+    return moves == done and not bad
+
+
+def main():
+    procs = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    n_ops = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    n_accs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'banking_system.db')
+        seed(path, n_accs)
+
+        with multiprocessing.Pool(procs) as pool:
+            done = sum(pool.starmap(worker, [(path, n_ops, n_accs, i)
+                                            for i in range(procs)]))
+
+        if check(path, n_accs, done):
+            print("OK - no lost updates")
+        else:
+            print("FAILED - balances drifted from history")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import uuid
+import sqlite3
+import subprocess
+
+import pytest
+
+import audit
+from bank_service import BankingService
+
+# Login events that never made it into login_info before a crash, a close or
+# a failed commit come back from the journal on the next start, once each.
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'banking_system.db')
+
+
+def open_bank(db_path):
+    return BankingService(db_path, pwd_cost=1000)
+
+
+def new_account(bank):
+    res = bank.open_account("Test User", '1990-01-01', 'Nowhere', 'Secret#123',
+                            1000000, '0000000000', 'test@test.com')
+    assert res['ok'], res
+    return res['acc_num']
+
+
+def logins(db_path):
+    db = sqlite3.connect(db_path)
+    try:
+        return db.execute("SELECT event_id, acc_num FROM login_info ORDER BY id").fetchall()
+    finally:
+        db.close()
+
+
+def journals(db_path):
+    return [name for name in os.listdir(os.path.dirname(db_path)) if '-audit-' in name]
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def test_journal_of_dead_process_is_replayed_once(db_path):
+    bank = open_bank(db_path)
+    acc = new_account(bank)
+    bank.close_all()
+
+    # What a process killed mid-batch leaves behind, torn last line and all
+    events = [{'id': uuid.uuid4().hex, 'kind': 'login', 'acc': acc, 'at': audit.now()}
+              for _ in range(5)]
+    lines = ''.join(json.dumps(e) + '\n' for e in events) + '{"id": "torn'
+    for n in range(2):
+        # The same events twice, as if the first replay died too
+        with open(f"{db_path}-audit-{dead_pid()}-{n}.jsonl", 'w', encoding='utf-8') as f:
+            f.write(lines)
+
+    bank = open_bank(db_path)
+    bank.close_all()
+    assert sorted(logins(db_path)) == sorted((e['id'], acc) for e in events)
+    assert journals(db_path) == []
+
+
+def test_failed_batch_is_kept_for_the_next_start(db_path, monkeypatch):
+    bank = open_bank(db_path)
+    acc = new_account(bank)
+
+    def broken(cur, events):
+        raise sqlite3.OperationalError("database is locked")
+
+    # Every commit fails until the writer is closed
+    monkeypatch.setattr(audit, 'write_events', broken)
+    monkeypatch.setattr(audit, 'RETRY_DELAY', 0.01)
+    monkeypatch.setattr(audit, 'COMMIT_RETRIES', 1)
+    for _ in range(10):
+        assert bank.login(acc, 'Secret#123')['ok']
+    assert not bank.audit.flush(0.5)
+    assert bank.audit.stats()['errors'] > 0
+    bank.close_all()
+    monkeypatch.undo()
+
+    assert logins(db_path) == []
+    assert len(journals(db_path)) == 1
+    bank = open_bank(db_path)
+    bank.close_all()
+    rows = logins(db_path)
+    assert len(rows) == 10 and len(set(rows)) == 10
+    assert journals(db_path) == []
+
+
+def test_retried_batch_is_committed_once(db_path, monkeypatch):
+    bank = open_bank(db_path)
+    acc = new_account(bank)
+    real = audit.write_events
+    fails = [3]
+
+    def flaky(cur, events):
+        if fails[0]:
+            fails[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        real(cur, events)
+
+    monkeypatch.setattr(audit, 'write_events', flaky)
+    monkeypatch.setattr(audit, 'RETRY_DELAY', 0.01)
+    monkeypatch.setattr(audit, 'COMMIT_RETRIES', 1)
+    for _ in range(20):
+        bank.audit.login(acc)
+    assert bank.audit.flush(5)
+    stats = bank.audit.stats()
+    assert stats['pending'] == 0 and stats['journal_bytes'] == 0
+    bank.close_all()
+
+    rows = logins(db_path)
+    assert len(rows) == 20 and len(set(rows)) == 20
+    assert journals(db_path) == []
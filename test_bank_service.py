@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from bank_service import BankingService
+from money import MIN_BALANCE_CENTS
+import stress_test
+
+# Small versions of stress_test.py: threads instead of processes, a handful
+# of accounts, and the same check that every committed move is in the
+# balances exactly once.
+# Run with: python -m pytest -q
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'banking_system.db')
+
+
+def run_threads(target, args_list):
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_guarded_debit_never_goes_below_the_floor(db_path):
+    # 20 debits of 1.00 race for 10.00 above the floor: exactly 10 get in
+    stress_test.seed(db_path, 1)
+    acc = f"{0:010d}"
+    bank = BankingService(db_path, pwd_cost=1000)
+    bank.run_write(lambda cur: cur.execute(
+        "UPDATE users SET cash_balance = ? WHERE acc_num = ?", (MIN_BALANCE_CENTS + 1000, acc)))
+    results = []
+
+    def debit():
+        results.append(bank.debit(acc, 100))
+        bank.release()
+
+    run_threads(debit, [()] * 20)
+    ok = [res for res in results if res['ok']]
+    assert len(ok) == 10
+    assert all('below' in res['error'] for res in results if not res['ok'])
+
+    cur = bank.conn().cursor()
+    cur.execute("SELECT cash_balance FROM users WHERE acc_num = ?", (acc,))
+    assert cur.fetchone()[0] == MIN_BALANCE_CENTS
+    cur.execute("SELECT COUNT(*) FROM money_moves WHERE move_type = 'DEBIT'")
+    assert cur.fetchone()[0] == 10
+    # Balances the callers saw are all different, nobody read a stale one
+    assert len({res['balance'] for res in ok}) == 10
+    bank.close_all()
+
+
+def test_mixed_moves_from_threads_lose_nothing(db_path):
+    stress_test.seed(db_path, 3)
+    done = []
+    run_threads(lambda i: done.append(stress_test.worker(db_path, 60, 3, i)),
+                [(i,) for i in range(4)])
+    assert stress_test.check(db_path, 3, sum(done))
+
+
+def test_export_to_a_bad_path_is_an_error(db_path, tmp_path):
+    stress_test.seed(db_path, 2)
+    bank = BankingService(db_path, pwd_cost=1000)
+    res = bank.export_users(str(tmp_path / 'missing' / 'users.csv'))
+    assert not res['ok'] and "Can't write" in res['error']
+    res = bank.export_users(str(tmp_path / 'users.jsonl'), 'jsonl')
+    assert res['ok'] and res['rows'] == 2
+    bank.close_all()
@@ -0,0 +1,198 @@
+import time
+import uuid
+import sqlite3
+import threading
+
+import pytest
+
+import shards
+import reconcile
+from shards import ShardedBank
+
+# Two-phase transfers between shards, and what recover() makes of the ones a
+# crash left half done. Every test ends with the same checks: no money made
+# or lost over all shards, and every shard's balances match its own ledger.
+
+N_SHARDS = 2
+START_CASH = 1000000    # cents
+
+
+def open_accounts(bank, n):
+    accs = []
+    for _ in range(n):
+        res = bank.open_account("Test User", '1990-01-01', 'Nowhere', 'Secret#123',
+                                START_CASH, '0000000000', 'test@test.com')
+        assert res['ok'], res
+        accs.append(res['acc_num'])
+    return accs
+
+
+def pair(bank, accs):
+    # One account on each of two different shards
+    for a in accs:
+        for b in accs:
+            if bank.index(a) != bank.index(b):
+                return a, b
+    raise AssertionError("all accounts ended up on one shard")
+
+
+def total(bank):
+    return sum(shard.conn().execute("SELECT SUM(cash_balance) FROM users").fetchone()[0] or 0
+               for shard in bank.shards)
+
+
+def check_ledgers(bank):
+    # Each shard's balances against its own money_moves, incoming transfers
+    # from other shards through the receiver's copy of the row
+    for shard in bank.shards:
+        cur = shard.conn().cursor()
+        cur.execute("SELECT acc_num, cash_balance FROM users")
+        for acc, balance in cur.fetchall():
+            cur.execute('''
+                SELECT COALESCE(SUM(CASE move_type WHEN 'CREDIT' THEN amount ELSE -amount END), 0)
+                FROM money_moves WHERE acc_num = ?
+            ''', (acc,))
+            net = cur.fetchone()[0]
+            cur.execute("SELECT COALESCE(SUM(amount), 0) FROM money_moves WHERE to_acc = ?", (acc,))
+            assert balance == net + cur.fetchone()[0], acc
+
+
+def open_xfers(bank):
+    return sum(shard.conn().execute('''
+        SELECT (SELECT COUNT(*) FROM xfer_out WHERE state = 'committed')
+             + (SELECT COUNT(*) FROM xfer_in WHERE state = 'prepared')
+    ''').fetchone()[0] for shard in bank.shards)
+
+
+@pytest.fixture
+def bank(tmp_path):
+    bank = ShardedBank(str(tmp_path / 'banking_system.db'), N_SHARDS, pwd_cost=1000)
+    yield bank
+    bank.close_all()
+
+
+def reopen(bank):
+    # What the next start after a crash sees
+    bank.close_all()
+    return ShardedBank(bank.db_path, N_SHARDS, pwd_cost=1000)
+
+
+def test_crash_after_decide_is_finished_by_recover(bank, monkeypatch):
+    src, dst = pair(bank, open_accounts(bank, 6))
+    before = total(bank)
+
+    def crash(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    # The money leaves the sender, then the process "dies" before apply
+    monkeypatch.setattr(ShardedBank, 'finish', crash)
+    assert bank.transfer(src, dst, 2500)['ok']
+    monkeypatch.undo()
+    assert total(bank) == before - 2500
+    assert open_xfers(bank) == 2
+
+    bank = reopen(bank)
+    try:
+        assert total(bank) == before
+        assert bank.balance(dst)['balance'] == START_CASH + 2500
+        assert open_xfers(bank) == 0
+        check_ledgers(bank)
+        # Running it again doesn't pay twice
+        assert bank.recover() == {'finished': 0, 'aborted': 0}
+        assert total(bank) == before
+    finally:
+        bank.close_all()
+
+
+def test_prepared_without_decision_is_aborted(bank):
+    src, dst = pair(bank, open_accounts(bank, 6))
+    before = total(bank)
+    xid = uuid.uuid4().hex
+    receiver = bank.shard(dst)
+
+    # Only the prepare made it, long enough ago to be given up on
+    receiver.run_write(lambda cur: cur.execute('''
+        INSERT INTO xfer_in (xid, from_acc, to_acc, amount, state, when_moved, created)
+        VALUES (?, ?, ?, 2500, 'prepared', ?, ?)
+    ''', (xid, src, dst, shards.now(), time.time() - shards.RECOVER_AFTER - 1)))
+
+    assert bank.recover() == {'finished': 0, 'aborted': 1}
+    assert total(bank) == before
+    assert open_xfers(bank) == 0
+    state = receiver.conn().execute("SELECT state FROM xfer_in WHERE xid = ?", (xid,)).fetchone()
+    assert state == ('aborted',)
+
+    # A sender that shows up late can't commit under the same id
+    with pytest.raises(sqlite3.IntegrityError):
+        bank.shard(src).run_write(lambda cur: cur.execute('''
+            INSERT INTO xfer_out (xid, from_acc, to_acc, amount, state, when_moved, created)
+            VALUES (?, ?, ?, 2500, 'committed', ?, ?)
+        ''', (xid, src, dst, shards.now(), time.time())))
+    check_ledgers(bank)
+
+
+def test_parallel_cross_shard_transfers_lose_nothing(bank):
+    accs = open_accounts(bank, 6)
+    before = total(bank)
+    errors = []
+
+    def worker(i):
+        for j in range(30):
+            acc = accs[(i + j) % len(accs)]
+            to_acc = accs[(i + 2 * j + 1) % len(accs)]
+            if acc == to_acc:
+                continue
+            res = bank.transfer(acc, to_acc, 100 + j)
+            if not res['ok'] and 'below' not in res['error']:
+                errors.append(res['error'])
+        bank.release()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert total(bank) == before
+    assert open_xfers(bank) == 0
+    check_ledgers(bank)
+
+
+@pytest.mark.parametrize('order_by', ['id', 'acc_num', 'cash_balance'])
+def test_iter_users_merges_like_list_users(bank, order_by):
+    open_accounts(bank, 8)
+    for desc in (False, True):
+        streamed = [u['acc_num'] for u in bank.iter_users(order_by=order_by, desc=desc,
+                                                          batch_size=3)]
+        paged, after = [], None
+        while True:
+            res = bank.list_users(order_by=order_by, desc=desc, page_size=3, after=after)
+            paged += [u['acc_num'] for u in res['users']]
+            after = res['next']
+            if not after:
+                break
+        assert len(streamed) == 8 and streamed == paged
+
+
+def test_reconcile_matches_cross_shard_copies(bank):
+    accs = open_accounts(bank, 6)
+    src, dst = pair(bank, accs)
+    for _ in range(3):
+        assert bank.transfer(src, dst, 700)['ok']
+        assert bank.transfer(dst, src, 300)['ok']
+
+    res = reconcile.reconcile(bank)
+    assert res['mismatch_count'] == 0
+    assert res['orphan_moves'] == 0
+    assert res['cross_shard_moves'] == 12
+
+    # A copy without an xfer row behind it is still an orphan
+    bank.shard(dst).run_write(lambda cur: cur.execute('''
+        INSERT INTO money_moves (acc_num, move_type, amount, to_acc, when_moved)
+        SELECT acc_num, move_type, amount, to_acc, when_moved FROM money_moves
+        WHERE acc_num = ? AND to_acc = ? LIMIT 1
+    ''', (src, dst)))
+    res = reconcile.reconcile(bank)
+    assert res['orphan_moves'] == 1
+    assert res['cross_shard_moves'] == 12
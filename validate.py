@@ -0,0 +1,154 @@
+import re
+import datetime
+
+# Field rules shared by the sign up form, imports and the quiz app, with the
+# patterns compiled once. Every rule gives an error code instead of
+# raising, MESSAGES turns codes into the text the menus show.
+#
+# One value:     check('phone', num) raises ValueError like the old check_*
+# Whole columns: check_columns({'name': [...], 'phone': [...]}) goes over one
+#                column at a time and returns [(row, [codes]), ...] for the
+#                rows that failed, so a batch reports every bad row and
+#                every bad field in one go.
+#
+# Passwords take one match with a lookahead per rule instead of a
+# re.search per rule, the separate rules only run to name what's missing.
+#
+# BANK is what bank_service uses, QUIZ the (stricter) rules of with_file.py.
+
+MESSAGES = {
+    'name': "Bad name! Letters only, 2-50 chars",
+    'dob': "Birthday should be a YYYY-MM-DD date!",
+    'city': "Need a city!",
+    'phone': "Phone number should be 10 digits!",
+    'email': "That's not a valid email!",
+    'pwd_short': "Password too short! Need 8+ chars",
+    'pwd_upper': "Need an uppercase letter!",
+    'pwd_lower': "Need a lowercase letter!",
+    'pwd_digit': "Need a number!",
+    'pwd_special': "Need a special character!",
+    'pwd': "Password doesn't meet the rules!",
+}
+
+
+class Pattern:
+    # Whole value has to match regex
+    def __init__(self, code, regex):
+        self.code = code
+        self.match = re.compile(regex).fullmatch
+
+    def one(self, value):
+        return None if self.match(value) else self.code
+
+    def column(self, values):
+        match, code = self.match, self.code
+        return [(i, code) for i, m in enumerate(map(match, values)) if m is None]
+
+
+class Date:
+    # YYYY-MM-DD that's a real day. date.fromisoformat is a lot cheaper
+    # than strptime, the pattern keeps it to exactly that shape.
+    def __init__(self, code):
+        self.code = code
+        self.shape = re.compile(r'\d{4}-\d{2}-\d{2}').fullmatch
+
+    def one(self, value):
+        if not self.shape(value):
+            return self.code
+        try:
+            datetime.date.fromisoformat(value)
+        except ValueError:
+            return self.code
+        return None
+
+    def column(self, values):
+        # Birthdays repeat a lot in a big file, each distinct one is parsed once
+        bad = {value for value in set(values) if self.one(value)}
+        if not bad:
+            return []
+        code = self.code
+        return [(i, code) for i, value in enumerate(values) if value in bad]
+
+
+class NotEmpty:
+    def __init__(self, code):
+        self.code = code
+
+    def one(self, value):
+        return None if value else self.code
+
+    def column(self, values):
+        code = self.code
+        return [(i, code) for i, v in enumerate(values) if not v]
+
+
+class Password:
+    # One compiled pattern with a lookahead per rule passes good passwords
+    # in a single match. Only the ones that fail get the rules one by one
+    # (length first, then the order the menu has always asked in) to find
+    # the code.
+    def __init__(self, min_len=8, special='!@#$%^&*(),.?":{}|<>'):
+        special = re.escape(special)
+        self.min_len = min_len
+        self.ok = re.compile(
+            rf'(?=[^A-Z]*[A-Z])(?=[^a-z]*[a-z])(?=[^0-9]*[0-9])(?=.*[{special}]).{{{min_len},}}',
+            re.S).fullmatch
+        self.rules = [(re.compile(regex).search, code) for regex, code in (
+            ('[A-Z]', 'pwd_upper'), ('[a-z]', 'pwd_lower'), ('[0-9]', 'pwd_digit'),
+            (f'[{special}]', 'pwd_special'))]
+
+    def one(self, value):
+        if self.ok(value):
+            return None
+        if len(value) < self.min_len:
+            return 'pwd_short'
+        for search, code in self.rules:
+            if not search(value):
+                return code
+        return None
+
+    def column(self, values):
+        one = self.one
+        return [(i, one(values[i])) for i, m in enumerate(map(self.ok, values)) if m is None]
+
+
+BANK = {
+    'name': Pattern('name', r'[A-Za-z ]{2,50}'),
+    'dob': Date('dob'),
+    'city': NotEmpty('city'),
+    'pwd': Password(),
+    'phone': Pattern('phone', r'[0-9]{10}'),
+    'email': Pattern('email', r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'),
+}
+
+QUIZ = {
+    'name': Pattern('name', r'[^\W\d_]+'),
+    'phone': Pattern('phone', r'[6-9][0-9]{9}'),
+    'email': Pattern('email', r'[\w.-]+@gmail\.com'),
+    'pwd': Pattern('pwd', r'(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}'),
+}
+
+
+def error(field, value, rules=BANK):
+    # Error code for one value, None if it's fine
+    return rules[field].one(value)
+
+
+def check(field, value, rules=BANK):
+    code = rules[field].one(value)
+    if code:
+        raise ValueError(MESSAGES[code])
+    return True
+
+
+def check_columns(columns, rules=BANK):
+    # columns: field -> list of values, all the same length. Fields without
+    # a rule aren't checked. Returns [(row, [codes in field order]), ...].
+    bad = {}
+    for field, values in columns.items():
+        rule = rules.get(field)
+        if rule is None:
+            continue
+        for i, code in rule.column(values):
+            bad.setdefault(i, []).append(code)
+    return sorted(bad.items())
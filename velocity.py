@@ -0,0 +1,218 @@
+import os
+import time
+import datetime
+import threading
+from collections import deque, OrderedDict
+
+from money import fmt_money, to_cents
+
+# Per-account velocity limits on money going out (debits and transfers),
+# e.g. at most 20 of them or $10,000 per rolling hour. Kept in memory so the
+# check costs no query: every account has one sliding window per limit,
+# made of BUCKETS time buckets with running totals, so adding and expiring
+# are O(1) amortized and an account never holds more than BUCKETS buckets
+# per limit. The window edge moves a bucket at a time, limits are exact to
+# within 1/BUCKETS of their window.
+#
+# reserve() checks and counts the move in one go (before the service opens
+# its write transaction), cancel() takes it back out if the write fails,
+# so two sessions can't both squeeze through the last slot.
+#
+# Accounts that had nothing inside the longest window are dropped, and past
+# max_accounts the least recently used goes first. On start the windows are
+# rebuilt from the newest money_moves (see rebuild()).
+#
+# Only a customer's own debits and transfers count. Batch files, standing
+# orders and interest/fee postings don't go through the limits, and
+# rebuild() skips them too (money_moves.via is set on those).
+#
+# The windows live in this process. Every process that runs a
+# BankingService (menu, net_server, scripts) counts on its own, so N of them
+# on one file let an account move up to N times the limits between them.
+# Put customer traffic through one server process if the limits have to hold
+# across all of it.
+
+# name -> (window seconds, max moves, max cents), None means no cap
+LIMITS = {
+    'hour': (3600, 20, 1000000),
+    'day': (86400, 100, 2500000),
+}
+# Windows BANK_LIMITS can name
+WINDOWS = {'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800}
+BUCKETS = 60
+MAX_ACCOUNTS = 100000
+LOAD_CHUNK = 10000
+
+
+class Window:
+    __slots__ = ('buckets', 'count', 'total')
+
+    def __init__(self):
+        self.buckets = deque()      # [bucket index, moves, cents], oldest first
+        self.count = 0
+        self.total = 0
+
+    def expire(self, oldest):
+        while self.buckets and self.buckets[0][0] < oldest:
+            _, count, total = self.buckets.popleft()
+            self.count -= count
+            self.total -= total
+
+    def add(self, idx, amt):
+        # Older than the newest bucket (rebuild, clock steps) goes in the newest
+        if self.buckets and self.buckets[-1][0] >= idx:
+            bucket = self.buckets[-1]
+            bucket[1] += 1
+            bucket[2] += amt
+        else:
+            self.buckets.append([idx, 1, amt])
+        self.count += 1
+        self.total += amt
+
+    def remove(self, idx, amt):
+        # Nothing to do if the bucket is gone already
+        for bucket in reversed(self.buckets):
+            if bucket[0] <= idx:
+                bucket[1] -= 1
+                bucket[2] -= amt
+                self.count -= 1
+                self.total -= amt
+                return
+
+
+def from_env(environ=os.environ):
+    # Limits from BANK_LIMITS, None (no limits) when it isn't set.
+    #   BANK_LIMITS="hour=20:10000,day=100:25000"
+    # is at most 20 moves or $10,000 out per hour and 100 or $25,000 per
+    # day. Leave a side empty for no cap on it ("day=:5000").
+    text = environ.get('BANK_LIMITS', '').strip()
+    if not text:
+        return None
+    limits = {}
+    for part in text.split(','):
+        try:
+            name, caps = part.split('=')
+            moves, total = caps.split(':')
+            name = name.strip()
+            limits[name] = (WINDOWS[name], int(moves) if moves.strip() else None,
+                            to_cents(total) if total.strip() else None)
+        except (KeyError, ValueError):
+            raise ValueError(f"BANK_LIMITS: can't read {part.strip()!r}, "
+                             f"want window=moves:dollars with window one of {', '.join(WINDOWS)}")
+    return limits
+
+
+def parse_when(when):
+    # when_moved text (UTC) -> epoch seconds
+    return datetime.datetime.strptime(when[:19], '%Y-%m-%d %H:%M:%S').replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+def format_when(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class VelocityLimits:
+    def __init__(self, limits=LIMITS, max_accounts=MAX_ACCOUNTS, buckets=BUCKETS):
+        # (name, seconds, max moves, max cents, bucket length)
+        self.limits = [(name, secs, moves, total, secs / buckets)
+                       for name, (secs, moves, total) in limits.items()]
+        self.longest = max(secs for _, secs, _, _, _ in self.limits)
+        self.n_buckets = buckets
+        self.max_accounts = max_accounts
+        self._accs = OrderedDict()      # acc -> [last move time, Window per limit]
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.evicted = 0
+
+    def _entry(self, acc, now):
+        entry = self._accs.get(acc)
+        if entry is None:
+            entry = self._accs[acc] = [now] + [Window() for _ in self.limits]
+        else:
+            entry[0] = max(entry[0], now)
+            self._accs.move_to_end(acc)
+
+        # Least recently used is in front, idle ones have nothing to count
+        idle = now - self.longest
+        while self._accs:
+            front = next(iter(self._accs.values()))
+            if front is entry or (front[0] >= idle and len(self._accs) <= self.max_accounts):
+                break
+            self._accs.popitem(last=False)
+            if front[0] >= idle:
+                self.evicted += 1
+        return entry
+
+    def reserve(self, acc, amt, now=None):
+        # Counts the move or raises ValueError if it would break a limit.
+        # Hand the returned time to cancel() if the move doesn't happen.
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entry(acc, now)
+            for (name, _, max_moves, max_total, step), win in zip(self.limits, entry[1:]):
+                win.expire(int(now // step) - self.n_buckets + 1)
+                if max_moves is not None and win.count + 1 > max_moves:
+                    self.rejected += 1
+                    raise ValueError(f"Limit reached: at most {max_moves} debits/transfers per {name}!")
+                if max_total is not None and win.total + amt > max_total:
+                    self.rejected += 1
+                    raise ValueError(f"Limit reached: at most ${fmt_money(max_total)} out per {name}!")
+            for (_, _, _, _, step), win in zip(self.limits, entry[1:]):
+                win.add(int(now // step), amt)
+        return now
+
+    def cancel(self, acc, amt, when):
+        with self._lock:
+            entry = self._accs.get(acc)
+            if entry is None:
+                return
+            for (_, _, _, _, step), win in zip(self.limits, entry[1:]):
+                win.remove(int(when // step), amt)
+
+    def load(self, moves):
+        # (acc_num, cents, epoch seconds), oldest first, counted without checks
+        with self._lock:
+            for acc, amt, when in moves:
+                entry = self._entry(acc, when)
+                for (_, _, _, _, step), win in zip(self.limits, entry[1:]):
+                    win.add(int(when // step), amt)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'accounts': len(self._accs),
+                'max_accounts': self.max_accounts,
+                'rejected': self.rejected,
+                'evicted': self.evicted,
+                'limits': {name: {'seconds': secs, 'max_moves': moves, 'max_total': total}
+                           for name, secs, moves, total, _ in self.limits},
+            }
+
+
+def rebuild(cur, limits, now=None):
+    # Walks money_moves newest first by id (ids follow when_moved for
+    # everything the service writes, so no when_moved index is needed) and
+    # stops at the first move older than the longest window
+    now = time.time() if now is None else now
+    cutoff = format_when(now - limits.longest)
+    cur.execute('''
+        SELECT acc_num, amount, when_moved FROM money_moves
+        WHERE move_type IN ('DEBIT', 'TRANSFER') AND via IS NULL
+        ORDER BY id DESC
+    ''')
+    moves = []
+    while True:
+        rows = cur.fetchmany(LOAD_CHUNK)
+        done = not rows
+        for acc, amt, when in rows:
+            if when < cutoff:
+                done = True
+                break
+            moves.append((acc, amt, parse_when(when)))
+        if done:
+            break
+    cur.close()
+    moves.reverse()
+    limits.load(moves)
+    return len(moves)
@@ -1,9 +1,70 @@
 import sqlite3
+import threading
+
+from quiz_bundle import open_bundle, parse_options
 
 DB_FILE = "quiz_app.db"
 
+# One connection per thread, opened on first use and kept for the life of
+# the process (close_db() at exit)
+_local = threading.local()
+
+# Quiz catalog cache: ((catalog id, version), [(id, name)], {quiz_id: questions}).
+# Question sets are loaded the first time their quiz is taken. Triggers
+# bump catalog_version on every change to quizzes/quiz_questions (see
+# db_init.py), a moved version drops the whole cache. invalidate_quizzes()
+# drops it right away. A db from before catalog_version isn't cached at
+# all, every quiz reads the db like it used to (db_init.py adds the table).
+_catalog = None
+_catalog_lock = threading.Lock()
+
+# Compiled quizzes (quiz_bundle.py), used while they were built from this db
+# (catalog_id) at its current version. Without one, or once the db moved
+# on, questions come from the db.
+_bundle = open_bundle()
+
 def db_connect():
-    return sqlite3.connect(DB_FILE)
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=5.0)
+        # Readers don't wait on score inserts from other sessions
+        conn.execute("PRAGMA journal_mode=WAL")
+        _local.conn = conn
+    return conn
+
+def close_db():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
+def invalidate_quizzes():
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+
+def current_catalog():
+    # The cached catalog, reloaded if the version in the db moved
+    global _catalog
+    cursor = db_connect().cursor()
+    try:
+        cursor.execute("SELECT catalog_id, version FROM catalog_version WHERE id = 1")
+        stamp = tuple(cursor.fetchone())
+    except (sqlite3.OperationalError, TypeError):
+        # No catalog_version (yet), nothing can be trusted for long
+        stamp = None
+    with _catalog_lock:
+        if _catalog is not None and stamp is not None and _catalog[0] == stamp:
+            return _catalog
+    if _bundle is not None and stamp is not None and _bundle.matches(stamp):
+        catalog = (stamp, _bundle.quizzes(), {})
+    else:
+        cursor.execute("SELECT id, name FROM quizzes")
+        catalog = (stamp, cursor.fetchall(), {})
+    if stamp is not None:
+        with _catalog_lock:
+            _catalog = catalog
+    return catalog
 
 # User Management
 def register():
@@ -36,10 +97,26 @@ def login():
 
 # Quiz Management
 def quiz_option():
-    with db_connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM quizzes")
-        return cursor.fetchall()
+    return current_catalog()[1]
+
+def quiz_questions(quiz_id):
+    # [(question, [options], answer index)] from the cache, loaded on first use
+    stamp, _, questions = current_catalog()
+    with _catalog_lock:
+        if quiz_id in questions:
+            return questions[quiz_id]
+    if _bundle is not None and stamp is not None and _bundle.matches(stamp):
+        rows = _bundle.questions(quiz_id)
+    else:
+        cursor = db_connect().cursor()
+        cursor.execute("SELECT question, options, answer FROM quiz_questions WHERE quiz_id = ?", (quiz_id,))
+        rows = []
+        for question, options, answer in cursor.fetchall():
+            options = parse_options(options)
+            rows.append((question, options, options.index(answer) if answer in options else None))
+    with _catalog_lock:
+        questions[quiz_id] = rows
+    return rows
 
 def quiz(user_id):
     quizzes = quiz_option()
@@ -55,33 +132,31 @@ def quiz(user_id):
         print("Invalid choice.")
         return
 
+    questions = quiz_questions(quiz_id)
+    if not questions:
+        print("No questions available for this quiz.")
+        return
+
+    score = 0
+    for question, options, answer in questions:
+        print(f"\n{question}")
+        for idx, opt in enumerate(options, start=1):
+            print(f"{idx}. {opt}")
+
+        user_answer = input("Your answer: ").strip()
+        try:
+            pick = int(user_answer) - 1
+            if not 0 <= pick < len(options):
+                raise IndexError(pick)
+            if pick == answer:
+                score += 1
+        except (IndexError, ValueError):
+            print("Invalid answer.")
+    print("\n\n")
+    print(f"You scored {score}/{len(questions)}!")
+    print("\n\n")
     with db_connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT question, options, answer FROM quiz_questions WHERE quiz_id = ?", (quiz_id,))
-        questions = cursor.fetchall()
-
-        if not questions:
-            print("No questions available for this quiz.")
-            return
-
-        score = 0
-        for question, options, answer in questions:
-            print(f"\n{question}")
-            options = options.split(",")  # Assuming options stored as "A,B,C,D"
-            for idx, opt in enumerate(options, start=1):
-                print(f"{idx}. {opt}")
-
-            user_answer = input("Your answer: ").strip()
-            try:
-                if options[int(user_answer) - 1] == answer:
-                    score += 1
-            except (IndexError, ValueError):
-                print("Invalid answer.")
-        print("\n\n")
-        print(f"You scored {score}/{len(questions)}!")
-        print("\n\n")
-        cursor.execute("INSERT INTO user_scores (user_id, quiz_id, score) VALUES (?, ?, ?)", (user_id, quiz_id, score))
-        conn.commit()
+        conn.execute("INSERT INTO user_scores (user_id, quiz_id, score) VALUES (?, ?, ?)", (user_id, quiz_id, score))
 
 # Main Menu
 def main():
@@ -101,6 +176,7 @@ def main():
                 print("Please log in first!")
         elif choice == '4':
             print("Goodbye!")
+            close_db()
             break
         else:
             print("Invalid option. Try again.")
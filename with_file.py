@@ -1,6 +1,9 @@
 import re
 from colorama import Fore, Style
 
+import quiz_bundle
+import validate
+
 filename = "registration_info.txt"
 result_file = "result.txt"
 
@@ -41,7 +44,7 @@ def print_divider(t):
 def val_phone():
     while True:
         phone = input(Fore.YELLOW + "Enter your phone number (10 digits only): " + Style.RESET_ALL)
-        if phone.isdigit() and len(phone) == 10 and phone[0] in "6789":
+        if not validate.error('phone', phone, validate.QUIZ):
             return phone
         print(Fore.RED + "Invalid phone number." + Style.RESET_ALL)
 
@@ -49,7 +52,7 @@ def val_phone():
 def val_name():
     while True:
         name = input(Fore.YELLOW + "Enter your name (alphabets only): " + Style.RESET_ALL)
-        if name.isalpha():
+        if not validate.error('name', name, validate.QUIZ):
             return name
         print(Fore.RED + "Invalid name. Please enter alphabets only." + Style.RESET_ALL)
 
@@ -57,7 +60,7 @@ def val_name():
 def val_email():
     while True:
         email = input(Fore.YELLOW + "Enter your email (e.g., xyz@gmail.com): " + Style.RESET_ALL)
-        if re.match(r'^[\w\.-]+@gmail\.com$', email):
+        if not validate.error('email', email, validate.QUIZ):
             return email
         print(Fore.RED + "Invalid email format. Please enter a valid email." + Style.RESET_ALL)
 
@@ -65,7 +68,7 @@ def val_email():
 def val_pass():
     while True:
         password = input(Fore.YELLOW + "Enter your password (at least 8 characters, 1 uppercase letter, 1 number, and 1 special character): " + Style.RESET_ALL)
-        if re.match(r'^(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$', password):
+        if not validate.error('pwd', password, validate.QUIZ):
             return password
         print(Fore.RED + "Password does not meet the criteria." + Style.RESET_ALL)
 
@@ -108,55 +111,71 @@ def login():
             break
 
 
+QUESTIONS = {
+    "python": [
+        {"question": "What is the output of 2 + 2?", "options": ["4", "5", "6", "3"], "answer": "4"},
+        {"question": "Which of the following is a mutable data type?", "options": ["List", "Tuple", "Set", "String"], "answer": "List"},
+        {"question": "What is the correct syntax for a function in Python?", "options": ["def function_name():", "function function_name():", "function():", "def: function_name"], "answer": "def function_name():"},
+        {"question": "Which of the following is a Python keyword?", "options": ["if", "yes", "none", "foreach"], "answer": "if"},
+        {"question": "What is the default return value of a function in Python?", "options": ["None", "0", "1", "null"], "answer": "None"}
+    ],
+    "dbms": [
+        {"question": "What does DBMS stand for?", "options": ["Database Management System", "Data Base Management System", "Database Managed System", "Data Base Managed System"], "answer": "Database Management System"},
+        {"question": "Which is not a DBMS model?", "options": ["Network Model", "Hierarchical Model", "Relational Model", "Tree Model"], "answer": "Tree Model"},
+        {"question": "What is normalization?", "options": ["Process of reducing redundancy", "Process of creating tables", "Process of defining relations", "Process of deleting records"], "answer": "Process of reducing redundancy"},
+        {"question": "Which of the following is a relational database?", "options": ["MySQL", "MongoDB", "PostgreSQL", "Both MySQL and PostgreSQL"], "answer": "Both MySQL and PostgreSQL"},
+        {"question": "Which SQL command is used to retrieve data from a database?", "options": ["SELECT", "INSERT", "UPDATE", "DELETE"], "answer": "SELECT"}
+    ],
+    "dsa": [
+        {"question": "What is the time complexity of binary search?", "options": ["O(n)", "O(log n)", "O(n^2)", "O(1)"], "answer": "O(log n)"},
+        {"question": "Which data structure is used to implement a breadth-first search?", "options": ["Stack", "Queue", "Tree", "Graph"], "answer": "Queue"},
+        {"question": "Which sorting algorithm is the fastest in the average case?", "options": ["QuickSort", "BubbleSort", "MergeSort", "SelectionSort"], "answer": "QuickSort"},
+        {"question": "What is the space complexity of merge sort?", "options": ["O(1)", "O(n)", "O(n log n)", "O(log n)"], "answer": "O(n)"},
+        {"question": "Which data structure is used for recursion?", "options": ["Stack", "Queue", "Array", "Linked List"], "answer": "Stack"}
+    ]
+}
+
+
+# Quiz type -> quiz name in the compiled bundle (quiz_bundle.py). Without a
+# bundle the built-in QUESTIONS above are used.
+QUIZ_NAMES = {'1': "Python Quiz", '2': "DBMS Quiz", '3': "DSA Quiz"}
+bundle = quiz_bundle.open_bundle()
+
+
+def load_quiz(quiz_choice):
+    # [(question, options, answer index)] of quiz type 1/2/3, None if there's no such type
+    name = QUIZ_NAMES.get(quiz_choice)
+    if name is None:
+        return None
+    if bundle is not None:
+        quiz_id = bundle.find(name)
+        if quiz_id is not None:
+            return bundle.questions(quiz_id)
+    return [(q['question'], q['options'], q['options'].index(q['answer']))
+            for q in QUESTIONS[name.split()[0].lower()]]
+
+
 def start_quiz(email):
     print("\nChoose quiz type:")
     print("1. Python")
     print("2. DBMS")
     print("3. DSA")
     quiz_choice = input("Enter your choice (1, 2, or 3): ")
-    questions = {
-        "python": [
-            {"question": "What is the output of 2 + 2?", "options": ["4", "5", "6", "3"], "answer": "4"},
-            {"question": "Which of the following is a mutable data type?", "options": ["List", "Tuple", "Set", "String"], "answer": "List"},
-            {"question": "What is the correct syntax for a function in Python?", "options": ["def function_name():", "function function_name():", "function():", "def: function_name"], "answer": "def function_name():"},
-            {"question": "Which of the following is a Python keyword?", "options": ["if", "yes", "none", "foreach"], "answer": "if"},
-            {"question": "What is the default return value of a function in Python?", "options": ["None", "0", "1", "null"], "answer": "None"}
-        ],
-        "dbms": [
-            {"question": "What does DBMS stand for?", "options": ["Database Management System", "Data Base Management System", "Database Managed System", "Data Base Managed System"], "answer": "Database Management System"},
-            {"question": "Which is not a DBMS model?", "options": ["Network Model", "Hierarchical Model", "Relational Model", "Tree Model"], "answer": "Tree Model"},
-            {"question": "What is normalization?", "options": ["Process of reducing redundancy", "Process of creating tables", "Process of defining relations", "Process of deleting records"], "answer": "Process of reducing redundancy"},
-            {"question": "Which of the following is a relational database?", "options": ["MySQL", "MongoDB", "PostgreSQL", "Both MySQL and PostgreSQL"], "answer": "Both MySQL and PostgreSQL"},
-            {"question": "Which SQL command is used to retrieve data from a database?", "options": ["SELECT", "INSERT", "UPDATE", "DELETE"], "answer": "SELECT"}
-        ],
-        "dsa": [
-            {"question": "What is the time complexity of binary search?", "options": ["O(n)", "O(log n)", "O(n^2)", "O(1)"], "answer": "O(log n)"},
-            {"question": "Which data structure is used to implement a breadth-first search?", "options": ["Stack", "Queue", "Tree", "Graph"], "answer": "Queue"},
-            {"question": "Which sorting algorithm is the fastest in the average case?", "options": ["QuickSort", "BubbleSort", "MergeSort", "SelectionSort"], "answer": "QuickSort"},
-            {"question": "What is the space complexity of merge sort?", "options": ["O(1)", "O(n)", "O(n log n)", "O(log n)"], "answer": "O(n)"},
-            {"question": "Which data structure is used for recursion?", "options": ["Stack", "Queue", "Array", "Linked List"], "answer": "Stack"}
-        ]
-    }
-    if quiz_choice == '1':
-        quiz = questions["python"]
-    elif quiz_choice == '2':
-        quiz = questions["dbms"]
-    elif quiz_choice == '3':
-        quiz = questions["dsa"]
-    else:
+    quiz = load_quiz(quiz_choice)
+    if quiz is None:
         print("Invalid choice.")
         return
     score = 0
-    for idx, question in enumerate(quiz):
-        print(f"\nQ{idx + 1}: {question['question']}")
-        for i, option in enumerate(question['options'], start=1):
+    for idx, (question, options, answer) in enumerate(quiz):
+        print(f"\nQ{idx + 1}: {question}")
+        for i, option in enumerate(options, start=1):
             print(f"{i}. {option}")
-        answer = input("Enter the option number: ")
-        if question['options'][int(answer) - 1] == question['answer']:
+        answer_no = input("Enter the option number: ")
+        if int(answer_no) - 1 == answer:
             score += 1
-    print(f"\nYou scored {score} out of 5.")
+    print(f"\nYou scored {score} out of {len(quiz)}.")
     with open(result_file, 'a') as result_file_obj:
-        result_file_obj.write(f"Email: {email}\nQuiz Type: {quiz_choice}\nScore: {score}/5\n\n")
+        result_file_obj.write(f"Email: {email}\nQuiz Type: {quiz_choice}\nScore: {score}/{len(quiz)}\n\n")
 
 
 def show_result():
@@ -167,12 +186,12 @@ def show_result():
         return
     with open(result_file, 'r') as file:
         records = file.read()
-    email_results = re.findall(rf"Email: {email}\nQuiz Type: (\d+)\nScore: (\d+)/5", records)
+    email_results = re.findall(rf"Email: {email}\nQuiz Type: (\d+)\nScore: (\d+/\d+)", records)
     if email_results:
         print(f"Results for {email}:")
         for quiz_type, score in email_results:
             quiz_name = {"1": "Python", "2": "DBMS", "3": "DSA"}.get(quiz_type, "Unknown")
-            print(f"Quiz Type: {quiz_name}, Score: {score}/5")
+            print(f"Quiz Type: {quiz_name}, Score: {score}")
     else:
         print("No quiz attempts found for this email.")
 